@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import time
+from calendar import monthrange
+from collections.abc import Iterable
+from datetime import UTC, date, datetime, timedelta
+
+from app.sheets import AsyncSheetsClient, SheetEntry, parse_entry
+from app.storage import AsyncSQLiteStateStore, Reminder
+
+logger = logging.getLogger("golden-dent")
+
+_DIGEST_VERSION = 2
+
+
+class AppointmentsMirror:
+    def __init__(
+        self,
+        store: AsyncSQLiteStateStore,
+        sheets: AsyncSheetsClient,
+        tab_name: str,
+        block_size: int = 200,
+        min_refresh_interval: float = 60.0,
+    ) -> None:
+        self._store = store
+        self._sheets = sheets
+        self._tab_name = tab_name
+        self._block_size = block_size
+        self._min_refresh_interval = min_refresh_interval
+        self._last_refresh: float | None = None
+
+    @property
+    def tab_name(self) -> str:
+        return self._tab_name
+
+    async def refresh(self, force: bool = False) -> int:
+        now = time.monotonic()
+        if (
+            not force
+            and self._last_refresh is not None
+            and now - self._last_refresh < self._min_refresh_interval
+        ):
+            return 0
+
+        # The spreadsheet-wide lastUpdateTime moves on every append the bot makes to other
+        # tabs, so change detection relies on the per-block digests of this tab alone.
+        stored_digests = await self._store.appointment_digests(self._tab_name)
+        rows = await self._sheets.get_values(self._tab_name, "A2:B")
+        block_count = (len(rows) + self._block_size - 1) // self._block_size
+        digests: dict[int, str] = {}
+        blocks: dict[int, list[tuple[int, datetime, str]]] = {}
+        reminders: dict[int, list[tuple[int, str, date]]] = {}
+        for block in range(block_count):
+            start = block * self._block_size
+            chunk = rows[start : start + self._block_size]
+            digest = _block_digest(self._block_size, chunk)
+            if stored_digests.get(block) == digest:
+                continue
+            digests[block] = digest
+            blocks[block] = [
+                (start + offset, entry.dt, entry.username)
+                for offset, row in enumerate(chunk)
+                if (entry := parse_entry(row))
+            ]
+            reminders[block] = [
+                (row_index, kind, fire_date)
+                for row_index, dt, _ in blocks[block]
+                for kind, fire_date in reminder_fire_dates(dt.date())
+            ]
+
+        await self._store.replace_appointment_blocks(
+            self._tab_name,
+            self._block_size,
+            blocks,
+            digests,
+            block_count,
+            datetime.now(UTC),
+            reminders,
+        )
+        self._last_refresh = now
+        logger.info(
+            "Appointments mirror %s refreshed: %d rows, %d of %d blocks changed",
+            self._tab_name,
+            len(rows),
+            len(blocks),
+            block_count,
+        )
+        return len(blocks)
+
+    async def entries_on(self, dates: Iterable[date]) -> list[SheetEntry]:
+        rows = await self._store.list_appointments(self._tab_name, dates)
+        return [SheetEntry(dt=row.dt, username=row.username) for row in rows]
+
+    async def all_entries(self) -> list[SheetEntry]:
+        rows = await self._store.list_appointments(self._tab_name)
+        return [SheetEntry(dt=row.dt, username=row.username) for row in rows]
+
+    async def due_between(self, since: date, until: date) -> list[Reminder]:
+        return await self._store.list_reminders(self._tab_name, since, until)
+
+    async def reminders(self) -> list[Reminder]:
+        return await self._store.list_reminders(self._tab_name)
+
+
+def reminder_fire_dates(appointment_date: date) -> list[tuple[str, date]]:
+    return [
+        ("appointment", appointment_date - timedelta(days=1)),
+        ("6m", six_month_fire_date(appointment_date)),
+    ]
+
+
+def six_month_fire_date(appointment_date: date) -> date:
+    # Six months after the 29th-31st may not exist; clip to the last day of that month.
+    month_index = appointment_date.month - 1 + 6
+    year, month = appointment_date.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(appointment_date.day, monthrange(year, month)[1]))
+
+
+def _block_digest(block_size: int, rows: list[list[str]]) -> str:
+    payload = json.dumps(
+        [_DIGEST_VERSION, block_size, [row[:2] for row in rows]], ensure_ascii=False
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import dataclass, field
+
+logger = logging.getLogger("golden-dent")
+
+
+@dataclass
+class BroadcastJob:
+    chat_key: str
+    send: Callable[[], Awaitable[bool]]
+
+
+@dataclass
+class BroadcastStats:
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: float | None = None
+
+    @property
+    def duration(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+    @property
+    def rate(self) -> float:
+        duration = self.duration
+        return self.sent / duration if duration > 0 else 0.0
+
+    @classmethod
+    def merge(cls, parts: Iterable[BroadcastStats]) -> BroadcastStats:
+        parts = list(parts)
+        if not parts:
+            return cls(finished_at=time.monotonic())
+        finished = [part.finished_at for part in parts if part.finished_at is not None]
+        return cls(
+            total=sum(part.total for part in parts),
+            sent=sum(part.sent for part in parts),
+            failed=sum(part.failed for part in parts),
+            started_at=min(part.started_at for part in parts),
+            finished_at=max(finished) if finished else None,
+        )
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    attempts: int = 4
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+    jitter: float = 0.1
+
+
+class TokenBucket:
+    def __init__(
+        self, rate: float, capacity: float | None = None, parent: TokenBucket | None = None
+    ) -> None:
+        self._rate = rate
+        self._capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._parent = parent
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float) -> None:
+        # Telegram's flood limit is per bot, so a RetryAfter pauses every shard of the engine.
+        if self._parent is not None:
+            self._parent.pause(seconds)
+            return
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _resume_at(self) -> float:
+        return self._parent._resume_at() if self._parent is not None else self._paused_until
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                paused = self._resume_at() - now
+                if paused > 0:
+                    await asyncio.sleep(paused)
+                    continue
+                self._tokens = min(
+                    self._capacity, self._tokens + (now - self._updated) * self._rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class BroadcastEngine:
+    def __init__(
+        self,
+        rate_per_second: float = 25.0,
+        concurrency: int = 16,
+        per_chat_interval: float = 1.0,
+        bucket: TokenBucket | None = None,
+        retry_policy: RetryPolicy | None = None,
+    ) -> None:
+        self._rate_per_second = rate_per_second
+        self._bucket = bucket or TokenBucket(rate_per_second)
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._concurrency = max(concurrency, 1)
+        self._per_chat_interval = per_chat_interval
+
+    @property
+    def bucket(self) -> TokenBucket:
+        return self._bucket
+
+    @property
+    def retry_policy(self) -> RetryPolicy:
+        return self._retry_policy
+
+    def shard(self, count: int) -> BroadcastEngine:
+        return BroadcastEngine(
+            rate_per_second=self._rate_per_second / count,
+            concurrency=max(self._concurrency // count, 1),
+            per_chat_interval=self._per_chat_interval,
+            bucket=TokenBucket(self._rate_per_second / count, parent=self._bucket),
+            retry_policy=self._retry_policy,
+        )
+
+    async def run(self, jobs: Iterable[BroadcastJob], name: str = "broadcast") -> BroadcastStats:
+        groups: dict[str, list[Callable[[], Awaitable[bool]]]] = {}
+        for job in jobs:
+            groups.setdefault(job.chat_key, []).append(job.send)
+
+        stats = BroadcastStats(total=sum(len(sends) for sends in groups.values()))
+        pending = deque(groups.values())
+        workers = [
+            asyncio.create_task(self._worker(pending, stats))
+            for _ in range(min(self._concurrency, len(pending)))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            stats.finished_at = time.monotonic()
+
+        logger.info(
+            "%s finished: %d sent, %d failed of %d in %.2fs (%.1f msg/s)",
+            name,
+            stats.sent,
+            stats.failed,
+            stats.total,
+            stats.duration,
+            stats.rate,
+        )
+        return stats
+
+    async def _worker(
+        self, pending: deque[list[Callable[[], Awaitable[bool]]]], stats: BroadcastStats
+    ) -> None:
+        while pending:
+            sends = pending.popleft()
+            for index, send in enumerate(sends):
+                if index:
+                    await asyncio.sleep(self._per_chat_interval)
+                await self._bucket.acquire()
+                try:
+                    delivered = await send()
+                except Exception:
+                    logger.exception("Broadcast send failed")
+                    delivered = False
+                if delivered:
+                    stats.sent += 1
+                else:
+                    stats.failed += 1
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+from difflib import SequenceMatcher
+
+from app.sheets import AsyncSheetsClient, ColumnEdit, clients_column
+from app.storage import AsyncSQLiteStateStore
+
+logger = logging.getLogger("golden-dent")
+
+
+class ClientsSheetSync:
+    def __init__(
+        self,
+        store: AsyncSQLiteStateStore,
+        sheets: AsyncSheetsClient,
+        tab_name: str,
+        debounce: float = 5.0,
+        reconcile_interval: float = 3600.0,
+        poll_interval: float = 0.0,
+        active: bool = True,
+    ) -> None:
+        self._store = store
+        self._sheets = sheets
+        self._tab_name = tab_name
+        self._debounce = debounce
+        self._reconcile_interval = reconcile_interval
+        self._poll_interval = poll_interval
+        self.active = active
+        self._column: list[str] | None = None
+        self._dirty = False
+        self._lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+        self._reconcile_task: asyncio.Task | None = None
+        self._poll_task: asyncio.Task | None = None
+
+    def mark_dirty(self) -> None:
+        self._dirty = True
+        if not self.active:
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if self._column is None:
+                await self._reconcile_locked()
+                return
+            usernames = await self._store.list_client_usernames()
+            target = clients_column(self._column, usernames)
+            edits = column_edits(self._column, target)
+            if not edits:
+                return
+            try:
+                await self._sheets.apply_column_edits(self._tab_name, edits)
+            except Exception:
+                self._column = None
+                raise
+            self._column = target
+
+    async def reconcile(self) -> None:
+        async with self._lock:
+            await self._reconcile_locked()
+
+    async def _reconcile_locked(self) -> None:
+        self._column = None
+        usernames = await self._store.list_client_usernames()
+        self._column = await self._sheets.sync_client_usernames(self._tab_name, usernames)
+
+    def start(self) -> None:
+        if self._reconcile_task is None:
+            self._reconcile_task = asyncio.create_task(self._reconcile_periodically())
+        if self._poll_interval > 0 and self._poll_task is None:
+            self._poll_task = asyncio.create_task(self._poll_periodically())
+
+    async def stop(self) -> None:
+        for task in (self._flush_task, self._reconcile_task, self._poll_task):
+            if task is None:
+                continue
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._flush_task = None
+        self._reconcile_task = None
+        self._poll_task = None
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self._debounce)
+        while self._dirty:
+            self._dirty = False
+            try:
+                await self.flush()
+            except Exception as exc:
+                logger.warning("Failed to sync clients sheet %s: %s", self._tab_name, exc)
+                return
+
+    async def _reconcile_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception as exc:
+                logger.warning("Failed to reconcile clients sheet %s: %s", self._tab_name, exc)
+
+    async def _poll_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._poll_interval)
+            try:
+                await self.flush()
+            except Exception as exc:
+                logger.warning("Failed to sync clients sheet %s: %s", self._tab_name, exc)
+
+
+def column_edits(existing: list[str], target: list[str]) -> list[ColumnEdit]:
+    matcher = SequenceMatcher(a=existing, b=target, autojunk=False)
+    return [
+        ColumnEdit(start=i1, delete_count=i2 - i1, values=target[j1:j2])
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
@@ -1,4 +1,6 @@
-﻿from pydantic_settings import BaseSettings, SettingsConfigDict
+﻿from typing import Literal
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
@@ -9,6 +11,12 @@ class Settings(BaseSettings):
     webhook_path: str = "/webhook"
     webhook_secret_token: str | None = None
     set_webhook: bool = True
+    admin_chat_id: int | None = None
+    webhook_queue_size: int = 1000
+    webhook_workers: int = 8
+    webhook_enqueue_timeout_seconds: float = 1.0
+    update_dedup_capacity: int = 10_000
+    update_dedup_flush_interval_seconds: float = 5.0
 
     google_sheet_id: str
     google_service_account_json: str
@@ -16,9 +24,37 @@ class Settings(BaseSettings):
     google_appointments_tab: str = "Записи для бота"
     google_undelivered_tab: str = "Не доставлено"
     google_clients_tab: str = "БД - клиенты"
+    sheets_max_workers: int = 4
+    sheets_timeout_seconds: float = 30.0
+    sheets_worksheet_ttl_seconds: float = 600.0
+    outbox_batch_size: int = 100
+    outbox_flush_interval_seconds: float = 5.0
+    clients_sync_debounce_seconds: float = 5.0
+    clients_reconcile_interval_seconds: float = 3600.0
+    clients_sync_poll_interval_seconds: float = 30.0
+    appointments_refresh_interval_seconds: float = 60.0
 
     tz: str = "Asia/Novosibirsk"
     daily_reminder_hour: int = 9
     daily_reminder_minute: int = 0
+    reminder_catch_up_days: int = 3
+    appointment_reminder_mode: Literal["daily", "exact"] = "daily"
+    appointment_reminder_offset_minutes: int = 24 * 60
+    scheduler_misfire_grace_seconds: int = 24 * 60 * 60
+    scheduler_poll_interval_seconds: float = 10.0
+    leader_lease_ttl_seconds: float = 10.0
+    leader_heartbeat_seconds: float = 3.0
+
+    broadcast_rate_per_second: float = 25.0
+    broadcast_concurrency: int = 16
+    broadcast_per_chat_interval: float = 1.0
+    daily_shards: int = 1
+    delivery_max_attempts: int = 4
+    delivery_backoff_base_seconds: float = 1.0
+    delivery_backoff_max_seconds: float = 60.0
 
     data_dir: str = "/data"
+    sqlite_read_workers: int = 4
+    user_cache_size: int = 10_000
+    user_touch_batch_size: int = 500
+    user_touch_interval_seconds: float = 300.0
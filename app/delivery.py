@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import warnings
+from collections.abc import Awaitable, Callable
+from datetime import UTC, date, datetime, timedelta
+from functools import partial
+from typing import TypeVar
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import (
+    BadRequest,
+    ChatMigrated,
+    Forbidden,
+    InvalidToken,
+    NetworkError,
+    RetryAfter,
+    TelegramError,
+)
+from telegram.warnings import PTBDeprecationWarning
+
+from app.broadcast import BroadcastEngine, RetryPolicy, TokenBucket
+from app.messages import send_main_message
+from app.outbox import SheetsOutbox
+from app.storage import AsyncSQLiteStateStore
+
+logger = logging.getLogger("golden-dent")
+
+T = TypeVar("T")
+
+RETRY_AFTER = "retry_after"
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+DELIVERY_LEASE_SECONDS = 60 * 60
+
+
+class DeliveryError(Exception):
+    def __init__(self, error: TelegramError, category: str, attempts: int) -> None:
+        super().__init__(str(error))
+        self.error = error
+        self.category = category
+        self.attempts = attempts
+
+
+def classify_error(exc: TelegramError) -> str:
+    if isinstance(exc, RetryAfter):
+        return RETRY_AFTER
+    # BadRequest is a NetworkError subclass in python-telegram-bot, so check it first.
+    if isinstance(exc, BadRequest | Forbidden | ChatMigrated | InvalidToken):
+        return PERMANENT
+    if isinstance(exc, NetworkError):
+        return TRANSIENT
+    return PERMANENT
+
+
+def retry_delay(
+    exc: TelegramError, attempt: int, policy: RetryPolicy, rng: random.Random | None = None
+) -> float:
+    rng = rng or random
+    if isinstance(exc, RetryAfter):
+        with warnings.catch_warnings():
+            # Both the int and the timedelta form of retry_after are handled below.
+            warnings.simplefilter("ignore", PTBDeprecationWarning)
+            retry_after = exc.retry_after
+        seconds = (
+            retry_after.total_seconds()
+            if isinstance(retry_after, timedelta)
+            else float(retry_after)
+        )
+        return seconds * (1 + rng.uniform(0, policy.jitter)) + rng.uniform(0, policy.base_delay)
+    ceiling = min(policy.max_delay, policy.base_delay * 2 ** (attempt - 1))
+    return ceiling / 2 + rng.uniform(0, ceiling / 2)
+
+
+async def send_with_retry(
+    send: Callable[[], Awaitable[T]],
+    policy: RetryPolicy | None = None,
+    bucket: TokenBucket | None = None,
+) -> T:
+    policy = policy or RetryPolicy()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return await send()
+        except TelegramError as exc:
+            category = classify_error(exc)
+            if category == PERMANENT or attempt >= policy.attempts:
+                raise DeliveryError(exc, category, attempt) from exc
+            delay = retry_delay(exc, attempt, policy)
+            logger.info(
+                "Send attempt %d failed (%s: %s), retrying in %.1fs",
+                attempt,
+                category,
+                exc,
+                delay,
+            )
+            if bucket is not None and category == RETRY_AFTER:
+                bucket.pause(delay)
+            await asyncio.sleep(delay)
+            # The first attempt spends the caller's token; each retry takes its own.
+            if bucket is not None:
+                await bucket.acquire()
+
+
+async def deliver(
+    store: AsyncSQLiteStateStore,
+    run_date: date,
+    username: str,
+    kind: str,
+    send: Callable[[], Awaitable[str]],
+) -> bool:
+    status = "failed"
+    try:
+        status = await send()
+    finally:
+        await store.mark_delivery(run_date, username, kind, status, datetime.now(UTC))
+    return status == "sent"
+
+
+async def send_appointment_message(
+    bot,
+    store: AsyncSQLiteStateStore,
+    outbox: SheetsOutbox,
+    undelivered_tab: str,
+    username: str,
+    dt: datetime,
+    zone,
+    chat_id: int | None,
+    ledger: tuple[date, str] | None = None,
+    record: bool = True,
+    engine: BroadcastEngine | None = None,
+) -> str:
+    local_dt = dt.replace(tzinfo=zone) if dt.tzinfo is None else dt.astimezone(zone)
+    date_str = local_dt.strftime("%d.%m.%Y")
+    time_str = local_dt.strftime("%H:%M")
+    day = _relative_day(local_dt.date(), datetime.now(zone).date())
+    text = (
+        f"Здравствуйте! Вы записаны {day}"
+        f"{date_str}г в клинику «Голден Дент» на прием в {time_str} 🕥"
+    )
+    keyboard = InlineKeyboardMarkup(
+        [
+            [InlineKeyboardButton("Подтвердить запись", callback_data="confirm_appt")],
+            [InlineKeyboardButton("Перенести запись", url="https://t.me/GoldenDentNSK")],
+        ]
+    )
+    fallback = username if username.startswith("@") or username.isdigit() else f"@{username}"
+    try:
+        await send_with_retry(
+            partial(
+                bot.send_message, chat_id=chat_id or fallback, text=text, reply_markup=keyboard
+            ),
+            *_throttle(engine),
+        )
+    except DeliveryError as exc:
+        return await _handle_undelivered(
+            store,
+            outbox,
+            undelivered_tab,
+            zone,
+            username,
+            "appointment",
+            chat_id,
+            {"dt": dt.isoformat()},
+            exc,
+            ledger,
+            record,
+        )
+    return "sent"
+
+
+def _throttle(engine: BroadcastEngine | None) -> tuple[RetryPolicy | None, TokenBucket | None]:
+    return (engine.retry_policy, engine.bucket) if engine is not None else (None, None)
+
+
+def _relative_day(day: date, today: date) -> str:
+    if day == today:
+        return "на сегодня "
+    if day == today + timedelta(days=1):
+        return "на завтра "
+    return ""
+
+
+async def send_6m_message(
+    bot,
+    store: AsyncSQLiteStateStore,
+    outbox: SheetsOutbox,
+    undelivered_tab: str,
+    username: str,
+    zone,
+    chat_id: int | None,
+    ledger: tuple[date, str] | None = None,
+    record: bool = True,
+    engine: BroadcastEngine | None = None,
+) -> str:
+    fallback = username if username.startswith("@") or username.isdigit() else f"@{username}"
+    try:
+        await send_with_retry(
+            partial(send_main_message, bot, chat_id or fallback),
+            *_throttle(engine),
+        )
+    except DeliveryError as exc:
+        return await _handle_undelivered(
+            store, outbox, undelivered_tab, zone, username, "6m", chat_id, {}, exc, ledger, record
+        )
+    return "sent"
+
+
+async def _handle_undelivered(
+    store: AsyncSQLiteStateStore,
+    outbox: SheetsOutbox,
+    undelivered_tab: str,
+    zone,
+    username: str,
+    kind: str,
+    chat_id: int | None,
+    payload: dict,
+    exc: DeliveryError,
+    ledger: tuple[date, str] | None = None,
+    record: bool = True,
+) -> str:
+    logger.warning(
+        "Failed to send %s reminder to %s after %d attempt(s): %s",
+        kind,
+        username,
+        exc.attempts,
+        exc.error,
+    )
+    if ledger is not None:
+        # Replay settles the same ledger row, so the dead letter remembers which one it is.
+        payload = {**payload, "run_date": ledger[0].isoformat(), "ledger_kind": ledger[1]}
+    if record:
+        await store.add_dead_letter(
+            kind,
+            username,
+            chat_id,
+            payload,
+            exc.category,
+            str(exc.error),
+            exc.attempts,
+            datetime.now(UTC),
+        )
+        if "Chat not found" in str(exc.error):
+            await _log_undelivered(outbox, undelivered_tab, zone, username, kind, str(exc.error))
+    # Permanent failures are "rejected" so later runs do not reclaim and resend them.
+    return "rejected" if exc.category == PERMANENT else "failed"
+
+
+async def _log_undelivered(
+    outbox: SheetsOutbox,
+    undelivered_tab: str,
+    zone,
+    username: str,
+    kind: str,
+    reason: str,
+) -> None:
+    now = datetime.now(zone)
+    now_str = now.strftime("%d.%m.%Y %H:%M")
+    await outbox.enqueue(undelivered_tab, [now_str, username, kind, reason], now)
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
+logger = logging.getLogger("golden-dent")
+
+
+class LeaderLease:
+    def __init__(
+        self,
+        data_dir: str,
+        name: str = "leader",
+        ttl: float = 10.0,
+        holder: str | None = None,
+    ) -> None:
+        self._path = Path(data_dir) / "leader.sqlite"
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS lease (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def try_acquire(self, now: float | None = None) -> bool:
+        now = time.time() if now is None else now
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT holder, expires_at FROM lease WHERE name=?", (self.name,)
+                ).fetchone()
+                if row is not None and row[0] != self.holder and row[1] > now:
+                    return False
+                conn.execute(
+                    """
+                    INSERT INTO lease (name, holder, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET
+                        holder=excluded.holder,
+                        expires_at=excluded.expires_at
+                    """,
+                    (self.name, self.holder, now + self.ttl),
+                )
+                return True
+            finally:
+                conn.execute("COMMIT")
+
+    def release(self) -> None:
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("DELETE FROM lease WHERE name=? AND holder=?", (self.name, self.holder))
+
+    def current_holder(self, now: float | None = None) -> str | None:
+        now = time.time() if now is None else now
+        with contextlib.closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT holder, expires_at FROM lease WHERE name=?", (self.name,)
+            ).fetchone()
+        return row[0] if row and row[1] > now else None
+
+
+class LeaderElection:
+    def __init__(
+        self,
+        lease: LeaderLease,
+        on_elected: Callable[[], Awaitable[None]],
+        on_demoted: Callable[[], Awaitable[None]],
+        heartbeat: float = 3.0,
+    ) -> None:
+        self._lease = lease
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        self._heartbeat = heartbeat
+        self._task: asyncio.Task | None = None
+        self.is_leader = False
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        if self.is_leader:
+            await self._set_leader(False)
+            await asyncio.to_thread(self._lease.release)
+
+    async def step(self) -> bool:
+        try:
+            acquired = await asyncio.to_thread(self._lease.try_acquire)
+        except Exception:
+            logger.exception("Failed to renew leader lease %s", self._lease.name)
+            acquired = False
+        if acquired != self.is_leader:
+            await self._set_leader(acquired)
+        return acquired
+
+    async def _set_leader(self, leader: bool) -> None:
+        self.is_leader = leader
+        logger.info(
+            "%s %s leadership of %s",
+            self._lease.holder,
+            "acquired" if leader else "lost",
+            self._lease.name,
+        )
+        try:
+            await (self._on_elected() if leader else self._on_demoted())
+        except Exception:
+            logger.exception("Leadership transition handler failed")
+
+    async def _run(self) -> None:
+        while True:
+            await self.step()
+            await asyncio.sleep(self._heartbeat)
@@ -1,14 +1,36 @@
-﻿import logging
+﻿import asyncio
+import contextlib
+import logging
 from contextlib import asynccontextmanager
+from datetime import timedelta
+from functools import partial
 
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from telegram import Update
 
+from app.appointments import AppointmentsMirror
+from app.broadcast import BroadcastEngine, RetryPolicy
+from app.clients_sync import ClientsSheetSync
 from app.config import Settings
-from app.scheduler import build_scheduler, schedule_daily_messages
-from app.sheets import SheetsClient
-from app.storage import SQLiteStateStore
+from app.leader import LeaderElection, LeaderLease
+from app.metrics import REGISTRY, UPDATE_QUEUE_DEPTH
+from app.outbox import SheetsOutbox
+from app.reminders import ExactAppointmentReminders
+from app.scheduler import (
+    bind_bot,
+    build_scheduler,
+    catch_up_daily_messages,
+    daily_kinds,
+    schedule_daily_messages,
+    schedule_jobstore_poll,
+    stop_daily_runs,
+)
+from app.sheets import AsyncSheetsClient, SheetsClient
+from app.startup import StartupTimer
+from app.storage import AsyncSQLiteStateStore, SQLiteStateStore, UserStateCache
 from app.telegram_bot import build_application
+from app.updates import UpdateDeduplicator, UpdateQueue
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("golden-dent")
@@ -16,22 +38,67 @@ logger = logging.getLogger("golden-dent")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    timer = StartupTimer()
+    app.state.startup = timer
+    app.state.warmup_done = False
     config = Settings()
     app.state.config = config
-    app.state.sheets = SheetsClient(config.google_sheet_id, config.google_service_account_json)
-    app.state.store = SQLiteStateStore(config.data_dir)
-    try:
-        app.state.sheets.sync_client_usernames(
-            config.google_clients_tab,
-            app.state.store.list_client_usernames(),
-        )
-    except Exception as exc:
-        logger.warning(
-            "Failed to sync clients sheet %s on startup: %s",
-            config.google_clients_tab,
-            exc,
-        )
-    app.state.scheduler = build_scheduler(config.data_dir, config.tz)
+    # Connecting to Google happens in _warm_up; nothing here may wait on the Sheets API.
+    app.state.sheets = AsyncSheetsClient(
+        max_workers=config.sheets_max_workers,
+        timeout=config.sheets_timeout_seconds,
+        factory=partial(
+            SheetsClient,
+            config.google_sheet_id,
+            config.google_service_account_json,
+            worksheet_ttl=config.sheets_worksheet_ttl_seconds,
+        ),
+    )
+    timer.mark("config")
+    app.state.store = AsyncSQLiteStateStore(
+        SQLiteStateStore(config.data_dir), read_workers=config.sqlite_read_workers
+    )
+    app.state.user_cache = UserStateCache(
+        app.state.store,
+        maxsize=config.user_cache_size,
+        touch_batch_size=config.user_touch_batch_size,
+        touch_interval=config.user_touch_interval_seconds,
+    )
+    app.state.outbox = SheetsOutbox(
+        app.state.store,
+        app.state.sheets,
+        batch_size=config.outbox_batch_size,
+        interval=config.outbox_flush_interval_seconds,
+    )
+    app.state.appointments = AppointmentsMirror(
+        app.state.store,
+        app.state.sheets,
+        config.google_appointments_tab,
+        min_refresh_interval=config.appointments_refresh_interval_seconds,
+    )
+    app.state.clients_sync = ClientsSheetSync(
+        app.state.store,
+        app.state.sheets,
+        config.google_clients_tab,
+        debounce=config.clients_sync_debounce_seconds,
+        reconcile_interval=config.clients_reconcile_interval_seconds,
+        poll_interval=config.clients_sync_poll_interval_seconds,
+        active=False,
+    )
+    app.state.broadcast = BroadcastEngine(
+        rate_per_second=config.broadcast_rate_per_second,
+        concurrency=config.broadcast_concurrency,
+        per_chat_interval=config.broadcast_per_chat_interval,
+        retry_policy=RetryPolicy(
+            attempts=config.delivery_max_attempts,
+            base_delay=config.delivery_backoff_base_seconds,
+            max_delay=config.delivery_backoff_max_seconds,
+        ),
+    )
+    app.state.scheduler = build_scheduler(
+        config.data_dir, config.tz, config.scheduler_misfire_grace_seconds
+    )
+    timer.mark("sqlite")
 
     application = build_application(
         config.bot_token,
@@ -40,49 +107,207 @@ async def lifespan(app: FastAPI):
         app.state.store,
         app.state.scheduler,
         config,
+        app.state.outbox,
+        app.state.clients_sync,
+        app.state.user_cache,
+        app.state.appointments,
+        app.state.broadcast,
     )
     app.state.application = application
+    bind_bot(application.bot)
 
     await application.initialize()
     await application.start()
+    timer.mark("telegram")
+    app.state.update_queue = UpdateQueue(
+        application.process_update,
+        maxsize=config.webhook_queue_size,
+        workers=config.webhook_workers,
+        put_timeout=config.webhook_enqueue_timeout_seconds,
+    )
+    app.state.update_queue.start()
+    UPDATE_QUEUE_DEPTH.set_callback(lambda: app.state.update_queue.stats()["queue_depth"])
+    app.state.dedup = UpdateDeduplicator(
+        app.state.store,
+        capacity=config.update_dedup_capacity,
+        flush_interval=config.update_dedup_flush_interval_seconds,
+    )
+    await app.state.dedup.load()
+    app.state.dedup.start()
     app.state.polling_enabled = False
-
-    if config.set_webhook and config.webhook_url:
-        webhook_url = config.webhook_url.rstrip("/") + config.webhook_path
-        await application.bot.set_webhook(
-            url=webhook_url,
-            secret_token=config.webhook_secret_token,
-            drop_pending_updates=True,
-        )
-        logger.info("Webhook set to %s", webhook_url)
-    else:
-        if application.updater is None:
-            logger.warning("Updater is not available, polling disabled")
-        else:
-            await application.updater.start_polling(drop_pending_updates=True)
-            app.state.polling_enabled = True
-            logger.info("Polling started")
+    if not (config.set_webhook and config.webhook_url) and application.updater is not None:
+        application.add_handler(app.state.dedup.handler(), group=-1)
+    timer.mark("updates")
 
     schedule_daily_messages(
         app.state.scheduler,
         application.bot,
-        app.state.sheets,
-        config.google_appointments_tab,
+        app.state.appointments,
         config.google_undelivered_tab,
         config.tz,
         config.daily_reminder_hour,
         config.daily_reminder_minute,
         app.state.store,
+        app.state.outbox,
+        app.state.broadcast,
+        config.daily_shards,
+        daily_kinds(config.appointment_reminder_mode),
+        config.reminder_catch_up_days,
+    )
+    app.state.exact_reminders = None
+    if config.appointment_reminder_mode == "exact":
+        app.state.exact_reminders = ExactAppointmentReminders(
+            application.bot,
+            app.state.appointments,
+            app.state.store,
+            app.state.outbox,
+            config.google_undelivered_tab,
+            config.tz,
+            timedelta(minutes=config.appointment_reminder_offset_minutes),
+            app.state.broadcast,
+            reload_interval=config.appointments_refresh_interval_seconds,
+            daily_hour=config.daily_reminder_hour,
+            daily_minute=config.daily_reminder_minute,
+        )
+    schedule_jobstore_poll(app.state.scheduler, config.scheduler_poll_interval_seconds)
+    app.state.scheduler.start(paused=True)
+    timer.mark("scheduler")
+    app.state.election = LeaderElection(
+        LeaderLease(config.data_dir, ttl=config.leader_lease_ttl_seconds),
+        on_elected=lambda: _become_leader(app),
+        on_demoted=lambda: _step_down(app),
+        heartbeat=config.leader_heartbeat_seconds,
     )
-    app.state.scheduler.start()
+    app.state.clients_reconcile = None
+    app.state.daily_catch_up = None
+    await app.state.election.step()
+    app.state.election.start()
+    timer.mark("leader")
+    timer.log(
+        "Startup critical path finished",
+        ["config", "sqlite", "telegram", "updates", "scheduler", "leader"],
+    )
+    app.state.warmup = asyncio.create_task(_warm_up(app))
 
     yield
 
+    app.state.warmup.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await app.state.warmup
+    await app.state.election.stop()
     app.state.scheduler.shutdown(wait=False)
-    if app.state.polling_enabled and app.state.application.updater is not None:
-        await app.state.application.updater.stop()
+    await app.state.update_queue.stop()
+    await app.state.dedup.stop()
     await application.stop()
     await application.shutdown()
+    app.state.sheets.shutdown()
+    await app.state.user_cache.flush()
+    app.state.store.close()
+
+
+async def _become_leader(app: FastAPI) -> None:
+    config = app.state.config
+    application = app.state.application
+    app.state.clients_sync.active = True
+    app.state.clients_reconcile = asyncio.create_task(_reconcile_clients(app))
+    app.state.clients_sync.start()
+    app.state.outbox.start()
+    app.state.scheduler.resume()
+    if app.state.exact_reminders is not None:
+        app.state.exact_reminders.start()
+    app.state.daily_catch_up = asyncio.create_task(_catch_up_daily(app))
+
+    if config.set_webhook and config.webhook_url:
+        webhook_url = config.webhook_url.rstrip("/") + config.webhook_path
+        await application.bot.set_webhook(
+            url=webhook_url,
+            secret_token=config.webhook_secret_token,
+            drop_pending_updates=False,
+        )
+        logger.info("Webhook set to %s", webhook_url)
+    elif application.updater is None:
+        logger.warning("Updater is not available, polling disabled")
+    else:
+        await application.updater.start_polling(drop_pending_updates=False)
+        app.state.polling_enabled = True
+        logger.info("Polling started")
+
+
+async def _step_down(app: FastAPI) -> None:
+    app.state.scheduler.pause()
+    if app.state.daily_catch_up is not None:
+        app.state.daily_catch_up.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await app.state.daily_catch_up
+        app.state.daily_catch_up = None
+    await stop_daily_runs()
+    if app.state.exact_reminders is not None:
+        await app.state.exact_reminders.stop()
+    if app.state.polling_enabled:
+        await app.state.application.updater.stop()
+        app.state.polling_enabled = False
+    await app.state.outbox.stop()
+    app.state.clients_sync.active = False
+    if app.state.clients_reconcile is not None:
+        app.state.clients_reconcile.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await app.state.clients_reconcile
+        app.state.clients_reconcile = None
+    await app.state.clients_sync.stop()
+
+
+async def _catch_up_daily(app: FastAPI) -> None:
+    config = app.state.config
+    try:
+        await catch_up_daily_messages(
+            app.state.application.bot,
+            app.state.appointments,
+            config.google_undelivered_tab,
+            config.tz,
+            config.daily_reminder_hour,
+            config.daily_reminder_minute,
+            app.state.store,
+            app.state.outbox,
+            app.state.broadcast,
+            config.daily_shards,
+            daily_kinds(config.appointment_reminder_mode),
+            config.reminder_catch_up_days,
+        )
+    except Exception:
+        logger.exception("Failed to catch up daily messages")
+
+
+async def _reconcile_clients(app: FastAPI) -> None:
+    try:
+        with app.state.startup.phase("clients_sync"):
+            await app.state.clients_sync.reconcile()
+    except Exception as exc:
+        logger.warning(
+            "Failed to sync clients sheet %s on startup: %s",
+            app.state.config.google_clients_tab,
+            exc,
+        )
+
+
+async def _warm_up(app: FastAPI, max_delay: float = 60.0) -> None:
+    timer: StartupTimer = app.state.startup
+    delay = 1.0
+    while True:
+        try:
+            with timer.phase("sheets_connect"):
+                await app.state.sheets.connect()
+            break
+        except Exception as exc:
+            logger.warning("Failed to connect to Google Sheets, retrying in %.0fs: %s", delay, exc)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
+    try:
+        with timer.phase("appointments_mirror"):
+            await app.state.appointments.refresh()
+    except Exception as exc:
+        logger.warning("Failed to warm up appointments mirror: %s", exc)
+    app.state.warmup_done = True
+    timer.log("Sheets warm-up finished", ["sheets_connect", "appointments_mirror"])
 
 
 app = FastAPI(lifespan=lifespan)
@@ -90,7 +315,39 @@ app = FastAPI(lifespan=lifespan)
 
 @app.get("/health")
 async def health() -> dict:
-    return {"status": "ok"}
+    return {"status": "ok", "leader": app.state.election.is_leader}
+
+
+@app.get("/ready")
+async def ready() -> JSONResponse:
+    sheets_ready = app.state.sheets.ready
+    ready = sheets_ready and app.state.warmup_done
+    return JSONResponse(
+        {
+            "status": "ready" if ready else "starting",
+            "sheets": sheets_ready,
+            "leader": app.state.election.is_leader,
+            "startup_seconds": app.state.startup.phases,
+        },
+        status_code=200 if ready else 503,
+    )
+
+
+@app.get("/stats")
+async def stats() -> dict:
+    return {
+        "outbox": await app.state.outbox.stats(),
+        "dead_letters": await app.state.store.dead_letter_counts(),
+        "updates": {
+            **app.state.update_queue.stats(),
+            "duplicates_total": app.state.dedup.duplicates_total,
+        },
+    }
+
+
+@app.get("/metrics")
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 
 def _validate_secret(request: Request) -> None:
@@ -100,22 +357,36 @@ def _validate_secret(request: Request) -> None:
         raise HTTPException(status_code=403, detail="Invalid secret token")
 
 
+async def _enqueue_update(request: Request) -> dict:
+    try:
+        update_data = await request.json()
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Invalid JSON") from exc
+    if not isinstance(update_data, dict) or not update_data:
+        raise HTTPException(status_code=400, detail="Empty update")
+    update_id = update_data.get("update_id")
+    if not isinstance(update_id, int):
+        raise HTTPException(status_code=400, detail="Missing update_id")
+    if not await app.state.dedup.claim(update_id):
+        return {"ok": True}
+    try:
+        update = Update.de_json(update_data, app.state.application.bot)
+    except Exception as exc:
+        raise HTTPException(status_code=400, detail="Invalid update") from exc
+    if not await app.state.update_queue.submit(update):
+        await app.state.dedup.release(update_id)
+        raise HTTPException(status_code=503, detail="Update queue is full")
+    return {"ok": True}
+
+
 @app.post("/webhook")
 async def telegram_webhook(request: Request):
     _validate_secret(request)
-    update_data = await request.json()
-    if not update_data:
-        raise HTTPException(status_code=400, detail="Empty update")
-    update = Update.de_json(update_data, app.state.application.bot)
-    await app.state.application.process_update(update)
-    return {"ok": True}
+    return await _enqueue_update(request)
 
 
 @app.post("/webhook/{token}")
 async def telegram_webhook_token(request: Request, token: str):
     if token != app.state.config.bot_token:
         raise HTTPException(status_code=403, detail="Invalid token")
-    update_data = await request.json()
-    update = Update.de_json(update_data, app.state.application.bot)
-    await app.state.application.process_update(update)
-    return {"ok": True}
+    return await _enqueue_update(request)
@@ -1,8 +1,13 @@
+import hashlib
 import logging
+from datetime import UTC, datetime
 from pathlib import Path
 from urllib.parse import quote
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Message
+from telegram.error import BadRequest
+
+from app.storage import AsyncSQLiteStateStore
 
 logger = logging.getLogger("golden-dent")
 
@@ -217,6 +222,56 @@ def build_flash_contact_keyboard() -> InlineKeyboardMarkup:
     return _build_offer_actions_keyboard(FLASH_CONTACT_URL)
 
 
+_INVALID_FILE_ID_MARKERS = ("file identifier", "file_id", "failed to get http url content")
+
+
+class PhotoFileIdCache:
+    def __init__(self, store: AsyncSQLiteStateStore) -> None:
+        self._store = store
+        self._hashes: dict[Path, tuple[int, int, str]] = {}
+        self._file_ids: dict[str, str] = {}
+
+    def content_hash(self, path: Path) -> str:
+        stat = path.stat()
+        cached = self._hashes.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        self._hashes[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    async def send_photo(self, bot, chat_id: int, path: Path, **kwargs) -> Message:
+        digest = self.content_hash(path)
+        file_id = self._file_ids.get(digest) or await self._store.get_media_file_id(digest)
+        if file_id:
+            try:
+                return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+            except BadRequest as exc:
+                if not any(marker in str(exc).lower() for marker in _INVALID_FILE_ID_MARKERS):
+                    raise
+                logger.info("Cached file_id for %s was rejected, re-uploading: %s", path, exc)
+                self._file_ids.pop(digest, None)
+                await self._store.delete_media_file_id(digest)
+
+        with path.open("rb") as photo:
+            message = await bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+        if message.photo:
+            file_id = message.photo[-1].file_id
+            self._file_ids[digest] = file_id
+            await self._store.set_media_file_id(digest, file_id, datetime.now(UTC))
+        return message
+
+
+async def _send_photo(
+    bot, chat_id: int, path: Path, photo_cache: PhotoFileIdCache | None, **kwargs
+) -> None:
+    if photo_cache is not None:
+        await photo_cache.send_photo(bot, chat_id, path, **kwargs)
+        return
+    with path.open("rb") as photo:
+        await bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+
+
 async def send_main_message(bot, chat_id: int) -> None:
     await bot.send_message(chat_id=chat_id, text=MAIN_MESSAGE, reply_markup=build_main_keyboard())
 
@@ -225,15 +280,18 @@ async def send_start_message(bot, chat_id: int) -> None:
     await bot.send_message(chat_id=chat_id, text=START_MESSAGE, reply_markup=build_main_keyboard())
 
 
-async def send_info_start_message(bot, chat_id: int) -> None:
+async def send_info_start_message(
+    bot, chat_id: int, photo_cache: PhotoFileIdCache | None = None
+) -> None:
     if _LOGO_PATH.exists():
-        with _LOGO_PATH.open("rb") as logo:
-            await bot.send_photo(
-                chat_id=chat_id,
-                photo=logo,
-                caption=INFO_START_MESSAGE,
-                reply_markup=build_info_start_keyboard(),
-            )
+        await _send_photo(
+            bot,
+            chat_id,
+            _LOGO_PATH,
+            photo_cache,
+            caption=INFO_START_MESSAGE,
+            reply_markup=build_info_start_keyboard(),
+        )
         return
 
     logger.warning("Start logo file not found: %s", _LOGO_PATH)
@@ -244,15 +302,18 @@ async def send_info_start_message(bot, chat_id: int) -> None:
     )
 
 
-async def send_special_offers_message(bot, chat_id: int) -> None:
+async def send_special_offers_message(
+    bot, chat_id: int, photo_cache: PhotoFileIdCache | None = None
+) -> None:
     if _SPECIAL_SUG_PATH.exists():
-        with _SPECIAL_SUG_PATH.open("rb") as image:
-            await bot.send_photo(
-                chat_id=chat_id,
-                photo=image,
-                caption=SPECIAL_OFFERS_HEADER,
-                reply_markup=build_special_offers_keyboard(),
-            )
+        await _send_photo(
+            bot,
+            chat_id,
+            _SPECIAL_SUG_PATH,
+            photo_cache,
+            caption=SPECIAL_OFFERS_HEADER,
+            reply_markup=build_special_offers_keyboard(),
+        )
         return
 
     logger.warning("Special offers image file not found: %s", _SPECIAL_SUG_PATH)
@@ -263,10 +324,11 @@ async def send_special_offers_message(bot, chat_id: int) -> None:
     )
 
 
-async def send_about_message(bot, chat_id: int) -> None:
+async def send_about_message(
+    bot, chat_id: int, photo_cache: PhotoFileIdCache | None = None
+) -> None:
     if _ABOUT_PHOTO_PATH.exists():
-        with _ABOUT_PHOTO_PATH.open("rb") as image:
-            await bot.send_photo(chat_id=chat_id, photo=image, caption=ABOUT_TEXT)
+        await _send_photo(bot, chat_id, _ABOUT_PHOTO_PATH, photo_cache, caption=ABOUT_TEXT)
         return
 
     logger.warning("About image file not found: %s", _ABOUT_PHOTO_PATH)
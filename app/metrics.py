@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import functools
+import math
+import os
+import threading
+import time
+from collections.abc import Callable, Iterable
+from contextlib import contextmanager
+from typing import TypeVar
+
+from telegram.request import BaseRequest
+
+M = TypeVar("M", bound="_Metric")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple[str, ...]) -> tuple[tuple[str, str], ...]:
+        return tuple(zip(self.labelnames, key, strict=True))
+
+    def _samples(self) -> list[tuple[str, tuple[tuple[str, str], ...], float]]:
+        raise NotImplementedError
+
+    def render(self, const_labels: tuple[tuple[str, str], ...] = ()) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self._samples():
+            labels = (*const_labels, *labels)
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [("", self._labels(key), value) for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        callback: Callable[[], float] | None = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_callback(self, callback: Callable[[], float] | None) -> None:
+        self._callback = callback
+
+    def _samples(self):
+        if self._callback is not None:
+            return [("", (), float(self._callback()))]
+        with self._lock:
+            items = sorted(self._values.items())
+        return [("", self._labels(key), value) for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: dict[tuple[str, ...], tuple[list[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(v[0]), v[1], v[2])) for key, v in self._values.items())
+        samples = []
+        for key, (counts, total, count) in items:
+            labels = self._labels(key)
+            for bound, bucket_count in zip(self.buckets, counts, strict=True):
+                samples.append(("_bucket", (*labels, ("le", _format_value(bound))), bucket_count))
+            samples.append(("_bucket", (*labels, ("le", "+Inf")), count))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+        return samples
+
+
+class Registry:
+    def __init__(self, worker_label: str | None = None) -> None:
+        self._metrics: list[_Metric] = []
+        self._worker_label = worker_label
+
+    def register(self, metric: M) -> M:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        # Every uvicorn worker keeps its own registry, so samples carry the worker's pid.
+        const_labels = ((self._worker_label, str(os.getpid())),) if self._worker_label else ()
+        return "\n".join(metric.render(const_labels) for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry(worker_label="worker")
+
+HANDLER_LATENCY = REGISTRY.register(
+    Histogram("golden_dent_handler_seconds", "Telegram handler latency.", ["handler"])
+)
+HANDLER_ERRORS = REGISTRY.register(
+    Counter("golden_dent_handler_errors_total", "Telegram handler exceptions.", ["handler"])
+)
+SHEETS_LATENCY = REGISTRY.register(
+    Histogram("golden_dent_sheets_seconds", "Google Sheets call latency.", ["method"])
+)
+SHEETS_CALLS = REGISTRY.register(
+    Counter("golden_dent_sheets_calls_total", "Google Sheets calls.", ["method", "outcome"])
+)
+STORE_LATENCY = REGISTRY.register(
+    Histogram(
+        "golden_dent_store_seconds",
+        "SQLite state store operation latency.",
+        ["operation"],
+        buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+    )
+)
+TELEGRAM_LATENCY = REGISTRY.register(
+    Histogram("golden_dent_telegram_seconds", "Telegram Bot API request latency.", ["method"])
+)
+DAILY_RUN_DURATION = REGISTRY.register(
+    Gauge("golden_dent_daily_run_duration_seconds", "Duration of the last daily run.")
+)
+DAILY_RUN_RATE = REGISTRY.register(
+    Gauge("golden_dent_daily_run_send_rate", "Messages per second of the last daily run.")
+)
+DAILY_RUN_MESSAGES = REGISTRY.register(
+    Counter("golden_dent_daily_run_messages_total", "Daily run messages.", ["outcome"])
+)
+UPDATE_QUEUE_WAIT = REGISTRY.register(
+    Histogram("golden_dent_update_queue_wait_seconds", "Time updates wait in the queue.")
+)
+UPDATE_QUEUE_DEPTH = REGISTRY.register(
+    Gauge("golden_dent_update_queue_depth", "Updates waiting in the webhook queue.")
+)
+STARTUP_PHASE_SECONDS = REGISTRY.register(
+    Gauge("golden_dent_startup_phase_seconds", "Duration of startup phases.", ["phase"])
+)
+
+
+def timed_handler(callback: Callable) -> Callable:
+    name = getattr(callback, "__name__", type(callback).__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
+
+    return wrapper
+
+
+class TimedRequest(BaseRequest):
+    def __init__(self, request: BaseRequest) -> None:
+        self._request = request
+
+    @property
+    def read_timeout(self) -> float | None:
+        return self._request.read_timeout
+
+    async def initialize(self) -> None:
+        await self._request.initialize()
+
+    async def shutdown(self) -> None:
+        await self._request.shutdown()
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> tuple[int, bytes]:
+        with TELEGRAM_LATENCY.time(method=url.rsplit("/", 1)[-1]):
+            return await self._request.do_request(url, method, *args, **kwargs)
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    pairs = (f'{name}="{_escape(value)}"' for name, value in labels)
+    return "{" + ",".join(pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
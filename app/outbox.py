@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+from datetime import UTC, datetime
+
+from app.sheets import AsyncSheetsClient
+from app.storage import AsyncSQLiteStateStore
+
+logger = logging.getLogger("golden-dent")
+
+_MAX_BACKOFF_SECONDS = 300.0
+
+
+class SheetsOutbox:
+    def __init__(
+        self,
+        store: AsyncSQLiteStateStore,
+        sheets: AsyncSheetsClient,
+        batch_size: int = 100,
+        interval: float = 5.0,
+    ) -> None:
+        self._store = store
+        self._sheets = sheets
+        self._batch_size = batch_size
+        self._interval = interval
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.flushed_total = 0
+        self.failed_total = 0
+        self.last_flush_at: datetime | None = None
+
+    async def enqueue(self, tab: str, row: list[str], created_at: datetime) -> None:
+        await self._store.enqueue_sheet_row(tab, row, created_at)
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+    async def flush(self) -> tuple[int, int]:
+        flushed = 0
+        failed = 0
+        for tab in await self._store.list_outbox_tabs():
+            while True:
+                items = await self._store.list_outbox(tab, self._batch_size)
+                if not items:
+                    break
+                try:
+                    await self._sheets.append_rows(tab, [item.row for item in items])
+                except Exception as exc:
+                    logger.warning(
+                        "Failed to flush %d rows to sheet %s: %s", len(items), tab, exc
+                    )
+                    failed += 1
+                    break
+                await self._store.delete_outbox([item.id for item in items])
+                flushed += len(items)
+                if len(items) < self._batch_size:
+                    break
+
+        self.flushed_total += flushed
+        self.failed_total += failed
+        if flushed:
+            self.last_flush_at = datetime.now(UTC)
+        return flushed, failed
+
+    async def stats(self) -> dict:
+        depth, oldest = await self._store.outbox_stats()
+        lag = 0.0
+        if oldest:
+            lag = max(
+                (datetime.now(UTC) - datetime.fromisoformat(oldest)).total_seconds(),
+                0.0,
+            )
+        return {
+            "queue_depth": depth,
+            "flush_lag_seconds": round(lag, 3),
+            "flushed_total": self.flushed_total,
+            "failed_total": self.failed_total,
+            "last_flush_at": self.last_flush_at.isoformat() if self.last_flush_at else None,
+        }
+
+    async def _run(self) -> None:
+        delay = self._interval
+        while True:
+            self._wakeup.clear()
+            try:
+                _, failed = await self.flush()
+            except Exception:
+                logger.exception("Sheets outbox flush crashed")
+                failed = 1
+            if failed:
+                delay = min(delay * 2, _MAX_BACKOFF_SECONDS)
+                await asyncio.sleep(delay)
+                continue
+            delay = self._interval
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), delay)
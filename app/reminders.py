@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import time
+import uuid
+from collections.abc import Hashable
+from datetime import UTC, date, datetime, timedelta
+from functools import partial
+from zoneinfo import ZoneInfo
+
+from app.appointments import AppointmentsMirror
+from app.broadcast import BroadcastEngine, BroadcastJob
+from app.delivery import DELIVERY_LEASE_SECONDS, deliver, send_appointment_message
+from app.outbox import SheetsOutbox
+from app.sheets import SheetEntry
+from app.storage import AsyncSQLiteStateStore, _normalize_username
+
+logger = logging.getLogger("golden-dent")
+
+
+class TimerHeap:
+    def __init__(self) -> None:
+        self._heap: list[tuple[float, int, Hashable]] = []
+        self._live: dict[Hashable, tuple[float, int, object]] = {}
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._live
+
+    def keys(self) -> set[Hashable]:
+        return set(self._live)
+
+    def push(self, key: Hashable, when: float, payload: object) -> None:
+        current = self._live.get(key)
+        if current is not None and current[0] == when:
+            self._live[key] = (when, current[1], payload)
+            return
+        seq = next(self._seq)
+        self._live[key] = (when, seq, payload)
+        heapq.heappush(self._heap, (when, seq, key))
+
+    def discard(self, key: Hashable) -> None:
+        self._live.pop(key, None)
+
+    def next_deadline(self) -> float | None:
+        self._prune()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> list[tuple[Hashable, object]]:
+        due = []
+        while self._prune() and self._heap[0][0] <= now:
+            _, _, key = heapq.heappop(self._heap)
+            due.append((key, self._live.pop(key)[2]))
+        return due
+
+    def _prune(self) -> bool:
+        # Rescheduled and cancelled timers stay in the heap until they reach the top.
+        while self._heap:
+            when, seq, key = self._heap[0]
+            live = self._live.get(key)
+            if live is not None and live[1] == seq:
+                return True
+            heapq.heappop(self._heap)
+        return False
+
+
+class ExactAppointmentReminders:
+    def __init__(
+        self,
+        bot,
+        appointments: AppointmentsMirror,
+        store: AsyncSQLiteStateStore,
+        outbox: SheetsOutbox,
+        undelivered_tab: str,
+        tz: str,
+        offset: timedelta,
+        engine: BroadcastEngine | None = None,
+        reload_interval: float = 60.0,
+        max_sleep: float = 30.0,
+        daily_hour: int = 9,
+        daily_minute: int = 0,
+    ) -> None:
+        self._bot = bot
+        self._appointments = appointments
+        self._store = store
+        self._outbox = outbox
+        self._undelivered_tab = undelivered_tab
+        self._zone = ZoneInfo(tz)
+        self._offset = offset
+        self._engine = engine or BroadcastEngine()
+        self._reload_interval = reload_interval
+        self._max_sleep = max_sleep
+        self._daily_hour = daily_hour
+        self._daily_minute = daily_minute
+        self._timers = TimerHeap()
+        self._fired: set[tuple[str, str]] = set()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._timers)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def reload(self, now: datetime | None = None) -> int:
+        try:
+            await self._appointments.refresh()
+        except Exception as exc:
+            logger.warning("Failed to refresh appointments mirror, using cached rows: %s", exc)
+
+        now = now or datetime.now(self._zone)
+        horizon = now + self._offset + timedelta(seconds=2 * self._reload_interval)
+        # Date-only rows fire the day before, so look one day past the horizon.
+        span = (horizon.date() - now.date()).days + 1
+        days = [now.date() + timedelta(days=offset) for offset in range(span + 1)]
+        wanted: dict[tuple[str, str], tuple[float, date, str, SheetEntry]] = {}
+        for entry in await self._appointments.entries_on(days):
+            local = _localize(entry.dt, self._zone)
+            if local.hour == local.minute == local.second == 0:
+                # Rows without a time parse as midnight; remind at the daily hour the day before.
+                fire_at = local.replace(
+                    hour=self._daily_hour, minute=self._daily_minute
+                ) - timedelta(days=1)
+                ends = local + timedelta(days=1)
+            else:
+                fire_at = local - self._offset
+                ends = local
+            if ends <= now or fire_at > horizon:
+                continue
+            key = (_normalize_username(entry.username), local.isoformat())
+            kind = f"appointment {local:%Y-%m-%d %H:%M}"
+            wanted[key] = (max(fire_at, now).timestamp(), fire_at.date(), kind, entry)
+
+        self._fired &= wanted.keys()
+        for key in self._timers.keys() - wanted.keys():
+            self._timers.discard(key)
+        for key, (when, run_date, kind, entry) in wanted.items():
+            if key not in self._fired:
+                self._timers.push(key, when, (run_date, kind, entry))
+        self._wakeup.set()
+        return len(self._timers)
+
+    async def fire_due(self, now: float | None = None) -> int:
+        due = self._timers.pop_due(time.time() if now is None else now)
+        if not due:
+            return 0
+        by_date: dict[date, dict[tuple[str, str], SheetEntry]] = {}
+        for key, (run_date, kind, entry) in due:
+            self._fired.add(key)
+            by_date.setdefault(run_date, {})[(key[0], kind)] = entry
+
+        jobs: list[BroadcastJob] = []
+        run_id = uuid.uuid4().hex
+        for run_date, by_key in by_date.items():
+            claimed = await self._store.claim_deliveries(
+                run_date, by_key, run_id, datetime.now(UTC), DELIVERY_LEASE_SECONDS
+            )
+            chat_ids = await self._store.get_chat_ids(username for username, _ in claimed)
+            for chat_key, kind in claimed:
+                entry = by_key[(chat_key, kind)]
+                send = partial(
+                    send_appointment_message,
+                    self._bot,
+                    self._store,
+                    self._outbox,
+                    self._undelivered_tab,
+                    entry.username,
+                    entry.dt,
+                    self._zone,
+                    chat_ids.get(chat_key),
+                    ledger=(run_date, kind),
+                    engine=self._engine,
+                )
+                jobs.append(
+                    BroadcastJob(
+                        chat_key=chat_key,
+                        send=partial(deliver, self._store, run_date, chat_key, kind, send),
+                    )
+                )
+        if jobs:
+            await self._engine.run(jobs, name="Exact appointment reminders")
+        return len(jobs)
+
+    async def _run(self) -> None:
+        next_reload = 0.0
+        while True:
+            if time.monotonic() >= next_reload:
+                try:
+                    await self.reload()
+                except Exception:
+                    logger.exception("Failed to load exact appointment reminders")
+                next_reload = time.monotonic() + self._reload_interval
+            try:
+                await self.fire_due()
+            except Exception:
+                logger.exception("Exact appointment reminders failed")
+
+            timeout = min(self._max_sleep, next_reload - time.monotonic())
+            deadline = self._timers.next_deadline()
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.time())
+            self._wakeup.clear()
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), max(timeout, 0.0))
+
+
+def _localize(dt: datetime, zone: ZoneInfo) -> datetime:
+    return dt.replace(tzinfo=zone) if dt.tzinfo is None else dt.astimezone(zone)
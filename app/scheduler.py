@@ -1,37 +1,140 @@
 from __future__ import annotations
 
+import asyncio
 import logging
-from datetime import datetime, timedelta
+import sqlite3
+import uuid
+import zlib
+from collections.abc import Awaitable, Callable, Collection, Iterable
+from datetime import UTC, date, datetime, timedelta
+from functools import partial
+from pathlib import Path
 from zoneinfo import ZoneInfo
 
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from dateutil.relativedelta import relativedelta
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.error import TelegramError
+from sqlalchemy import create_engine, event
 
-from app.messages import send_main_message
-from app.sheets import SheetsClient
-from app.storage import SQLiteStateStore
+from app.appointments import AppointmentsMirror
+from app.broadcast import BroadcastEngine, BroadcastJob, BroadcastStats
+from app.delivery import (
+    DELIVERY_LEASE_SECONDS,
+    deliver,
+    send_6m_message,
+    send_appointment_message,
+)
+from app.messages import send_main_message, send_start_message
+from app.metrics import DAILY_RUN_DURATION, DAILY_RUN_MESSAGES, DAILY_RUN_RATE
+from app.outbox import SheetsOutbox
+from app.sheets import SheetEntry
+from app.storage import AsyncSQLiteStateStore, DeadLetter, _normalize_username
 
 logger = logging.getLogger("golden-dent")
 
+PERSISTENT_JOBSTORE = "persistent"
 
-def build_scheduler(data_dir: str, tz: str) -> AsyncIOScheduler:
-    scheduler = AsyncIOScheduler(timezone=ZoneInfo(tz))
+_daily_run_lock = asyncio.Lock()
+
+_daily_runs: set[asyncio.Task] = set()
+
+_job_runtime: dict[str, object] = {}
+
+
+def build_scheduler(
+    data_dir: str, tz: str, misfire_grace_seconds: int = 24 * 60 * 60
+) -> AsyncIOScheduler:
+    path = Path(data_dir) / "jobs.sqlite"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    engine = create_engine(f"sqlite:///{path}")
+    event.listen(engine, "connect", _configure_sqlite)
+
+    scheduler = AsyncIOScheduler(
+        jobstores={
+            "default": MemoryJobStore(),
+            PERSISTENT_JOBSTORE: SQLAlchemyJobStore(engine=engine),
+        },
+        job_defaults={"coalesce": True, "misfire_grace_time": misfire_grace_seconds},
+        timezone=ZoneInfo(tz),
+    )
     return scheduler
 
 
+def _configure_sqlite(dbapi_conn: sqlite3.Connection, _record) -> None:
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.close()
+
+
+def schedule_jobstore_poll(scheduler: AsyncIOScheduler, interval_seconds: float) -> None:
+    scheduler.add_job(
+        _poll_jobstores,
+        trigger="interval",
+        seconds=interval_seconds,
+        id="jobstore_poll",
+        replace_existing=True,
+    )
+
+
+async def _poll_jobstores() -> None:
+    # No-op: each run wakes the scheduler so it sees jobs other workers wrote to the jobstore.
+    return None
+
+
+def bind_bot(bot) -> None:
+    _job_runtime["bot"] = bot
+
+
+def schedule_start_followup(
+    scheduler: AsyncIOScheduler, user_id: int, chat_id: int, run_date: datetime
+) -> None:
+    scheduler.add_job(
+        send_start_followup,
+        trigger="date",
+        run_date=run_date,
+        id=f"start_followup_{user_id}",
+        replace_existing=True,
+        jobstore=PERSISTENT_JOBSTORE,
+        args=[chat_id],
+    )
+
+
+def schedule_2w_reminder(scheduler: AsyncIOScheduler, chat_id: int, run_date: datetime) -> None:
+    scheduler.add_job(
+        send_2w_reminder,
+        trigger="date",
+        run_date=run_date,
+        id=f"remind_{chat_id}",
+        replace_existing=True,
+        jobstore=PERSISTENT_JOBSTORE,
+        args=[chat_id],
+    )
+
+
+async def send_start_followup(chat_id: int) -> None:
+    await send_start_message(_job_runtime["bot"], chat_id)
+
+
+async def send_2w_reminder(chat_id: int) -> None:
+    await send_main_message(_job_runtime["bot"], chat_id)
+
+
 def schedule_daily_messages(
     scheduler: AsyncIOScheduler,
     bot,
-    sheets: SheetsClient,
-    appointments_tab: str,
+    appointments: AppointmentsMirror,
     undelivered_tab: str,
     tz: str,
     hour: int,
     minute: int,
-    store: SQLiteStateStore,
+    store: AsyncSQLiteStateStore,
+    outbox: SheetsOutbox,
+    engine: BroadcastEngine | None = None,
+    shards: int = 1,
+    kinds: Collection[str] | None = None,
+    catch_up_days: int = 0,
 ) -> None:
     trigger = CronTrigger(hour=hour, minute=minute, timezone=ZoneInfo(tz))
     scheduler.add_job(
@@ -39,103 +142,377 @@ def schedule_daily_messages(
         trigger=trigger,
         id="daily_messages",
         replace_existing=True,
-        args=[bot, sheets, appointments_tab, undelivered_tab, tz, store],
+        args=[bot, appointments, undelivered_tab, tz, store, outbox, engine, shards],
+        kwargs={"kinds": kinds, "catch_up_days": catch_up_days},
     )
 
 
 async def send_daily_messages(
-    bot, sheets: SheetsClient, tab_name: str, undelivered_tab: str, tz: str, store: SQLiteStateStore
-) -> None:
-    zone = ZoneInfo(tz)
-    today = datetime.now(zone).date()
-    tomorrow = today + timedelta(days=1)
-
-    for entry in sheets.iter_entries(tab_name):
-        entry_date = entry.dt.date()
-
-        if entry_date == tomorrow:
-            await _send_appointment_message(
-                bot, sheets, undelivered_tab, entry.username, entry.dt, zone, store
+    bot,
+    appointments: AppointmentsMirror,
+    undelivered_tab: str,
+    tz: str,
+    store: AsyncSQLiteStateStore,
+    outbox: SheetsOutbox,
+    engine: BroadcastEngine | None = None,
+    shards: int = 1,
+    only_shards: Iterable[int] | None = None,
+    kinds: Collection[str] | None = None,
+    catch_up_days: int = 0,
+) -> BroadcastStats:
+    task = asyncio.current_task()
+    _daily_runs.add(task)
+    try:
+        async with _daily_run_lock:
+            return await _send_daily_messages(
+                bot,
+                appointments,
+                undelivered_tab,
+                tz,
+                store,
+                outbox,
+                engine,
+                shards,
+                only_shards,
+                kinds,
+                catch_up_days,
             )
-            continue
+    finally:
+        _daily_runs.discard(task)
+
 
-        if entry_date + relativedelta(months=+6) == today:
-            await _send_6m_message(bot, sheets, undelivered_tab, entry.username, zone, store)
+async def stop_daily_runs() -> None:
+    tasks = [task for task in _daily_runs if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
 
 
-async def _send_appointment_message(
+async def catch_up_daily_messages(
     bot,
-    sheets: SheetsClient,
+    appointments: AppointmentsMirror,
     undelivered_tab: str,
-    username: str,
-    dt: datetime,
-    zone,
-    store: SQLiteStateStore,
-) -> None:
-    local_dt = dt.replace(tzinfo=zone) if dt.tzinfo is None else dt.astimezone(zone)
-    date_str = local_dt.strftime("%d.%m.%Y")
-    time_str = local_dt.strftime("%H:%M")
-    text = (
-        "Здравствуйте! Вы записаны на завтра "
-        f"{date_str}г в клинику «Голден Дент» на прием в {time_str} 🕥"
-    )
-    keyboard = InlineKeyboardMarkup(
-        [
-            [InlineKeyboardButton("Подтвердить запись", callback_data="confirm_appt")],
-            [InlineKeyboardButton("Перенести запись", url="https://t.me/GoldenDentNSK")],
-        ]
+    tz: str,
+    hour: int,
+    minute: int,
+    store: AsyncSQLiteStateStore,
+    outbox: SheetsOutbox,
+    engine: BroadcastEngine | None = None,
+    shards: int = 1,
+    kinds: Collection[str] | None = None,
+    catch_up_days: int = 0,
+) -> BroadcastStats | None:
+    now = datetime.now(ZoneInfo(tz))
+    if (now.hour, now.minute) < (hour, minute):
+        return None
+    finished = await store.list_daily_shards(now.date())
+    if len(finished) >= max(shards, 1) and all(shard.status == "done" for shard in finished):
+        return None
+    logger.info("Daily messages for %s did not finish, catching up", now.date())
+    # The cron job lives in memory and will not fire again today. Claims still held by
+    # another run keep their lease; a process that died leaves them to a later run.
+    return await send_daily_messages(
+        bot,
+        appointments,
+        undelivered_tab,
+        tz,
+        store,
+        outbox,
+        engine,
+        shards,
+        kinds=kinds,
+        catch_up_days=catch_up_days,
     )
-    chat_id = store.get_chat_id(username)
-    fallback = username if username.startswith("@") or username.isdigit() else f"@{username}"
+
+
+async def _send_daily_messages(
+    bot,
+    appointments: AppointmentsMirror,
+    undelivered_tab: str,
+    tz: str,
+    store: AsyncSQLiteStateStore,
+    outbox: SheetsOutbox,
+    engine: BroadcastEngine | None,
+    shards: int,
+    only_shards: Iterable[int] | None,
+    kinds: Collection[str] | None,
+    catch_up_days: int,
+) -> BroadcastStats:
+    zone = ZoneInfo(tz)
+    now = datetime.now(zone)
+    today = now.date()
+
     try:
-        await bot.send_message(chat_id=chat_id or fallback, text=text, reply_markup=keyboard)
-    except TelegramError as exc:
-        logger.warning("Failed to send appointment to %s: %s", fallback, exc)
-        if "Chat not found" in str(exc):
-            _log_undelivered(
-                sheets,
+        await appointments.refresh()
+    except Exception as exc:
+        logger.warning("Failed to refresh appointments mirror, using cached rows: %s", exc)
+
+    # Reminders missed while the bot was down stay due for catch_up_days; the ledger is
+    # keyed by fire date, so the ones already sent are not claimed again. Days before the
+    # first recorded run have no ledger rows to tell, so they are never caught up.
+    first_run = await store.first_daily_run()
+    since = max(today - timedelta(days=max(catch_up_days, 0)), first_run or today)
+    shards = max(shards, 1)
+    partitions: list[dict[tuple[date, str, str], SheetEntry]] = [{} for _ in range(shards)]
+    for reminder in await appointments.due_between(since, today):
+        if kinds is not None and reminder.kind not in kinds:
+            continue
+        if reminder.kind == "appointment" and _appointment_passed(reminder.dt, now):
+            continue
+        chat_key = _normalize_username(reminder.username)
+        partitions[shard_of(chat_key, shards)].setdefault(
+            (reminder.fire_date, chat_key, reminder.kind),
+            SheetEntry(dt=reminder.dt, username=reminder.username),
+        )
+
+    selected = sorted(set(range(shards) if only_shards is None else only_shards))
+    engine = engine or BroadcastEngine()
+    results = await asyncio.gather(
+        *(
+            _run_daily_shard(
+                bot,
                 undelivered_tab,
                 zone,
-                username,
-                "appointment",
-                str(exc),
+                store,
+                outbox,
+                engine.shard(len(selected)) if len(selected) > 1 else engine,
+                today,
+                shard,
+                shards,
+                partitions[shard],
             )
-        return
+            for shard in selected
+        ),
+        return_exceptions=True,
+    )
+    stats = BroadcastStats.merge(
+        result for result in results if isinstance(result, BroadcastStats)
+    )
+    DAILY_RUN_DURATION.set(stats.duration)
+    DAILY_RUN_RATE.set(stats.rate)
+    DAILY_RUN_MESSAGES.inc(stats.sent, outcome="sent")
+    DAILY_RUN_MESSAGES.inc(stats.failed, outcome="failed")
+    return stats
+
+
+def daily_kinds(reminder_mode: str) -> tuple[str, ...]:
+    # In exact mode appointment reminders are sent by app.reminders, not the daily run.
+    return ("6m",) if reminder_mode == "exact" else ("appointment", "6m")
 
 
-async def _send_6m_message(
+def shard_of(chat_key: str, shards: int) -> int:
+    return zlib.crc32(chat_key.encode("utf-8")) % shards
+
+
+def _appointment_passed(dt: datetime, now: datetime) -> bool:
+    local = dt.replace(tzinfo=now.tzinfo) if dt.tzinfo is None else dt.astimezone(now.tzinfo)
+    if local.hour == local.minute == local.second == 0:
+        # Date-only rows parse as midnight and stay current for the whole day.
+        return local.date() < now.date()
+    return local <= now
+
+
+async def _run_daily_shard(
     bot,
-    sheets: SheetsClient,
     undelivered_tab: str,
-    username: str,
-    zone,
-    store: SQLiteStateStore,
-) -> None:
-    chat_id = store.get_chat_id(username)
-    fallback = username if username.startswith("@") or username.isdigit() else f"@{username}"
+    zone: ZoneInfo,
+    store: AsyncSQLiteStateStore,
+    outbox: SheetsOutbox,
+    engine: BroadcastEngine,
+    today: date,
+    shard: int,
+    shards: int,
+    by_key: dict[tuple[date, str, str], SheetEntry],
+) -> BroadcastStats:
+    await store.start_daily_shard(today, shard, shards, datetime.now(UTC))
+    run_id = uuid.uuid4().hex
     try:
-        await send_main_message(bot, chat_id or fallback)
-    except TelegramError as exc:
-        logger.warning("Failed to send 6m reminder to %s: %s", fallback, exc)
-        if "Chat not found" in str(exc):
-            _log_undelivered(
-                sheets,
+        by_date: dict[date, list[tuple[str, str]]] = {}
+        for fire_date, chat_key, kind in by_key:
+            by_date.setdefault(fire_date, []).append((chat_key, kind))
+        claimed: list[tuple[date, str, str]] = []
+        for fire_date, keys in sorted(by_date.items()):
+            claimed_keys = await store.claim_deliveries(
+                fire_date,
+                keys,
+                run_id,
+                datetime.now(UTC),
+                DELIVERY_LEASE_SECONDS,
+                shard,
+                today,
+            )
+            claimed.extend((fire_date, chat_key, kind) for chat_key, kind in claimed_keys)
+        if len(claimed) < len(by_key):
+            logger.info(
+                "Daily messages for %s shard %d/%d: %d of %d already delivered or in progress",
+                today,
+                shard,
+                shards,
+                len(by_key) - len(claimed),
+                len(by_key),
+            )
+
+        chat_ids = await store.get_chat_ids(username for _, username, _ in claimed)
+        jobs: list[BroadcastJob] = []
+        for fire_date, chat_key, kind in claimed:
+            entry = by_key[(fire_date, chat_key, kind)]
+            chat_id = chat_ids.get(chat_key)
+            if kind == "appointment":
+                send = partial(
+                    send_appointment_message,
+                    bot,
+                    store,
+                    outbox,
+                    undelivered_tab,
+                    entry.username,
+                    entry.dt,
+                    zone,
+                    chat_id,
+                    ledger=(fire_date, kind),
+                    engine=engine,
+                )
+            else:
+                send = partial(
+                    send_6m_message,
+                    bot,
+                    store,
+                    outbox,
+                    undelivered_tab,
+                    entry.username,
+                    zone,
+                    chat_id,
+                    ledger=(fire_date, kind),
+                    engine=engine,
+                )
+            jobs.append(
+                BroadcastJob(
+                    chat_key=chat_key,
+                    send=partial(deliver, store, fire_date, chat_key, kind, send),
+                )
+            )
+
+        name = "Daily messages" if shards == 1 else f"Daily messages shard {shard}/{shards}"
+        stats = await engine.run(jobs, name=name)
+    except Exception:
+        logger.exception("Daily messages shard %d/%d crashed", shard, shards)
+        await store.finish_daily_shard(today, shard, datetime.now(UTC), crashed=True)
+        raise
+    except asyncio.CancelledError:
+        # A leader that steps down hands its unsent claims straight to the next run.
+        await store.release_deliveries(run_id, datetime.now(UTC))
+        await store.finish_daily_shard(today, shard, datetime.now(UTC), crashed=True)
+        raise
+    await store.finish_daily_shard(today, shard, datetime.now(UTC))
+    return stats
+
+
+async def replay_dead_letters(
+    bot,
+    store: AsyncSQLiteStateStore,
+    outbox: SheetsOutbox,
+    undelivered_tab: str,
+    tz: str,
+    limit: int = 500,
+    error_class: str | None = None,
+    engine: BroadcastEngine | None = None,
+) -> BroadcastStats:
+    zone = ZoneInfo(tz)
+    now = datetime.now(zone)
+    engine = engine or BroadcastEngine()
+    closed: list[int] = []
+    letters: dict[tuple[date, str, str], list[DeadLetter]] = {}
+    for letter in await store.list_dead_letters(limit, error_class):
+        if letter.kind == "appointment" and _appointment_passed(
+            datetime.fromisoformat(letter.payload["dt"]), now
+        ):
+            closed.append(letter.id)
+            continue
+        letters.setdefault(_ledger_key(letter, zone), []).append(letter)
+
+    # Replays go through the delivery ledger like any other send, so a letter whose
+    # delivery is claimed by a running job waits and one already sent is only closed.
+    by_date: dict[date, list[tuple[str, str]]] = {}
+    for run_date, chat_key, kind in letters:
+        by_date.setdefault(run_date, []).append((chat_key, kind))
+    run_id = uuid.uuid4().hex
+    claimed: list[tuple[date, str, str]] = []
+    for run_date, keys in sorted(by_date.items()):
+        claimed_keys = await store.claim_deliveries(
+            run_date,
+            keys,
+            run_id,
+            datetime.now(UTC),
+            DELIVERY_LEASE_SECONDS,
+            reclaim_rejected=True,
+        )
+        claimed.extend((run_date, chat_key, kind) for chat_key, kind in claimed_keys)
+    for key in letters.keys() - set(claimed):
+        if await store.delivery_status(*key) == "sent":
+            closed.extend(letter.id for letter in letters[key])
+    await store.mark_dead_letters_replayed(closed, datetime.now(UTC))
+
+    chat_ids = await store.get_chat_ids(chat_key for _, chat_key, _ in claimed)
+    jobs: list[BroadcastJob] = []
+    for run_date, chat_key, kind in claimed:
+        group = letters[(run_date, chat_key, kind)]
+        letter = group[0]
+        chat_id = chat_ids.get(chat_key, letter.chat_id)
+        if letter.kind == "appointment":
+            send = partial(
+                send_appointment_message,
+                bot,
+                store,
+                outbox,
+                undelivered_tab,
+                letter.username,
+                datetime.fromisoformat(letter.payload["dt"]),
+                zone,
+                chat_id,
+                record=False,
+                engine=engine,
+            )
+        else:
+            send = partial(
+                send_6m_message,
+                bot,
+                store,
+                outbox,
                 undelivered_tab,
+                letter.username,
                 zone,
-                username,
-                "6m",
-                str(exc),
+                chat_id,
+                record=False,
+                engine=engine,
             )
-        return
+        jobs.append(
+            BroadcastJob(
+                chat_key=chat_key,
+                send=partial(
+                    _replay,
+                    store,
+                    [letter.id for letter in group],
+                    partial(deliver, store, run_date, chat_key, kind, send),
+                ),
+            )
+        )
+    return await engine.run(jobs, name="Dead letter replay")
 
 
-def _log_undelivered(
-    sheets: SheetsClient,
-    undelivered_tab: str,
-    zone,
-    username: str,
-    kind: str,
-    reason: str,
-) -> None:
-    now_str = datetime.now(zone).strftime("%d.%m.%Y %H:%M")
-    sheets.append_undelivered(undelivered_tab, [now_str, username, kind, reason])
+def _ledger_key(letter: DeadLetter, zone: ZoneInfo) -> tuple[date, str, str]:
+    run_date = letter.payload.get("run_date")
+    if run_date is None:
+        day = datetime.fromisoformat(letter.created_at).astimezone(zone).date()
+    else:
+        day = date.fromisoformat(run_date)
+    kind = letter.payload.get("ledger_kind", letter.kind)
+    return day, _normalize_username(letter.username), kind
+
+
+async def _replay(
+    store: AsyncSQLiteStateStore, letter_ids: list[int], send: Callable[[], Awaitable[bool]]
+) -> bool:
+    # A failed replay keeps its letter open instead of recording a second one.
+    sent = await send()
+    if sent:
+        await store.mark_dead_letters_replayed(letter_ids, datetime.now(UTC))
+    return sent
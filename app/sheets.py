@@ -1,10 +1,23 @@
 from __future__ import annotations
 
-from collections.abc import Iterable
+import asyncio
+import re
+import threading
+import time
+from calendar import monthrange
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache, partial
+from typing import TypeVar
 
 import gspread
+from gspread.exceptions import APIError
+
+from app.metrics import SHEETS_CALLS, SHEETS_LATENCY
+
+T = TypeVar("T")
 
 
 @dataclass
@@ -13,58 +26,262 @@ class SheetEntry:
     username: str
 
 
+@dataclass
+class ColumnEdit:
+    start: int
+    delete_count: int
+    values: list[str]
+
+
+_STALE_WORKSHEET_MARKERS = ("Unable to parse range", "No grid with id")
+
+
 class SheetsClient:
-    def __init__(self, sheet_id: str, service_account_json: str) -> None:
+    def __init__(
+        self, sheet_id: str, service_account_json: str, worksheet_ttl: float = 600.0
+    ) -> None:
         self._gc = gspread.service_account(filename=service_account_json)
         self._sheet = self._gc.open_by_key(sheet_id)
+        self._worksheet_ttl = worksheet_ttl
+        self._worksheets: dict[str, tuple[gspread.Worksheet, float]] = {}
+        self._worksheets_lock = threading.Lock()
 
-    def append_comment(self, tab_name: str, row: list[str]) -> None:
+    def _worksheet(self, tab_name: str) -> gspread.Worksheet:
+        now = time.monotonic()
+        with self._worksheets_lock:
+            cached = self._worksheets.get(tab_name)
+        if cached and now - cached[1] < self._worksheet_ttl:
+            return cached[0]
         ws = self._sheet.worksheet(tab_name)
-        ws.append_row(row, value_input_option="USER_ENTERED")
+        with self._worksheets_lock:
+            self._worksheets[tab_name] = (ws, now)
+        return ws
 
-    def append_undelivered(self, tab_name: str, row: list[str]) -> None:
-        ws = self._sheet.worksheet(tab_name)
-        ws.append_row(row, value_input_option="USER_ENTERED")
+    def invalidate_worksheet(self, tab_name: str | None = None) -> None:
+        with self._worksheets_lock:
+            if tab_name is None:
+                self._worksheets.clear()
+            else:
+                self._worksheets.pop(tab_name, None)
 
-    def sync_client_usernames(self, tab_name: str, usernames: list[str]) -> None:
-        ws = self._sheet.worksheet(tab_name)
-        existing = ws.col_values(1)
-        header = existing[0].strip() if existing and existing[0].strip() else "tg_username"
+    def _with_worksheet(self, tab_name: str, func: Callable[[gspread.Worksheet], T]) -> T:
+        try:
+            return func(self._worksheet(tab_name))
+        except APIError as exc:
+            if not _is_stale_worksheet_error(exc):
+                raise
+        self.invalidate_worksheet(tab_name)
+        return func(self._worksheet(tab_name))
+
+    def append_comment(self, tab_name: str, row: list[str]) -> None:
+        self._with_worksheet(
+            tab_name, lambda ws: ws.append_row(row, value_input_option="USER_ENTERED")
+        )
 
-        unique_usernames = sorted(
-            {username.strip().lower() for username in usernames if username.strip()}
+    def append_undelivered(self, tab_name: str, row: list[str]) -> None:
+        self._with_worksheet(
+            tab_name, lambda ws: ws.append_row(row, value_input_option="USER_ENTERED")
         )
-        target = [header, *unique_usernames]
-        if existing == target:
-            return
-
-        ws.update(
-            f"A1:A{len(target)}",
-            [[value] for value in target],
-            value_input_option="USER_ENTERED",
+
+    def append_rows(self, tab_name: str, rows: list[list[str]]) -> None:
+        self._with_worksheet(
+            tab_name, lambda ws: ws.append_rows(rows, value_input_option="USER_ENTERED")
         )
-        if len(existing) > len(target):
-            ws.batch_clear([f"A{len(target) + 1}:A{len(existing)}"])
 
-    def iter_entries(self, tab_name: str) -> Iterable[SheetEntry]:
-        ws = self._sheet.worksheet(tab_name)
-        rows = ws.get_all_values()
-        for row in rows[1:]:
-            if not row or not row[0].strip():
-                continue
-            dt = _parse_datetime(row[0].strip())
-            if not dt:
-                continue
-            username = row[1].strip() if len(row) > 1 else ""
-            if not username:
-                continue
-            yield SheetEntry(dt=dt, username=username)
+    def sync_client_usernames(self, tab_name: str, usernames: list[str]) -> list[str]:
+        return self._with_worksheet(tab_name, lambda ws: _sync_usernames_column(ws, usernames))
 
+    def apply_column_edits(self, tab_name: str, edits: list[ColumnEdit]) -> None:
+        if edits:
+            self._with_worksheet(tab_name, lambda ws: self._apply_column_edits(ws, edits))
 
-def _parse_datetime(value: str) -> datetime | None:
-    for fmt in ("%d.%m.%Y %H:%M", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y"):
+    def _apply_column_edits(self, ws: gspread.Worksheet, edits: list[ColumnEdit]) -> None:
+        requests: list[dict] = []
+        for edit in sorted(edits, key=lambda item: item.start, reverse=True):
+            if edit.delete_count:
+                requests.append(
+                    {
+                        "deleteRange": {
+                            "range": _column_range(ws.id, edit.start, edit.delete_count),
+                            "shiftDimension": "ROWS",
+                        }
+                    }
+                )
+            if edit.values:
+                requests.append(
+                    {
+                        "insertRange": {
+                            "range": _column_range(ws.id, edit.start, len(edit.values)),
+                            "shiftDimension": "ROWS",
+                        }
+                    }
+                )
+                requests.append(
+                    {
+                        "updateCells": {
+                            "start": {"sheetId": ws.id, "rowIndex": edit.start, "columnIndex": 0},
+                            "rows": [
+                                {"values": [{"userEnteredValue": {"stringValue": value}}]}
+                                for value in edit.values
+                            ],
+                            "fields": "userEnteredValue",
+                        }
+                    }
+                )
+        self._sheet.batch_update({"requests": requests})
+
+    def get_values(self, tab_name: str, range_name: str) -> list[list[str]]:
+        return self._with_worksheet(tab_name, lambda ws: ws.get_values(range_name))
+
+
+def parse_entry(row: list[str]) -> SheetEntry | None:
+    if not row or not row[0].strip():
+        return None
+    dt = _parse_datetime(row[0].strip())
+    if not dt:
+        return None
+    username = row[1].strip() if len(row) > 1 else ""
+    if not username:
+        return None
+    return SheetEntry(dt=dt, username=username)
+
+
+def _is_stale_worksheet_error(exc: APIError) -> bool:
+    if exc.code == 404:
+        return True
+    message = str(exc.error.get("message", ""))
+    return exc.code == 400 and any(marker in message for marker in _STALE_WORKSHEET_MARKERS)
+
+
+def clients_column(existing: list[str], usernames: list[str]) -> list[str]:
+    header = existing[0].strip() if existing and existing[0].strip() else "tg_username"
+    unique_usernames = sorted(
+        {username.strip().lower() for username in usernames if username.strip()}
+    )
+    return [header, *unique_usernames]
+
+
+def _column_range(sheet_id: int, start: int, count: int) -> dict:
+    return {
+        "sheetId": sheet_id,
+        "startRowIndex": start,
+        "endRowIndex": start + count,
+        "startColumnIndex": 0,
+        "endColumnIndex": 1,
+    }
+
+
+def _sync_usernames_column(ws: gspread.Worksheet, usernames: list[str]) -> list[str]:
+    existing = ws.col_values(1)
+    target = clients_column(existing, usernames)
+    if existing == target:
+        return target
+
+    ws.update(
+        f"A1:A{len(target)}",
+        [[value] for value in target],
+        value_input_option="USER_ENTERED",
+    )
+    if len(existing) > len(target):
+        ws.batch_clear([f"A{len(target) + 1}:A{len(existing)}"])
+    return target
+
+
+class AsyncSheetsClient:
+    def __init__(
+        self,
+        client: SheetsClient | None = None,
+        max_workers: int = 4,
+        timeout: float = 30.0,
+        factory: Callable[[], SheetsClient] | None = None,
+    ) -> None:
+        if client is None and factory is None:
+            raise ValueError("Either client or factory is required")
+        self._client = client
+        self._factory = factory
+        self._connect_lock = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sheets")
+        self._timeout = timeout
+
+    @property
+    def ready(self) -> bool:
+        return self._client is not None
+
+    async def connect(self) -> SheetsClient:
+        if self._client is not None:
+            return self._client
+        async with self._connect_lock:
+            if self._client is None:
+                self._client = await self._run(_connect, self._factory)
+        return self._client
+
+    async def _run(self, func: Callable[..., T], *args) -> T:
+        method = func.__name__.lstrip("_")
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, partial(func, *args))
+        started = time.perf_counter()
+        outcome = "error"
         try:
-            return datetime.strptime(value, fmt)
-        except ValueError:
-            continue
-    return None
+            result = await asyncio.wait_for(future, self._timeout)
+            outcome = "ok"
+            return result
+        except TimeoutError:
+            outcome = "timeout"
+            raise
+        finally:
+            SHEETS_LATENCY.observe(time.perf_counter() - started, method=method)
+            SHEETS_CALLS.inc(method=method, outcome=outcome)
+
+    async def _call(self, method: str, *args):
+        client = await self.connect()
+        return await self._run(getattr(client, method), *args)
+
+    async def append_comment(self, tab_name: str, row: list[str]) -> None:
+        await self._call("append_comment", tab_name, row)
+
+    async def append_undelivered(self, tab_name: str, row: list[str]) -> None:
+        await self._call("append_undelivered", tab_name, row)
+
+    async def append_rows(self, tab_name: str, rows: list[list[str]]) -> None:
+        await self._call("append_rows", tab_name, rows)
+
+    async def sync_client_usernames(self, tab_name: str, usernames: list[str]) -> list[str]:
+        return await self._call("sync_client_usernames", tab_name, usernames)
+
+    async def apply_column_edits(self, tab_name: str, edits: list[ColumnEdit]) -> None:
+        await self._call("apply_column_edits", tab_name, edits)
+
+    async def get_values(self, tab_name: str, range_name: str) -> list[list[str]]:
+        return await self._call("get_values", tab_name, range_name)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _connect(factory: Callable[[], SheetsClient]) -> SheetsClient:
+    return factory()
+
+
+# Unicode \s keeps the NBSP that Sheets copy-paste puts between date and time; digits stay ASCII.
+_DATETIME_RE = re.compile(
+    r"([0-9]{1,2}| [0-9])\.([0-9]{1,2})\.([0-9]{4})"
+    r"(?:\s+([0-9]{1,2}):([0-9]{1,2})(?::([0-9]{1,2}))?)?"
+)
+
+
+@lru_cache(maxsize=65536)
+def _parse_datetime(value: str) -> datetime | None:
+    match = _DATETIME_RE.fullmatch(value)
+    if not match:
+        return None
+    day_s, month_s, year_s, hour_s, minute_s, second_s = match.groups()
+    day, month, year = int(day_s), int(month_s), int(year_s)
+    if year < 1 or not 1 <= month <= 12 or not 1 <= day <= monthrange(year, month)[1]:
+        return None
+    if hour_s is None:
+        return datetime(year, month, day)
+    hour, minute = int(hour_s), int(minute_s)
+    second = int(second_s) if second_s is not None else 0
+    if hour > 23 or minute > 59 or second > 59:
+        return None
+    return datetime(year, month, day, hour, minute, second)
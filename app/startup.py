@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import logging
+import time
+from contextlib import contextmanager
+
+from app.metrics import STARTUP_PHASE_SECONDS
+
+logger = logging.getLogger("golden-dent")
+
+
+class StartupTimer:
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self.failed: set[str] = set()
+        self._last_mark = self.started
+
+    def mark(self, name: str) -> None:
+        now = time.perf_counter()
+        self._record(name, now - self._last_mark)
+        self._last_mark = now
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.failed.add(name)
+            raise
+        finally:
+            self._record(name, time.perf_counter() - started)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def log(self, stage: str, names: list[str]) -> None:
+        logger.info(
+            "%s after %.2fs: %s",
+            stage,
+            self.elapsed(),
+            ", ".join(
+                f"{name}={self.phases[name]:.3f}s" + (" (failed)" if name in self.failed else "")
+                for name in names
+                if name in self.phases
+            ),
+        )
+
+    def _record(self, name: str, elapsed: float) -> None:
+        self.phases[name] = round(elapsed, 4)
+        STARTUP_PHASE_SECONDS.set(elapsed, phase=name)
@@ -1,8 +1,19 @@
+import asyncio
+import json
 import sqlite3
-from collections.abc import Iterable
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from functools import partial
 from pathlib import Path
+from typing import TypeVar
+
+from app.metrics import STORE_LATENCY
+
+T = TypeVar("T")
 
 
 @dataclass
@@ -12,14 +23,90 @@ class PendingComment:
     created_at: str
 
 
+@dataclass
+class OutboxRow:
+    id: int
+    tab: str
+    row: list[str]
+    created_at: str
+
+
+@dataclass
+class AppointmentRow:
+    row_index: int
+    dt: datetime
+    username: str
+
+
+@dataclass
+class Reminder:
+    row_index: int
+    kind: str
+    fire_date: date
+    dt: datetime
+    username: str
+
+
+@dataclass
+class DeadLetter:
+    id: int
+    kind: str
+    username: str
+    chat_id: int | None
+    payload: dict
+    error_class: str
+    error: str
+    attempts: int
+    created_at: str
+
+
+@dataclass
+class DailyShard:
+    run_date: str
+    shard: int
+    shard_count: int
+    status: str
+    total: int
+    sent: int
+    failed: int
+    started_at: str
+    finished_at: str | None
+
+
 class SQLiteStateStore:
-    def __init__(self, data_dir: str) -> None:
+    def __init__(self, data_dir: str, busy_timeout_ms: int = 5000) -> None:
         self._path = Path(data_dir) / "state.sqlite"
         self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
         self._init_db()
 
     def _connect(self) -> sqlite3.Connection:
-        return sqlite3.connect(self._path)
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        conn = sqlite3.connect(
+            self._path,
+            timeout=self._busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self._busy_timeout_ms)}")
+        self._local.conn = conn
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def close(self) -> None:
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
 
     def _init_db(self) -> None:
         with self._connect() as conn:
@@ -58,9 +145,150 @@ class SQLiteStateStore:
                 )
                 """
             )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sheets_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    tab TEXT NOT NULL,
+                    row TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS sheets_outbox_tab_id ON sheets_outbox (tab, id)"
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS appointment (
+                    tab TEXT NOT NULL,
+                    row_index INTEGER NOT NULL,
+                    appointment_at TEXT NOT NULL,
+                    appointment_date TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    PRIMARY KEY (tab, row_index)
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS appointment_tab_date
+                ON appointment (tab, appointment_date)
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS reminder_due (
+                    tab TEXT NOT NULL,
+                    row_index INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    fire_date TEXT NOT NULL,
+                    PRIMARY KEY (tab, row_index, kind)
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS reminder_due_date ON reminder_due (tab, fire_date)"
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS appointment_block (
+                    tab TEXT NOT NULL,
+                    block INTEGER NOT NULL,
+                    digest TEXT NOT NULL,
+                    PRIMARY KEY (tab, block)
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS appointment_sync (
+                    tab TEXT PRIMARY KEY,
+                    refreshed_at TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS media_file (
+                    content_hash TEXT PRIMARY KEY,
+                    file_id TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS seen_update (update_id INTEGER PRIMARY KEY)"
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS delivery_ledger (
+                    run_date TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    claimed_by TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    updated_at TEXT NOT NULL,
+                    shard INTEGER,
+                    batch_date TEXT,
+                    PRIMARY KEY (run_date, username, kind)
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS daily_shard (
+                    run_date TEXT NOT NULL,
+                    shard INTEGER NOT NULL,
+                    shard_count INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    sent INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    started_at TEXT NOT NULL,
+                    finished_at TEXT,
+                    PRIMARY KEY (run_date, shard)
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS dead_letter (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    chat_id INTEGER,
+                    payload TEXT NOT NULL,
+                    error_class TEXT NOT NULL,
+                    error TEXT NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    created_at TEXT NOT NULL,
+                    replayed_at TEXT
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS dead_letter_pending ON dead_letter (replayed_at, id)"
+            )
+            self._add_missing_column(conn, "delivery_ledger", "shard", "INTEGER")
+            self._add_missing_column(conn, "delivery_ledger", "batch_date", "TEXT")
+            conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS delivery_ledger_batch
+                ON delivery_ledger (batch_date, shard)
+                """
+            )
             self._migrate_clients_from_user_map(conn)
             conn.commit()
 
+    def _add_missing_column(
+        self, conn: sqlite3.Connection, table: str, column: str, definition: str
+    ) -> None:
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
     def _migrate_clients_from_user_map(self, conn: sqlite3.Connection) -> None:
         cur = conn.execute(
             "SELECT chat_id, username, updated_at FROM user_map ORDER BY updated_at"
@@ -149,6 +377,29 @@ class SQLiteStateStore:
             conn.commit()
         return changed
 
+    def touch_users(self, touches: Iterable[tuple[int, str, int, datetime]]) -> list[int]:
+        stale = []
+        with self._connect() as conn:
+            for user_id, username, chat_id, updated_at in touches:
+                stamp = updated_at.isoformat()
+                if not username:
+                    cur = conn.execute("SELECT 1 FROM client_map WHERE user_id=?", (user_id,))
+                    if cur.fetchone():
+                        stale.append(user_id)
+                    continue
+                users = conn.execute(
+                    "UPDATE user_map SET updated_at=? WHERE username=? AND chat_id=?",
+                    (stamp, username, chat_id),
+                )
+                clients = conn.execute(
+                    "UPDATE client_map SET updated_at=? WHERE user_id=? AND username=?",
+                    (stamp, user_id, username),
+                )
+                if not users.rowcount or not clients.rowcount:
+                    stale.append(user_id)
+            conn.commit()
+        return stale
+
     def remove_client(self, user_id: int) -> bool:
         with self._connect() as conn:
             cur = conn.execute("DELETE FROM client_map WHERE user_id=?", (user_id,))
@@ -184,6 +435,787 @@ class SQLiteStateStore:
             row = cur.fetchone()
         return row[0] if row else None
 
+    def get_chat_ids(self, usernames: Iterable[str]) -> dict[str, int]:
+        normalized = sorted({_normalize_username(username) for username in usernames} - {""})
+        if not normalized:
+            return {}
+        with self._connect() as conn:
+            cur = conn.execute(
+                """
+                SELECT username, chat_id FROM user_map
+                WHERE username IN (SELECT value FROM json_each(?))
+                """,
+                (json.dumps(normalized, ensure_ascii=False),),
+            )
+            rows = cur.fetchall()
+        return dict(rows)
+
+    def enqueue_sheet_row(self, tab: str, row: list[str], created_at: datetime) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO sheets_outbox (tab, row, created_at) VALUES (?, ?, ?)",
+                (tab, json.dumps(row, ensure_ascii=False), created_at.isoformat()),
+            )
+            conn.commit()
+
+    def list_outbox_tabs(self) -> list[str]:
+        with self._connect() as conn:
+            cur = conn.execute("SELECT DISTINCT tab FROM sheets_outbox")
+            rows = cur.fetchall()
+        return [row[0] for row in rows]
+
+    def list_outbox(self, tab: str, limit: int) -> list[OutboxRow]:
+        with self._connect() as conn:
+            cur = conn.execute(
+                """
+                SELECT id, tab, row, created_at FROM sheets_outbox
+                WHERE tab=? ORDER BY id LIMIT ?
+                """,
+                (tab, limit),
+            )
+            rows = cur.fetchall()
+        return [
+            OutboxRow(id=row[0], tab=row[1], row=json.loads(row[2]), created_at=row[3])
+            for row in rows
+        ]
+
+    def delete_outbox(self, ids: list[int]) -> None:
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM sheets_outbox WHERE id=?", [(id_,) for id_ in ids])
+            conn.commit()
+
+    def outbox_stats(self) -> tuple[int, str | None]:
+        with self._connect() as conn:
+            cur = conn.execute(
+                """
+                SELECT COUNT(*), (SELECT created_at FROM sheets_outbox ORDER BY id LIMIT 1)
+                FROM sheets_outbox
+                """
+            )
+            count, oldest = cur.fetchone()
+        return count, oldest
+
+    def appointment_digests(self, tab: str) -> dict[int, str]:
+        with self._connect() as conn:
+            cur = conn.execute("SELECT block, digest FROM appointment_block WHERE tab=?", (tab,))
+            return dict(cur.fetchall())
+
+    def replace_appointment_blocks(
+        self,
+        tab: str,
+        block_size: int,
+        blocks: dict[int, list[tuple[int, datetime, str]]],
+        digests: dict[int, str],
+        block_count: int,
+        refreshed_at: datetime,
+        reminders: dict[int, list[tuple[int, str, date]]] | None = None,
+    ) -> None:
+        reminders = reminders or {}
+        with self._connect() as conn:
+            for block, entries in blocks.items():
+                bounds = (tab, block * block_size, (block + 1) * block_size)
+                conn.execute(
+                    "DELETE FROM appointment WHERE tab=? AND row_index >= ? AND row_index < ?",
+                    bounds,
+                )
+                conn.execute(
+                    "DELETE FROM reminder_due WHERE tab=? AND row_index >= ? AND row_index < ?",
+                    bounds,
+                )
+                conn.executemany(
+                    """
+                    INSERT INTO appointment
+                        (tab, row_index, appointment_at, appointment_date, username)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    [
+                        (tab, row_index, dt.isoformat(), dt.date().isoformat(), username)
+                        for row_index, dt, username in entries
+                    ],
+                )
+                conn.executemany(
+                    """
+                    INSERT INTO reminder_due (tab, row_index, kind, fire_date)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    [
+                        (tab, row_index, kind, fire_date.isoformat())
+                        for row_index, kind, fire_date in reminders.get(block, [])
+                    ],
+                )
+            for table in ("appointment", "reminder_due"):
+                conn.execute(
+                    f"DELETE FROM {table} WHERE tab=? AND row_index >= ?",
+                    (tab, block_count * block_size),
+                )
+            conn.execute(
+                "DELETE FROM appointment_block WHERE tab=? AND block >= ?", (tab, block_count)
+            )
+            conn.executemany(
+                """
+                INSERT INTO appointment_block (tab, block, digest) VALUES (?, ?, ?)
+                ON CONFLICT(tab, block) DO UPDATE SET digest=excluded.digest
+                """,
+                [(tab, block, digest) for block, digest in digests.items()],
+            )
+            conn.execute(
+                """
+                INSERT INTO appointment_sync (tab, refreshed_at) VALUES (?, ?)
+                ON CONFLICT(tab) DO UPDATE SET refreshed_at=excluded.refreshed_at
+                """,
+                (tab, refreshed_at.isoformat()),
+            )
+            conn.commit()
+
+    def list_appointments(
+        self, tab: str, dates: Iterable[date] | None = None
+    ) -> list[AppointmentRow]:
+        with self._connect() as conn:
+            if dates is None:
+                cur = conn.execute(
+                    """
+                    SELECT row_index, appointment_at, username FROM appointment
+                    WHERE tab=? ORDER BY row_index
+                    """,
+                    (tab,),
+                )
+            else:
+                cur = conn.execute(
+                    """
+                    SELECT row_index, appointment_at, username FROM appointment
+                    WHERE tab=? AND appointment_date IN (SELECT value FROM json_each(?))
+                    ORDER BY row_index
+                    """,
+                    (tab, json.dumps(sorted({day.isoformat() for day in dates}))),
+                )
+            rows = cur.fetchall()
+        return [
+            AppointmentRow(row_index=row[0], dt=datetime.fromisoformat(row[1]), username=row[2])
+            for row in rows
+        ]
+
+    def list_reminders(
+        self, tab: str, since: date | None = None, until: date | None = None
+    ) -> list[Reminder]:
+        query = """
+            SELECT r.row_index, r.kind, r.fire_date, a.appointment_at, a.username
+            FROM reminder_due r
+            JOIN appointment a ON a.tab = r.tab AND a.row_index = r.row_index
+            WHERE r.tab=?
+        """
+        params: list = [tab]
+        if since is not None:
+            query += " AND r.fire_date>=?"
+            params.append(since.isoformat())
+        if until is not None:
+            query += " AND r.fire_date<=?"
+            params.append(until.isoformat())
+        with self._connect() as conn:
+            rows = conn.execute(
+                query + " ORDER BY r.fire_date, r.row_index, r.kind", params
+            ).fetchall()
+        return [
+            Reminder(
+                row_index=row[0],
+                kind=row[1],
+                fire_date=date.fromisoformat(row[2]),
+                dt=datetime.fromisoformat(row[3]),
+                username=row[4],
+            )
+            for row in rows
+        ]
+
+    def get_media_file_id(self, content_hash: str) -> str | None:
+        with self._connect() as conn:
+            cur = conn.execute(
+                "SELECT file_id FROM media_file WHERE content_hash=?", (content_hash,)
+            )
+            row = cur.fetchone()
+        return row[0] if row else None
+
+    def set_media_file_id(self, content_hash: str, file_id: str, updated_at: datetime) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO media_file (content_hash, file_id, updated_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT(content_hash) DO UPDATE SET
+                    file_id=excluded.file_id,
+                    updated_at=excluded.updated_at
+                """,
+                (content_hash, file_id, updated_at.isoformat()),
+            )
+            conn.commit()
+
+    def delete_media_file_id(self, content_hash: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM media_file WHERE content_hash=?", (content_hash,))
+            conn.commit()
+
+    def claim_deliveries(
+        self,
+        run_date: date,
+        keys: Iterable[tuple[str, str]],
+        claimed_by: str,
+        now: datetime,
+        lease_seconds: float,
+        shard: int | None = None,
+        batch_date: date | None = None,
+        reclaim_rejected: bool = False,
+    ) -> list[tuple[str, str]]:
+        stale_before = (now - timedelta(seconds=lease_seconds)).isoformat()
+        batch = (batch_date or run_date).isoformat()
+        claimed: list[tuple[str, str]] = []
+        with self._connect() as conn:
+            for username, kind in keys:
+                cur = conn.execute(
+                    """
+                    INSERT INTO delivery_ledger (
+                        run_date, username, kind, status, claimed_by, attempts, updated_at,
+                        shard, batch_date
+                    )
+                    VALUES (?, ?, ?, 'claimed', ?, 1, ?, ?, ?)
+                    ON CONFLICT(run_date, username, kind) DO UPDATE SET
+                        status='claimed',
+                        claimed_by=excluded.claimed_by,
+                        attempts=delivery_ledger.attempts + 1,
+                        updated_at=excluded.updated_at,
+                        shard=excluded.shard,
+                        batch_date=excluded.batch_date
+                    WHERE delivery_ledger.status='failed'
+                        OR (? AND delivery_ledger.status='rejected')
+                        OR (delivery_ledger.status='claimed' AND delivery_ledger.updated_at < ?)
+                    """,
+                    (
+                        run_date.isoformat(),
+                        username,
+                        kind,
+                        claimed_by,
+                        now.isoformat(),
+                        shard,
+                        batch,
+                        reclaim_rejected,
+                        stale_before,
+                    ),
+                )
+                if cur.rowcount:
+                    claimed.append((username, kind))
+            conn.commit()
+        return claimed
+
+    def mark_delivery(
+        self, run_date: date, username: str, kind: str, status: str, updated_at: datetime
+    ) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE delivery_ledger SET status=?, updated_at=?
+                WHERE run_date=? AND username=? AND kind=?
+                """,
+                (status, updated_at.isoformat(), run_date.isoformat(), username, kind),
+            )
+            conn.commit()
+
+    def release_deliveries(self, claimed_by: str, updated_at: datetime) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE delivery_ledger SET status='failed', updated_at=?
+                WHERE claimed_by=? AND status='claimed'
+                """,
+                (updated_at.isoformat(), claimed_by),
+            )
+            conn.commit()
+
+    def delivery_status(self, run_date: date, username: str, kind: str) -> str | None:
+        with self._connect() as conn:
+            cur = conn.execute(
+                """
+                SELECT status FROM delivery_ledger WHERE run_date=? AND username=? AND kind=?
+                """,
+                (run_date.isoformat(), username, kind),
+            )
+            row = cur.fetchone()
+        return row[0] if row else None
+
+    def delivery_counts(self, run_date: date) -> dict[str, int]:
+        with self._connect() as conn:
+            cur = conn.execute(
+                "SELECT status, COUNT(*) FROM delivery_ledger WHERE run_date=? GROUP BY status",
+                (run_date.isoformat(),),
+            )
+            rows = cur.fetchall()
+        return dict(rows)
+
+    def start_daily_shard(
+        self, run_date: date, shard: int, shard_count: int, started_at: datetime
+    ) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO daily_shard (run_date, shard, shard_count, status, started_at)
+                VALUES (?, ?, ?, 'running', ?)
+                ON CONFLICT(run_date, shard) DO UPDATE SET
+                    shard_count=excluded.shard_count,
+                    status='running',
+                    started_at=excluded.started_at,
+                    finished_at=NULL
+                """,
+                (run_date.isoformat(), shard, shard_count, started_at.isoformat()),
+            )
+            conn.commit()
+
+    def finish_daily_shard(
+        self, run_date: date, shard: int, finished_at: datetime, crashed: bool = False
+    ) -> None:
+        with self._connect() as conn:
+            cur = conn.execute(
+                """
+                SELECT status, COUNT(*) FROM delivery_ledger
+                WHERE batch_date=? AND shard=? GROUP BY status
+                """,
+                (run_date.isoformat(), shard),
+            )
+            counts = dict(cur.fetchall())
+            # Counts cover every delivery the shard claimed on that day, so a retry or a
+            # crash never leaves them out of step with the ledger.
+            failed = counts.get("failed", 0) + counts.get("rejected", 0)
+            status = "failed" if crashed or counts.get("failed", 0) else "done"
+            conn.execute(
+                """
+                UPDATE daily_shard SET status=?, total=?, sent=?, failed=?, finished_at=?
+                WHERE run_date=? AND shard=?
+                """,
+                (
+                    status,
+                    sum(counts.values()),
+                    counts.get("sent", 0),
+                    failed,
+                    finished_at.isoformat(),
+                    run_date.isoformat(),
+                    shard,
+                ),
+            )
+            conn.commit()
+
+    def first_daily_run(self) -> date | None:
+        with self._connect() as conn:
+            cur = conn.execute("SELECT MIN(run_date) FROM daily_shard")
+            row = cur.fetchone()
+        return date.fromisoformat(row[0]) if row[0] else None
+
+    def list_daily_shards(self, run_date: date) -> list[DailyShard]:
+        with self._connect() as conn:
+            cur = conn.execute(
+                """
+                SELECT run_date, shard, shard_count, status, total, sent, failed,
+                    started_at, finished_at
+                FROM daily_shard WHERE run_date=? ORDER BY shard
+                """,
+                (run_date.isoformat(),),
+            )
+            rows = cur.fetchall()
+        return [DailyShard(*row) for row in rows]
+
+    def list_seen_updates(self, limit: int) -> list[int]:
+        with self._connect() as conn:
+            cur = conn.execute(
+                "SELECT update_id FROM seen_update ORDER BY update_id DESC LIMIT ?", (limit,)
+            )
+            rows = cur.fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def claim_update(self, update_id: int) -> bool:
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO seen_update (update_id) VALUES (?)", (update_id,)
+            )
+            conn.commit()
+        return cur.rowcount > 0
+
+    def release_update(self, update_id: int) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM seen_update WHERE update_id=?", (update_id,))
+            conn.commit()
+
+    def trim_seen_updates(self, keep: int) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                DELETE FROM seen_update WHERE update_id <= (
+                    SELECT update_id FROM seen_update ORDER BY update_id DESC LIMIT 1 OFFSET ?
+                )
+                """,
+                (keep,),
+            )
+            conn.commit()
+
+    def add_dead_letter(
+        self,
+        kind: str,
+        username: str,
+        chat_id: int | None,
+        payload: dict,
+        error_class: str,
+        error: str,
+        attempts: int,
+        created_at: datetime,
+    ) -> int:
+        with self._connect() as conn:
+            cur = conn.execute(
+                """
+                INSERT INTO dead_letter (
+                    kind, username, chat_id, payload, error_class, error, attempts, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    kind,
+                    username,
+                    chat_id,
+                    json.dumps(payload, ensure_ascii=False),
+                    error_class,
+                    error,
+                    attempts,
+                    created_at.isoformat(),
+                ),
+            )
+            conn.commit()
+        return cur.lastrowid
+
+    def list_dead_letters(self, limit: int, error_class: str | None = None) -> list[DeadLetter]:
+        with self._connect() as conn:
+            cur = conn.execute(
+                """
+                SELECT id, kind, username, chat_id, payload, error_class, error, attempts,
+                    created_at
+                FROM dead_letter
+                WHERE replayed_at IS NULL AND (? IS NULL OR error_class=?)
+                ORDER BY id LIMIT ?
+                """,
+                (error_class, error_class, limit),
+            )
+            rows = cur.fetchall()
+        return [
+            DeadLetter(
+                id=row[0],
+                kind=row[1],
+                username=row[2],
+                chat_id=row[3],
+                payload=json.loads(row[4]),
+                error_class=row[5],
+                error=row[6],
+                attempts=row[7],
+                created_at=row[8],
+            )
+            for row in rows
+        ]
+
+    def mark_dead_letters_replayed(self, ids: list[int], replayed_at: datetime) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE dead_letter SET replayed_at=? WHERE id=?",
+                [(replayed_at.isoformat(), id_) for id_ in ids],
+            )
+            conn.commit()
+
+    def dead_letter_counts(self) -> dict[str, int]:
+        with self._connect() as conn:
+            cur = conn.execute(
+                """
+                SELECT error_class, COUNT(*) FROM dead_letter
+                WHERE replayed_at IS NULL GROUP BY error_class
+                """
+            )
+            rows = cur.fetchall()
+        return dict(rows)
+
+
+class AsyncSQLiteStateStore:
+    def __init__(self, store: SQLiteStateStore, read_workers: int = 4) -> None:
+        self.sync = store
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._readers = ThreadPoolExecutor(
+            max_workers=read_workers, thread_name_prefix="sqlite-reader"
+        )
+
+    async def _read(self, func: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, partial(_timed, func, *args))
+
+    async def _write(self, func: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, partial(_timed, func, *args))
+
+    async def set_pending(self, user_id: int, username: str, created_at: datetime) -> None:
+        await self._write(self.sync.set_pending, user_id, username, created_at)
+
+    async def pop_pending(self, user_id: int) -> PendingComment | None:
+        return await self._write(self.sync.pop_pending, user_id)
+
+    async def list_pending(self) -> list[PendingComment]:
+        return await self._read(self.sync.list_pending)
+
+    async def upsert_user(self, username: str, chat_id: int, updated_at: datetime) -> None:
+        await self._write(self.sync.upsert_user, username, chat_id, updated_at)
+
+    async def upsert_client(self, user_id: int, username: str, updated_at: datetime) -> bool:
+        return await self._write(self.sync.upsert_client, user_id, username, updated_at)
+
+    async def touch_users(self, touches: Iterable[tuple[int, str, int, datetime]]) -> list[int]:
+        return await self._write(self.sync.touch_users, list(touches))
+
+    async def remove_client(self, user_id: int) -> bool:
+        return await self._write(self.sync.remove_client, user_id)
+
+    async def list_client_usernames(self) -> list[str]:
+        return await self._read(self.sync.list_client_usernames)
+
+    async def mark_activated(self, user_id: int, activated_at: datetime) -> bool:
+        return await self._write(self.sync.mark_activated, user_id, activated_at)
+
+    async def get_chat_id(self, username: str) -> int | None:
+        return await self._read(self.sync.get_chat_id, username)
+
+    async def get_chat_ids(self, usernames: Iterable[str]) -> dict[str, int]:
+        return await self._read(self.sync.get_chat_ids, list(usernames))
+
+    async def enqueue_sheet_row(self, tab: str, row: list[str], created_at: datetime) -> None:
+        await self._write(self.sync.enqueue_sheet_row, tab, row, created_at)
+
+    async def list_outbox_tabs(self) -> list[str]:
+        return await self._read(self.sync.list_outbox_tabs)
+
+    async def list_outbox(self, tab: str, limit: int) -> list[OutboxRow]:
+        return await self._read(self.sync.list_outbox, tab, limit)
+
+    async def delete_outbox(self, ids: list[int]) -> None:
+        await self._write(self.sync.delete_outbox, ids)
+
+    async def outbox_stats(self) -> tuple[int, str | None]:
+        return await self._read(self.sync.outbox_stats)
+
+    async def appointment_digests(self, tab: str) -> dict[int, str]:
+        return await self._read(self.sync.appointment_digests, tab)
+
+    async def replace_appointment_blocks(
+        self,
+        tab: str,
+        block_size: int,
+        blocks: dict[int, list[tuple[int, datetime, str]]],
+        digests: dict[int, str],
+        block_count: int,
+        refreshed_at: datetime,
+        reminders: dict[int, list[tuple[int, str, date]]] | None = None,
+    ) -> None:
+        await self._write(
+            self.sync.replace_appointment_blocks,
+            tab,
+            block_size,
+            blocks,
+            digests,
+            block_count,
+            refreshed_at,
+            reminders,
+        )
+
+    async def list_appointments(
+        self, tab: str, dates: Iterable[date] | None = None
+    ) -> list[AppointmentRow]:
+        return await self._read(
+            self.sync.list_appointments, tab, None if dates is None else list(dates)
+        )
+
+    async def list_reminders(
+        self, tab: str, since: date | None = None, until: date | None = None
+    ) -> list[Reminder]:
+        return await self._read(self.sync.list_reminders, tab, since, until)
+
+    async def get_media_file_id(self, content_hash: str) -> str | None:
+        return await self._read(self.sync.get_media_file_id, content_hash)
+
+    async def set_media_file_id(
+        self, content_hash: str, file_id: str, updated_at: datetime
+    ) -> None:
+        await self._write(self.sync.set_media_file_id, content_hash, file_id, updated_at)
+
+    async def delete_media_file_id(self, content_hash: str) -> None:
+        await self._write(self.sync.delete_media_file_id, content_hash)
+
+    async def claim_deliveries(
+        self,
+        run_date: date,
+        keys: Iterable[tuple[str, str]],
+        claimed_by: str,
+        now: datetime,
+        lease_seconds: float,
+        shard: int | None = None,
+        batch_date: date | None = None,
+        reclaim_rejected: bool = False,
+    ) -> list[tuple[str, str]]:
+        return await self._write(
+            self.sync.claim_deliveries,
+            run_date,
+            list(keys),
+            claimed_by,
+            now,
+            lease_seconds,
+            shard,
+            batch_date,
+            reclaim_rejected,
+        )
+
+    async def mark_delivery(
+        self, run_date: date, username: str, kind: str, status: str, updated_at: datetime
+    ) -> None:
+        await self._write(self.sync.mark_delivery, run_date, username, kind, status, updated_at)
+
+    async def release_deliveries(self, claimed_by: str, updated_at: datetime) -> None:
+        await self._write(self.sync.release_deliveries, claimed_by, updated_at)
+
+    async def delivery_status(self, run_date: date, username: str, kind: str) -> str | None:
+        return await self._read(self.sync.delivery_status, run_date, username, kind)
+
+    async def delivery_counts(self, run_date: date) -> dict[str, int]:
+        return await self._read(self.sync.delivery_counts, run_date)
+
+    async def start_daily_shard(
+        self, run_date: date, shard: int, shard_count: int, started_at: datetime
+    ) -> None:
+        await self._write(self.sync.start_daily_shard, run_date, shard, shard_count, started_at)
+
+    async def finish_daily_shard(
+        self, run_date: date, shard: int, finished_at: datetime, crashed: bool = False
+    ) -> None:
+        await self._write(self.sync.finish_daily_shard, run_date, shard, finished_at, crashed)
+
+    async def first_daily_run(self) -> date | None:
+        return await self._read(self.sync.first_daily_run)
+
+    async def list_daily_shards(self, run_date: date) -> list[DailyShard]:
+        return await self._read(self.sync.list_daily_shards, run_date)
+
+    async def list_seen_updates(self, limit: int) -> list[int]:
+        return await self._read(self.sync.list_seen_updates, limit)
+
+    async def claim_update(self, update_id: int) -> bool:
+        return await self._write(self.sync.claim_update, update_id)
+
+    async def release_update(self, update_id: int) -> None:
+        await self._write(self.sync.release_update, update_id)
+
+    async def trim_seen_updates(self, keep: int) -> None:
+        await self._write(self.sync.trim_seen_updates, keep)
+
+    async def add_dead_letter(
+        self,
+        kind: str,
+        username: str,
+        chat_id: int | None,
+        payload: dict,
+        error_class: str,
+        error: str,
+        attempts: int,
+        created_at: datetime,
+    ) -> int:
+        return await self._write(
+            self.sync.add_dead_letter,
+            kind,
+            username,
+            chat_id,
+            payload,
+            error_class,
+            error,
+            attempts,
+            created_at,
+        )
+
+    async def list_dead_letters(
+        self, limit: int, error_class: str | None = None
+    ) -> list[DeadLetter]:
+        return await self._read(self.sync.list_dead_letters, limit, error_class)
+
+    async def mark_dead_letters_replayed(self, ids: list[int], replayed_at: datetime) -> None:
+        await self._write(self.sync.mark_dead_letters_replayed, list(ids), replayed_at)
+
+    async def dead_letter_counts(self) -> dict[str, int]:
+        return await self._read(self.sync.dead_letter_counts)
+
+    def close(self) -> None:
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.sync.close()
+
+
+class UserStateCache:
+    def __init__(
+        self,
+        store: AsyncSQLiteStateStore,
+        maxsize: int = 10_000,
+        touch_batch_size: int = 500,
+        touch_interval: float = 300.0,
+    ) -> None:
+        self._store = store
+        self._maxsize = maxsize
+        self._touch_batch_size = touch_batch_size
+        self._touch_interval = touch_interval
+        self._entries: OrderedDict[int, tuple[str, int]] = OrderedDict()
+        self._touched: dict[int, tuple[str, int, datetime]] = {}
+        self._last_flush: datetime | None = None
+
+    async def record(
+        self, user_id: int, username: str | None, chat_id: int, now: datetime
+    ) -> bool:
+        normalized = _normalize_username(username or "")
+        state = (normalized, chat_id)
+        if self._entries.get(user_id) == state:
+            self._entries.move_to_end(user_id)
+            self._touched[user_id] = (normalized, chat_id, now)
+            await self._maybe_flush(now)
+            return False
+
+        if normalized:
+            await self._store.upsert_user(normalized, chat_id, now)
+            changed = await self._store.upsert_client(user_id, normalized, now)
+        else:
+            changed = await self._store.remove_client(user_id)
+        self._touched.pop(user_id, None)
+        self._entries[user_id] = state
+        self._entries.move_to_end(user_id)
+        if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+        return changed
+
+    async def flush(self, now: datetime | None = None) -> int:
+        touched = self._touched
+        self._touched = {}
+        self._last_flush = now or datetime.now().astimezone()
+        if touched:
+            stale = await self._store.touch_users(
+                (user_id, username, chat_id, updated_at)
+                for user_id, (username, chat_id, updated_at) in touched.items()
+            )
+            # Another worker rewrote these users since they were cached; forget them so the
+            # next update writes the current state again.
+            for user_id in stale:
+                username, chat_id, _ = touched[user_id]
+                if self._entries.get(user_id) == (username, chat_id):
+                    del self._entries[user_id]
+        return len(touched)
+
+    async def _maybe_flush(self, now: datetime) -> None:
+        if self._last_flush is None:
+            self._last_flush = now
+        if (
+            len(self._touched) >= self._touch_batch_size
+            or (now - self._last_flush).total_seconds() >= self._touch_interval
+        ):
+            await self.flush(now)
+
+
+def _timed(func: Callable[..., T], *args) -> T:
+    with STORE_LATENCY.time(operation=func.__name__):
+        return func(*args)
+
 
 def _normalize_username(username: str) -> str:
     username = username.strip()
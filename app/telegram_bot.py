@@ -1,10 +1,9 @@
 from __future__ import annotations
 
 import logging
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from zoneinfo import ZoneInfo
 
-from dateutil.relativedelta import relativedelta
 from telegram import Update
 from telegram.ext import (
     Application,
@@ -14,13 +13,19 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
+from telegram.request import BaseRequest, HTTPXRequest
 
+from app.appointments import AppointmentsMirror
+from app.broadcast import BroadcastEngine
+from app.clients_sync import ClientsSheetSync
+from app.delivery import PERMANENT, RETRY_AFTER, TRANSIENT
 from app.messages import (
     ADULT_SUBSCRIPTION_TEXT,
     CHILD_SUBSCRIPTION_TEXT,
     FLASH_WHITENING_TEXT,
     IMPLANT_CROWN_TEXT,
     ULTRASOUND_EXTRACTION_TEXT,
+    PhotoFileIdCache,
     build_adult_subscription_keyboard,
     build_child_subscription_keyboard,
     build_flash_contact_keyboard,
@@ -28,13 +33,20 @@ from app.messages import (
     build_ultrasound_contact_keyboard,
     send_about_message,
     send_info_start_message,
-    send_main_message,
     send_special_offers_message,
     send_start_message,
 )
-from app.scheduler import send_daily_messages
-from app.sheets import SheetsClient
-from app.storage import SQLiteStateStore
+from app.metrics import TimedRequest, timed_handler
+from app.outbox import SheetsOutbox
+from app.scheduler import (
+    daily_kinds,
+    replay_dead_letters,
+    schedule_2w_reminder,
+    schedule_start_followup,
+    send_daily_messages,
+)
+from app.sheets import AsyncSheetsClient
+from app.storage import AsyncSQLiteStateStore, UserStateCache
 
 logger = logging.getLogger("golden-dent")
 
@@ -42,22 +54,47 @@ logger = logging.getLogger("golden-dent")
 def build_application(
     bot_token: str,
     tz: str,
-    sheets: SheetsClient,
-    store: SQLiteStateStore,
+    sheets: AsyncSheetsClient,
+    store: AsyncSQLiteStateStore,
     scheduler,
     config,
+    outbox: SheetsOutbox,
+    clients_sync: ClientsSheetSync,
+    user_cache: UserStateCache,
+    appointments: AppointmentsMirror,
+    broadcast: BroadcastEngine | None = None,
+    request: BaseRequest | None = None,
 ) -> Application:
-    application = Application.builder().token(bot_token).build()
+    application = (
+        Application.builder()
+        .token(bot_token)
+        .request(TimedRequest(request or HTTPXRequest()))
+        .build()
+    )
     application.bot_data["tz"] = tz
     application.bot_data["sheets"] = sheets
     application.bot_data["store"] = store
     application.bot_data["scheduler"] = scheduler
     application.bot_data["config"] = config
+    application.bot_data["outbox"] = outbox
+    application.bot_data["clients_sync"] = clients_sync
+    application.bot_data["user_cache"] = user_cache
+    application.bot_data["appointments"] = appointments
+    application.bot_data["photo_cache"] = PhotoFileIdCache(store)
+    application.bot_data["broadcast"] = broadcast or BroadcastEngine()
 
     application.add_handler(CommandHandler("start", start_cmd))
     application.add_handler(CommandHandler("test_main", test_main_cmd))
     application.add_handler(CommandHandler("test_daily", test_daily_cmd))
     application.add_handler(CommandHandler("test_daily_debug", test_daily_debug_cmd))
+    # Without ADMIN_CHAT_ID the filter is empty and the admin commands match nobody.
+    admin = filters.Chat(chat_id=config.admin_chat_id)
+    application.add_handler(
+        CommandHandler("retry_daily_shard", retry_daily_shard_cmd, filters=admin)
+    )
+    application.add_handler(
+        CommandHandler("replay_dead_letters", replay_dead_letters_cmd, filters=admin)
+    )
     application.add_handler(CommandHandler("whoami", whoami_cmd))
 
     application.add_handler(CallbackQueryHandler(remind_2w_cb, pattern="^remind_2w$"))
@@ -75,56 +112,161 @@ def build_application(
     application.add_handler(CallbackQueryHandler(offer_flash_cb, pattern="^offer_flash$"))
 
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = timed_handler(handler.callback)
     return application
 
 
 async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.effective_chat or not update.effective_user:
         return
-    _record_user(update, context)
-    await send_info_start_message(context.bot, update.effective_chat.id)
+    await _record_user(update, context)
+    await send_info_start_message(
+        context.bot, update.effective_chat.id, context.application.bot_data["photo_cache"]
+    )
 
     tz = ZoneInfo(context.application.bot_data["tz"])
     now = datetime.now(tz)
-    store: SQLiteStateStore = context.application.bot_data["store"]
-    if not store.mark_activated(update.effective_user.id, now):
+    store: AsyncSQLiteStateStore = context.application.bot_data["store"]
+    if not await store.mark_activated(update.effective_user.id, now):
         return
 
     scheduler = context.application.bot_data["scheduler"]
-    scheduler.add_job(
-        send_start_message,
-        trigger="date",
-        run_date=now + timedelta(days=3),
-        id=f"start_followup_{update.effective_user.id}",
-        replace_existing=True,
-        args=[context.bot, update.effective_chat.id],
+    schedule_start_followup(
+        scheduler,
+        update.effective_user.id,
+        update.effective_chat.id,
+        now + timedelta(days=3),
     )
 
 
 async def test_main_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.effective_chat:
         return
-    _record_user(update, context)
+    await _record_user(update, context)
     await send_start_message(context.bot, update.effective_chat.id)
 
 
 async def test_daily_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    _record_user(update, context)
-    sheets: SheetsClient = context.application.bot_data["sheets"]
+    await _record_user(update, context)
+    appointments: AppointmentsMirror = context.application.bot_data["appointments"]
     tz = context.application.bot_data["tz"]
-    tab = context.application.bot_data["config"].google_appointments_tab
     undelivered_tab = context.application.bot_data["config"].google_undelivered_tab
-    store: SQLiteStateStore = context.application.bot_data["store"]
-    await send_daily_messages(context.bot, sheets, tab, undelivered_tab, tz, store)
+    store: AsyncSQLiteStateStore = context.application.bot_data["store"]
+    outbox: SheetsOutbox = context.application.bot_data["outbox"]
+    engine: BroadcastEngine = context.application.bot_data["broadcast"]
+    config = context.application.bot_data["config"]
+    await send_daily_messages(
+        context.bot,
+        appointments,
+        undelivered_tab,
+        tz,
+        store,
+        outbox,
+        engine,
+        config.daily_shards,
+        kinds=daily_kinds(config.appointment_reminder_mode),
+        catch_up_days=config.reminder_catch_up_days,
+    )
+
+
+async def retry_daily_shard_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not update.message:
+        return
+    await _record_user(update, context)
+    appointments: AppointmentsMirror = context.application.bot_data["appointments"]
+    tz = context.application.bot_data["tz"]
+    config = context.application.bot_data["config"]
+    store: AsyncSQLiteStateStore = context.application.bot_data["store"]
+    outbox: SheetsOutbox = context.application.bot_data["outbox"]
+    engine: BroadcastEngine = context.application.bot_data["broadcast"]
+
+    if context.args:
+        try:
+            selected = [int(arg) for arg in context.args]
+        except ValueError:
+            await update.message.reply_text("Использование: /retry_daily_shard [номер шарда ...]")
+            return
+    else:
+        today = datetime.now(ZoneInfo(tz)).date()
+        selected = [
+            shard.shard
+            for shard in await store.list_daily_shards(today)
+            if shard.status == "failed"
+        ]
+    selected = [shard for shard in selected if 0 <= shard < config.daily_shards]
+    if not selected:
+        await update.message.reply_text("Нет шардов для повторной отправки.")
+        return
+
+    stats = await send_daily_messages(
+        context.bot,
+        appointments,
+        config.google_undelivered_tab,
+        tz,
+        store,
+        outbox,
+        engine,
+        config.daily_shards,
+        only_shards=selected,
+        kinds=daily_kinds(config.appointment_reminder_mode),
+        catch_up_days=config.reminder_catch_up_days,
+    )
+    await update.message.reply_text(
+        f"Шарды {', '.join(map(str, selected))}: отправлено {stats.sent}, "
+        f"ошибок {stats.failed}."
+    )
+
+
+async def replay_dead_letters_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not update.message:
+        return
+    await _record_user(update, context)
+    tz = context.application.bot_data["tz"]
+    config = context.application.bot_data["config"]
+    store: AsyncSQLiteStateStore = context.application.bot_data["store"]
+    outbox: SheetsOutbox = context.application.bot_data["outbox"]
+    engine: BroadcastEngine = context.application.bot_data["broadcast"]
+
+    error_class = None
+    limit = 500
+    for arg in context.args or []:
+        if arg in (RETRY_AFTER, TRANSIENT, PERMANENT):
+            error_class = arg
+        elif arg.isdigit():
+            limit = int(arg)
+        else:
+            await update.message.reply_text(
+                "Использование: /replay_dead_letters [retry_after|transient|permanent] [лимит]"
+            )
+            return
+
+    stats = await replay_dead_letters(
+        context.bot,
+        store,
+        outbox,
+        config.google_undelivered_tab,
+        tz,
+        limit,
+        error_class,
+        engine,
+    )
+    remaining = sum((await store.dead_letter_counts()).values())
+    await update.message.reply_text(
+        f"Повторно отправлено {stats.sent} из {stats.total}, ошибок {stats.failed}. "
+        f"В очереди недоставленных: {remaining}."
+    )
 
 
 async def test_daily_debug_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.effective_chat:
         return
-    _record_user(update, context)
-    sheets: SheetsClient = context.application.bot_data["sheets"]
+    await _record_user(update, context)
+    appointments: AppointmentsMirror = context.application.bot_data["appointments"]
     tz = context.application.bot_data["tz"]
-    tab = context.application.bot_data["config"].google_appointments_tab
+    tab = appointments.tab_name
     zone = ZoneInfo(tz)
     today = datetime.now(zone).date()
     tomorrow = today + timedelta(days=1)
@@ -136,17 +278,25 @@ async def test_daily_debug_cmd(update: Update, context: ContextTypes.DEFAULT_TYP
         "",
     ]
 
+    await appointments.refresh(force=True)
+    fire_dates: dict[int, dict[str, date]] = {}
+    entries: dict[int, tuple[datetime, str]] = {}
+    for reminder in await appointments.reminders():
+        fire_dates.setdefault(reminder.row_index, {})[reminder.kind] = reminder.fire_date
+        entries[reminder.row_index] = (reminder.dt, reminder.username)
+
     count = 0
-    for entry in sheets.iter_entries(tab):
+    for row_index in sorted(entries):
         count += 1
-        entry_date = entry.dt.date()
-        if entry_date == tomorrow:
+        dt, username = entries[row_index]
+        fires = fire_dates[row_index]
+        if fires.get("appointment") == today:
             reason = "OK: напоминание на завтра"
-        elif entry_date + relativedelta(months=+6) == today:
+        elif fires.get("6m") == today:
             reason = "OK: 6-месячное напоминание"
         else:
-            reason = "NO: не завтра и не 6 месяцев"
-        line = f"{count}) {entry.dt.strftime('%d.%m.%Y %H:%M')} | {entry.username} | {reason}"
+            reason = "NO: 6 месяцев исполнится " + fires["6m"].strftime("%d.%m.%Y")
+        line = f"{count}) {dt.strftime('%d.%m.%Y %H:%M')} | {username} | {reason}"
         lines.append(line)
 
     if count == 0:
@@ -158,7 +308,7 @@ async def test_daily_debug_cmd(update: Update, context: ContextTypes.DEFAULT_TYP
 async def whoami_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.effective_user or not update.effective_chat:
         return
-    _record_user(update, context)
+    await _record_user(update, context)
     user = update.effective_user
     username = f"@{user.username}" if user.username else "нет username"
     await update.effective_chat.send_message(f"Ваш username: {username}")
@@ -168,45 +318,36 @@ async def remind_2w_cb(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     query = update.callback_query
     if not query or not query.message:
         return
-    _record_user(update, context)
+    await _record_user(update, context)
     await query.answer()
     await query.message.reply_text("Хорошо, вернёмся через 2 недели")
 
     scheduler = context.application.bot_data["scheduler"]
     tz = ZoneInfo(context.application.bot_data["tz"])
     run_date = datetime.now(tz) + timedelta(days=14)
-    chat_id = query.message.chat.id
-    job_id = f"remind_{chat_id}"
-    scheduler.add_job(
-        send_main_message,
-        trigger="date",
-        run_date=run_date,
-        id=job_id,
-        replace_existing=True,
-        args=[context.bot, chat_id],
-    )
+    schedule_2w_reminder(scheduler, query.message.chat.id, run_date)
 
 
 async def not_ready_cb(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     if not query or not query.message:
         return
-    _record_user(update, context)
+    await _record_user(update, context)
     await query.answer()
     await query.message.reply_text("Подскажите, пожалуйста, почему не получается?")
 
-    store: SQLiteStateStore = context.application.bot_data["store"]
+    store: AsyncSQLiteStateStore = context.application.bot_data["store"]
     tz = ZoneInfo(context.application.bot_data["tz"])
     user = query.from_user
     username = f"@{user.username}" if user and user.username else f"id:{user.id}"
-    store.set_pending(user.id, username, datetime.now(tz))
+    await store.set_pending(user.id, username, datetime.now(tz))
 
 
 async def confirm_appt_cb(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     if not query or not query.message:
         return
-    _record_user(update, context)
+    await _record_user(update, context)
     await query.answer()
     await query.message.reply_text("Отлично, будем ждать Вас!")
 
@@ -215,34 +356,40 @@ async def about_us_cb(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     query = update.callback_query
     if not query or not query.message:
         return
-    _record_user(update, context)
+    await _record_user(update, context)
     await query.answer()
-    await send_about_message(context.bot, query.message.chat.id)
+    await send_about_message(
+        context.bot, query.message.chat.id, context.application.bot_data["photo_cache"]
+    )
 
 
 async def go_start_cb(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     if not query or not query.message:
         return
-    _record_user(update, context)
+    await _record_user(update, context)
     await query.answer()
-    await send_info_start_message(context.bot, query.message.chat.id)
+    await send_info_start_message(
+        context.bot, query.message.chat.id, context.application.bot_data["photo_cache"]
+    )
 
 
 async def special_offers_cb(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     if not query or not query.message:
         return
-    _record_user(update, context)
+    await _record_user(update, context)
     await query.answer()
-    await send_special_offers_message(context.bot, query.message.chat.id)
+    await send_special_offers_message(
+        context.bot, query.message.chat.id, context.application.bot_data["photo_cache"]
+    )
 
 
 async def offer_adult_cb(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     if not query or not query.message:
         return
-    _record_user(update, context)
+    await _record_user(update, context)
     await query.answer()
     await query.message.reply_text(
         ADULT_SUBSCRIPTION_TEXT,
@@ -254,7 +401,7 @@ async def offer_child_cb(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     query = update.callback_query
     if not query or not query.message:
         return
-    _record_user(update, context)
+    await _record_user(update, context)
     await query.answer()
     await query.message.reply_text(
         CHILD_SUBSCRIPTION_TEXT,
@@ -266,7 +413,7 @@ async def offer_implant_cb(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     query = update.callback_query
     if not query or not query.message:
         return
-    _record_user(update, context)
+    await _record_user(update, context)
     await query.answer()
     await query.message.reply_text(
         IMPLANT_CROWN_TEXT,
@@ -278,7 +425,7 @@ async def offer_ultrasound_cb(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     if not query or not query.message:
         return
-    _record_user(update, context)
+    await _record_user(update, context)
     await query.answer()
     await query.message.reply_text(
         ULTRASOUND_EXTRACTION_TEXT,
@@ -290,7 +437,7 @@ async def offer_flash_cb(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     query = update.callback_query
     if not query or not query.message:
         return
-    _record_user(update, context)
+    await _record_user(update, context)
     await query.answer()
     await query.message.reply_text(
         FLASH_WHITENING_TEXT,
@@ -301,43 +448,32 @@ async def offer_flash_cb(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.message or not update.effective_user:
         return
-    _record_user(update, context)
-    store: SQLiteStateStore = context.application.bot_data["store"]
-    pending = store.pop_pending(update.effective_user.id)
+    await _record_user(update, context)
+    store: AsyncSQLiteStateStore = context.application.bot_data["store"]
+    pending = await store.pop_pending(update.effective_user.id)
     if not pending:
         return
 
-    sheets: SheetsClient = context.application.bot_data["sheets"]
+    outbox: SheetsOutbox = context.application.bot_data["outbox"]
     tz = ZoneInfo(context.application.bot_data["tz"])
-    now_str = datetime.now(tz).strftime("%d.%m.%Y %H:%M")
+    now = datetime.now(tz)
     comment = update.message.text.strip()
-    sheets.append_comment(
+    await outbox.enqueue(
         context.application.bot_data["config"].google_comments_tab,
-        [now_str, pending.username, comment],
+        [now.strftime("%d.%m.%Y %H:%M"), pending.username, comment],
+        now,
     )
     await update.message.reply_text("Спасибо, комментарий записан!")
 
 
-def _record_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def _record_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.effective_user:
         return
     user = update.effective_user
-    store: SQLiteStateStore = context.application.bot_data["store"]
+    user_cache: UserStateCache = context.application.bot_data["user_cache"]
     tz = ZoneInfo(context.application.bot_data["tz"])
-    now = datetime.now(tz)
-
-    if user.username:
-        store.upsert_user(user.username, user.id, now)
-        changed = store.upsert_client(user.id, user.username, now)
-    else:
-        changed = store.remove_client(user.id)
-
-    if not changed:
-        return
+    changed = await user_cache.record(user.id, user.username, user.id, datetime.now(tz))
 
-    sheets: SheetsClient = context.application.bot_data["sheets"]
-    clients_tab = context.application.bot_data["config"].google_clients_tab
-    try:
-        sheets.sync_client_usernames(clients_tab, store.list_client_usernames())
-    except Exception as exc:
-        logger.warning("Failed to sync clients sheet %s: %s", clients_tab, exc)
+    if changed:
+        clients_sync: ClientsSheetSync = context.application.bot_data["clients_sync"]
+        clients_sync.mark_dirty()
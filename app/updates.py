@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes, TypeHandler
+
+from app.metrics import UPDATE_QUEUE_WAIT
+from app.storage import AsyncSQLiteStateStore
+
+logger = logging.getLogger("golden-dent")
+
+
+class UpdateQueue:
+    def __init__(
+        self,
+        process: Callable[[Update], Awaitable[None]],
+        maxsize: int = 1000,
+        workers: int = 8,
+        put_timeout: float = 1.0,
+    ) -> None:
+        self._process = process
+        self._put_timeout = put_timeout
+        per_worker = max(maxsize // workers, 1)
+        self._queues: list[asyncio.Queue[tuple[Update, float]]] = [
+            asyncio.Queue(maxsize=per_worker) for _ in range(workers)
+        ]
+        self._tasks: list[asyncio.Task] = []
+        self.in_flight = 0
+        self.accepted_total = 0
+        self.rejected_total = 0
+        self.processed_total = 0
+        self.failed_total = 0
+        self.last_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._wait_sum = 0.0
+        self._waited = 0
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._worker(queue)) for queue in self._queues
+            ]
+
+    async def stop(self, drain_timeout: float = 5.0) -> None:
+        if not self._tasks:
+            return
+        with contextlib.suppress(TimeoutError):
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)), drain_timeout
+            )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, update: Update) -> bool:
+        queue = self._queues[_partition_key(update) % len(self._queues)]
+        try:
+            await asyncio.wait_for(queue.put((update, time.monotonic())), self._put_timeout)
+        except TimeoutError:
+            self.rejected_total += 1
+            logger.warning("Update queue is full, rejecting update %s", update.update_id)
+            return False
+        self.accepted_total += 1
+        return True
+
+    def stats(self) -> dict:
+        depth = sum(queue.qsize() for queue in self._queues)
+        return {
+            "queue_depth": depth,
+            "queue_capacity": sum(queue.maxsize for queue in self._queues),
+            "in_flight": self.in_flight,
+            "accepted_total": self.accepted_total,
+            "rejected_total": self.rejected_total,
+            "processed_total": self.processed_total,
+            "failed_total": self.failed_total,
+            "last_wait_seconds": round(self.last_wait_seconds, 3),
+            "avg_wait_seconds": round(self._wait_sum / self._waited, 3) if self._waited else 0.0,
+            "max_wait_seconds": round(self.max_wait_seconds, 3),
+        }
+
+    async def _worker(self, queue: asyncio.Queue[tuple[Update, float]]) -> None:
+        while True:
+            update, enqueued_at = await queue.get()
+            wait = time.monotonic() - enqueued_at
+            UPDATE_QUEUE_WAIT.observe(wait)
+            self.last_wait_seconds = wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+            self._wait_sum += wait
+            self._waited += 1
+            self.in_flight += 1
+            try:
+                await self._process(update)
+                self.processed_total += 1
+            except Exception:
+                self.failed_total += 1
+                logger.exception("Failed to process update %s", update.update_id)
+            finally:
+                self.in_flight -= 1
+                queue.task_done()
+
+
+class UpdateDeduplicator:
+    def __init__(
+        self, store: AsyncSQLiteStateStore, capacity: int = 10_000, flush_interval: float = 5.0
+    ) -> None:
+        self._store = store
+        self._capacity = capacity
+        self._flush_interval = flush_interval
+        self._order: deque[int] = deque()
+        self._seen: set[int] = set()
+        self._task: asyncio.Task | None = None
+        self.duplicates_total = 0
+
+    async def load(self) -> None:
+        for update_id in await self._store.list_seen_updates(self._capacity):
+            self._remember(update_id)
+
+    async def claim(self, update_id: int) -> bool:
+        if update_id in self._seen:
+            self.duplicates_total += 1
+            return False
+        self._remember(update_id)
+        # The local window only answers for this process; the insert decides between workers.
+        try:
+            claimed = await self._store.claim_update(update_id)
+        except Exception:
+            self._seen.discard(update_id)
+            raise
+        if not claimed:
+            self.duplicates_total += 1
+        return claimed
+
+    async def release(self, update_id: int) -> None:
+        self._seen.discard(update_id)
+        await self._store.release_update(update_id)
+
+    async def trim(self) -> None:
+        await self._store.trim_seen_updates(self._capacity)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        await self.trim()
+
+    def handler(self) -> TypeHandler:
+        async def drop_duplicate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+            if not await self.claim(update.update_id):
+                logger.info("Dropping duplicate update %s", update.update_id)
+                raise ApplicationHandlerStop
+
+        return TypeHandler(Update, drop_duplicate)
+
+    def _remember(self, update_id: int) -> None:
+        if update_id in self._seen:
+            return
+        self._order.append(update_id)
+        self._seen.add(update_id)
+        if len(self._order) > self._capacity:
+            self._seen.discard(self._order.popleft())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.trim()
+            except Exception:
+                logger.exception("Failed to trim seen update ids")
+
+
+def _partition_key(update: Update) -> int:
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return update.update_id
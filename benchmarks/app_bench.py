@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import platform
+import tempfile
+import time
+from datetime import UTC, datetime
+from pathlib import Path
+from types import SimpleNamespace
+from zoneinfo import ZoneInfo
+
+import httpx
+from telegram import Update
+
+from app.scheduler import send_daily_messages
+from app.telegram_bot import _record_user
+from benchmarks.environment import (
+    CONFIG,
+    TZ,
+    bind_webhook_app,
+    build_environment,
+    text_update,
+)
+from benchmarks.fakes import FakeBotAPI
+
+
+async def bench_daily(rows: int, args: argparse.Namespace) -> dict:
+    today = datetime.now(ZoneInfo(TZ)).date()
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = await build_environment(
+            data_dir,
+            today,
+            rows=rows,
+            bot_api=FakeBotAPI(args.bot_latency, args.rate_limit_every),
+            sheets_latency=args.sheets_latency,
+            rate_per_second=args.rate,
+        )
+        now = datetime.now(UTC)
+        for index in range(rows):
+            env.store.sync.upsert_user(f"user{index}", 10_000 + index, now)
+
+        started = time.perf_counter()
+        stats = await send_daily_messages(
+            env.application.bot,
+            env.appointments,
+            CONFIG.google_undelivered_tab,
+            TZ,
+            env.store,
+            env.outbox,
+            env.engine,
+            args.shards,
+        )
+        cold = time.perf_counter() - started
+
+        started = time.perf_counter()
+        rerun = await send_daily_messages(
+            env.application.bot,
+            env.appointments,
+            CONFIG.google_undelivered_tab,
+            TZ,
+            env.store,
+            env.outbox,
+            env.engine,
+            args.shards,
+        )
+        warm = time.perf_counter() - started
+        await env.close()
+
+    return {
+        "rows": rows,
+        "shards": args.shards,
+        "messages": stats.total,
+        "sent": stats.sent,
+        "failed": stats.failed,
+        "run_seconds": round(cold, 4),
+        "send_rate": round(stats.rate, 1),
+        "rerun_seconds": round(warm, 4),
+        "rerun_messages": rerun.total,
+    }
+
+
+async def bench_record_user(iterations: int, users: int) -> dict:
+    today = datetime.now(ZoneInfo(TZ)).date()
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = await build_environment(data_dir, today)
+        context = SimpleNamespace(application=env.application)
+        updates = [
+            Update.de_json(text_update(index, 1 + index % users, "hi"), env.application.bot)
+            for index in range(iterations)
+        ]
+
+        started = time.perf_counter()
+        for update in updates[:users]:
+            await _record_user(update, context)
+        cold = (time.perf_counter() - started) / min(users, iterations)
+
+        started = time.perf_counter()
+        for update in updates:
+            await _record_user(update, context)
+        hot = (time.perf_counter() - started) / iterations
+        await env.close()
+
+    return {
+        "iterations": iterations,
+        "distinct_users": users,
+        "first_seen_us": round(cold * 1_000_000, 1),
+        "repeat_us": round(hot * 1_000_000, 1),
+    }
+
+
+async def bench_webhook(updates: int, args: argparse.Namespace) -> dict:
+    today = datetime.now(ZoneInfo(TZ)).date()
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = await build_environment(
+            data_dir, today, bot_api=FakeBotAPI(args.bot_latency, args.rate_limit_every)
+        )
+        app = bind_webhook_app(env)
+        queue = app.state.update_queue
+        payloads = [
+            text_update(index, 1 + index % 500, "/start" if index % 4 == 0 else "hello")
+            for index in range(updates)
+        ]
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.perf_counter()
+            for payload in payloads:
+                response = await client.post("/webhook", json=payload)
+                response.raise_for_status()
+            acked = time.perf_counter() - started
+            while queue.stats()["processed_total"] + queue.stats()["failed_total"] < updates:
+                await asyncio.sleep(0.005)
+            drained = time.perf_counter() - started
+
+        stats = queue.stats()
+        await queue.stop()
+        await env.close()
+
+    return {
+        "updates": updates,
+        "ack_per_second": round(updates / acked, 1),
+        "processed_per_second": round(updates / drained, 1),
+        "failed": stats["failed_total"],
+        "max_queue_wait_seconds": stats["max_wait_seconds"],
+        "bot_api_calls": sum(env.bot_api.calls.values()),
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    results: dict[str, dict] = {}
+    for rows in args.rows:
+        results[f"daily_{rows}"] = await bench_daily(rows, args)
+    results["record_user"] = await bench_record_user(args.iterations, args.users)
+    results["webhook"] = await bench_webhook(args.updates, args)
+    return results
+
+
+def compare(results: dict, baseline: dict) -> list[str]:
+    lines = [f"{'metric':<40}{'baseline':>14}{'current':>14}{'change':>10}"]
+    for scenario, metrics in results.items():
+        for name, value in metrics.items():
+            old = baseline.get(scenario, {}).get(name)
+            if not isinstance(value, int | float) or not isinstance(old, int | float):
+                continue
+            change = f"{(value - old) / old * 100:+.1f}%" if old else "n/a"
+            lines.append(f"{scenario + '.' + name:<40}{old:>14}{value:>14}{change:>10}")
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmarks")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--iterations", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--updates", type=int, default=2_000)
+    parser.add_argument("--bot-latency", type=float, default=0.0)
+    parser.add_argument("--sheets-latency", type=float, default=0.0)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--rate", type=float, default=1_000.0)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--baseline", type=Path)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report = {
+        "meta": {
+            "created_at": datetime.now(UTC).isoformat(),
+            "python": platform.python_version(),
+            "args": {key: str(value) for key, value in vars(args).items()},
+        },
+        "results": results,
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))["results"]
+        print("\n".join(compare(results, baseline)))
+
+
+if __name__ == "__main__":
+    main()
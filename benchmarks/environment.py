@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from datetime import date
+from types import SimpleNamespace
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from fastapi import FastAPI
+from telegram import Update
+from telegram.ext import Application
+
+from app.appointments import AppointmentsMirror
+from app.broadcast import BroadcastEngine
+from app.clients_sync import ClientsSheetSync
+from app.main import app as webhook_app
+from app.outbox import SheetsOutbox
+from app.scheduler import build_scheduler
+from app.sheets import AsyncSheetsClient
+from app.storage import AsyncSQLiteStateStore, SQLiteStateStore, UserStateCache
+from app.telegram_bot import build_application
+from app.updates import UpdateDeduplicator, UpdateQueue
+from benchmarks.fakes import (
+    BOT_USER,
+    FakeBotAPI,
+    FakeSpreadsheet,
+    FakeWorksheet,
+    appointment_rows,
+    fake_sheets_client,
+)
+
+TZ = "Asia/Novosibirsk"
+BOT_TOKEN = "123456:BENCHMARK"
+CONFIG = SimpleNamespace(
+    bot_token=BOT_TOKEN,
+    webhook_secret_token=None,
+    google_comments_tab="comments",
+    google_appointments_tab="appointments",
+    google_undelivered_tab="undelivered",
+    google_clients_tab="clients",
+    daily_shards=1,
+    appointment_reminder_mode="daily",
+    reminder_catch_up_days=0,
+    admin_chat_id=None,
+)
+
+
+@dataclass
+class Environment:
+    bot_api: FakeBotAPI
+    spreadsheet: FakeSpreadsheet
+    store: AsyncSQLiteStateStore
+    sheets: AsyncSheetsClient
+    outbox: SheetsOutbox
+    clients_sync: ClientsSheetSync
+    user_cache: UserStateCache
+    appointments: AppointmentsMirror
+    engine: BroadcastEngine
+    scheduler: AsyncIOScheduler
+    application: Application
+
+    async def close(self) -> None:
+        self.scheduler.shutdown(wait=False)
+        await self.clients_sync.stop()
+        await self.outbox.stop()
+        await self.application.shutdown()
+        self.sheets.shutdown()
+        self.store.close()
+
+
+async def build_environment(
+    data_dir: str,
+    today: date,
+    rows: int = 0,
+    bot_api: FakeBotAPI | None = None,
+    sheets_latency: float = 0.0,
+    rate_per_second: float = 1000.0,
+) -> Environment:
+    bot_api = bot_api or FakeBotAPI()
+    spreadsheet = FakeSpreadsheet(
+        {
+            CONFIG.google_appointments_tab: FakeWorksheet(
+                CONFIG.google_appointments_tab, appointment_rows(rows, today), sheets_latency
+            ),
+            CONFIG.google_comments_tab: FakeWorksheet(
+                CONFIG.google_comments_tab, [], sheets_latency
+            ),
+            CONFIG.google_undelivered_tab: FakeWorksheet(
+                CONFIG.google_undelivered_tab, [], sheets_latency
+            ),
+            CONFIG.google_clients_tab: FakeWorksheet(
+                CONFIG.google_clients_tab, [["tg_username"]], sheets_latency
+            ),
+        },
+        latency=sheets_latency,
+    )
+    sheets = AsyncSheetsClient(fake_sheets_client(spreadsheet))
+    store = AsyncSQLiteStateStore(SQLiteStateStore(data_dir))
+    user_cache = UserStateCache(store)
+    outbox = SheetsOutbox(store, sheets)
+    appointments = AppointmentsMirror(store, sheets, CONFIG.google_appointments_tab)
+    clients_sync = ClientsSheetSync(store, sheets, CONFIG.google_clients_tab)
+    engine = BroadcastEngine(rate_per_second=rate_per_second, per_chat_interval=0.0)
+    scheduler = build_scheduler(data_dir, TZ)
+    scheduler.start(paused=True)
+    application = build_application(
+        BOT_TOKEN,
+        TZ,
+        sheets,
+        store,
+        scheduler,
+        CONFIG,
+        outbox,
+        clients_sync,
+        user_cache,
+        appointments,
+        engine,
+        request=bot_api,
+    )
+    await application.initialize()
+    return Environment(
+        bot_api=bot_api,
+        spreadsheet=spreadsheet,
+        store=store,
+        sheets=sheets,
+        outbox=outbox,
+        clients_sync=clients_sync,
+        user_cache=user_cache,
+        appointments=appointments,
+        engine=engine,
+        scheduler=scheduler,
+        application=application,
+    )
+
+
+def bind_webhook_app(
+    env: Environment,
+    workers: int = 8,
+    queue_size: int = 1000,
+    process: Callable[[Update], Awaitable[None]] | None = None,
+) -> FastAPI:
+    webhook_app.state.config = CONFIG
+    webhook_app.state.application = env.application
+    webhook_app.state.update_queue = UpdateQueue(
+        process or env.application.process_update, maxsize=queue_size, workers=workers
+    )
+    webhook_app.state.dedup = UpdateDeduplicator(env.store)
+    webhook_app.state.update_queue.start()
+    return webhook_app
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": "User", "username": f"user{user_id}"}
+
+
+def text_update(update_id: int, user_id: int, text: str) -> dict:
+    user = _user(user_id)
+    message = {
+        "message_id": update_id,
+        "date": 0,
+        "chat": {"id": user_id, "type": "private"},
+        "from": user,
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return {"update_id": update_id, "message": message}
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "menu",
+            },
+        },
+    }
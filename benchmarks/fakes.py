@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from unittest import mock
+
+import gspread
+from telegram.request import BaseRequest, RequestData
+
+from app.sheets import SheetsClient
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Golden Dent", "username": "golden_dent_bot"}
+
+
+class FakeBotAPI(BaseRequest):
+    def __init__(
+        self, latency: float = 0.0, rate_limit_every: int = 0, retry_after: int = 1
+    ) -> None:
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.calls: dict[str, int] = {}
+        self.rate_limited = 0
+        self._message_id = 0
+
+    @property
+    def read_timeout(self) -> float | None:
+        return None
+
+    async def initialize(self) -> None:
+        return None
+
+    async def shutdown(self) -> None:
+        return None
+
+    async def do_request(
+        self, url: str, method: str, request_data: RequestData | None = None, **kwargs
+    ) -> tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        calls = self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if (
+            self.rate_limit_every
+            and endpoint.startswith("send")
+            and calls % self.rate_limit_every == 0
+        ):
+            self.rate_limited += 1
+            return 429, _payload(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+            )
+        params = request_data.parameters if request_data else {}
+        return 200, _payload({"ok": True, "result": self._result(endpoint, params)})
+
+    def _result(self, endpoint: str, params: dict) -> object:
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint in ("sendMessage", "sendPhoto"):
+            self._message_id += 1
+            chat_id = params.get("chat_id")
+            message = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {
+                    "id": chat_id if isinstance(chat_id, int) else abs(hash(chat_id)) % 10**9,
+                    "type": "private",
+                },
+                "from": BOT_USER,
+            }
+            if endpoint == "sendPhoto":
+                message["photo"] = [
+                    {
+                        "file_id": f"photo-{self._message_id}",
+                        "file_unique_id": f"unique-{self._message_id}",
+                        "width": 640,
+                        "height": 480,
+                    }
+                ]
+            else:
+                message["text"] = params.get("text", "")
+            return message
+        return True
+
+
+class FakeWorksheet:
+    def __init__(self, title: str, rows: list[list[str]], latency: float = 0.0) -> None:
+        self.id = abs(hash(title)) % 10**6
+        self.title = title
+        self.rows = rows
+        self.latency = latency
+
+    def _wait(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_all_values(self) -> list[list[str]]:
+        self._wait()
+        return [list(row) for row in self.rows]
+
+    def get_values(self, range_name: str) -> list[list[str]]:
+        self._wait()
+        return [list(row[:2]) for row in self.rows[1:]]
+
+    def col_values(self, col: int) -> list[str]:
+        self._wait()
+        return [row[col - 1] if len(row) >= col else "" for row in self.rows]
+
+    def append_row(self, row: list[str], value_input_option=None) -> None:
+        self._wait()
+        self.rows.append(list(row))
+
+    def append_rows(self, rows: list[list[str]], value_input_option=None) -> None:
+        self._wait()
+        self.rows.extend(list(row) for row in rows)
+
+    def update(self, range_name: str, values: list[list[str]], value_input_option=None) -> None:
+        self._wait()
+        for index, value in enumerate(values):
+            if index < len(self.rows):
+                self.rows[index][:1] = value
+            else:
+                self.rows.append(list(value))
+
+    def batch_clear(self, ranges: list[str]) -> None:
+        self._wait()
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheets: dict[str, FakeWorksheet], latency: float = 0.0) -> None:
+        self.worksheets = worksheets
+        self.latency = latency
+        self.batch_updates = 0
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        if self.latency:
+            time.sleep(self.latency)
+        if title not in self.worksheets:
+            raise gspread.WorksheetNotFound(title)
+        return self.worksheets[title]
+
+    def batch_update(self, body: dict) -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        self.batch_updates += 1
+        return {}
+
+
+class FakeGspreadClient:
+    def __init__(self, spreadsheet: FakeSpreadsheet) -> None:
+        self.spreadsheet = spreadsheet
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        return self.spreadsheet
+
+
+@contextmanager
+def fake_gspread(spreadsheet: FakeSpreadsheet):
+    with mock.patch.object(
+        gspread, "service_account", lambda filename: FakeGspreadClient(spreadsheet)
+    ):
+        yield
+
+
+def fake_sheets_client(spreadsheet: FakeSpreadsheet) -> SheetsClient:
+    with fake_gspread(spreadsheet):
+        return SheetsClient("bench-sheet", "service-account.json")
+
+
+def appointment_rows(count: int, today: date, seed: int = 1) -> list[list[str]]:
+    rng = random.Random(seed)
+    rows = [["Дата и время", "tg_username"]]
+    for index in range(count):
+        day = today + timedelta(days=rng.randint(-200, 60))
+        hour, minute = rng.randint(8, 20), rng.choice([0, 15, 30, 45])
+        rows.append([f"{day:%d.%m.%Y} {hour:02d}:{minute:02d}", f"@user{index}"])
+    return rows
+
+
+def _payload(data: dict) -> bytes:
+    return json.dumps(data).encode("utf-8")
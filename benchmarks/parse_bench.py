@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from collections.abc import Callable
+from datetime import datetime
+
+from app.sheets import _parse_datetime
+
+
+def parse_datetime_strptime(value: str) -> datetime | None:
+    for fmt in ("%d.%m.%Y %H:%M", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def make_cells(rows: int, seed: int = 1) -> list[str]:
+    rng = random.Random(seed)
+    cells = []
+    for _ in range(rows):
+        day, month, year = rng.randint(1, 28), rng.randint(1, 12), rng.choice([2025, 2026])
+        hour, minute = rng.randint(8, 20), rng.choice([0, 15, 30, 45])
+        fmt = rng.random()
+        if fmt < 0.6:
+            cells.append(f"{day:02d}.{month:02d}.{year} {hour:02d}:{minute:02d}")
+        elif fmt < 0.8:
+            cells.append(f"{day:02d}.{month:02d}.{year} {hour:02d}:{minute:02d}:00")
+        else:
+            cells.append(f"{day:02d}.{month:02d}.{year}")
+    return cells
+
+
+def _measure(parse: Callable[[str], datetime | None], cells: list[str]) -> float:
+    started = time.perf_counter()
+    for cell in cells:
+        parse(cell)
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Appointment datetime parser benchmark")
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    cells = make_cells(args.rows)
+    baseline = _measure(parse_datetime_strptime, cells)
+    _parse_datetime.cache_clear()
+    cold = _measure(_parse_datetime.__wrapped__, cells)
+    _parse_datetime.cache_clear()
+    cached = _measure(_parse_datetime, cells)
+
+    print(f"rows: {args.rows}, distinct cells: {len(set(cells))}")
+    for name, seconds in (
+        ("strptime", baseline),
+        ("single pass", cold),
+        ("single pass, memoized", cached),
+    ):
+        print(f"{name:<24}{seconds * 1000:>10.1f} ms{baseline / seconds:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
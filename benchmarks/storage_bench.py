@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import argparse
+import sqlite3
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import datetime
+
+from app.storage import SQLiteStateStore
+
+
+class PerCallConnectionStore(SQLiteStateStore):
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path)
+
+
+def _measure(func: Callable[[int], object], iterations: int) -> float:
+    started = time.perf_counter()
+    for index in range(iterations):
+        func(index)
+    return (time.perf_counter() - started) / iterations * 1_000_000
+
+
+def _run(store: SQLiteStateStore, iterations: int) -> dict[str, float]:
+    now = datetime(2026, 2, 11, 10, 0, 0)
+    for index in range(iterations):
+        store.upsert_user(f"user{index}", index, now)
+        store.set_pending(index, f"@user{index}", now)
+    return {
+        "get_chat_id": _measure(lambda index: store.get_chat_id(f"user{index}"), iterations),
+        "upsert_user": _measure(
+            lambda index: store.upsert_user(f"user{index}", index, now), iterations
+        ),
+        "pop_pending": _measure(store.pop_pending, iterations),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SQLiteStateStore per-operation latency")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as before_dir, tempfile.TemporaryDirectory() as after_dir:
+        before = _run(PerCallConnectionStore(before_dir), args.iterations)
+        pooled = SQLiteStateStore(after_dir)
+        after = _run(pooled, args.iterations)
+        pooled.close()
+
+    print(f"{'operation':<14}{'per-call conn, us':>20}{'pooled, us':>14}{'speedup':>10}")
+    for name in before:
+        speedup = before[name] / after[name]
+        print(f"{name:<14}{before[name]:>20.1f}{after[name]:>14.1f}{speedup:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import random
+import tempfile
+import time
+from datetime import UTC, datetime
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+import httpx
+from telegram import Update
+from telegram.ext import Application, CallbackQueryHandler
+
+from benchmarks.environment import (
+    TZ,
+    bind_webhook_app,
+    build_environment,
+    callback_update,
+    text_update,
+)
+from benchmarks.fakes import FakeBotAPI
+
+
+def callback_data_values(application: Application) -> list[str]:
+    values = []
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, CallbackQueryHandler) and handler.pattern is not None:
+                values.append(handler.pattern.pattern.strip("^$"))
+    return values
+
+
+class PayloadFactory:
+    def __init__(self, callback_data: list[str], users: int, seed: int = 1) -> None:
+        self._callback_data = callback_data
+        self._users = users
+        self._rng = random.Random(seed)
+        self._update_ids = itertools.count(1)
+
+    def __call__(self) -> dict:
+        update_id = next(self._update_ids)
+        user_id = self._rng.randint(1, self._users)
+        roll = self._rng.random()
+        if roll < 0.2:
+            return text_update(update_id, user_id, "/start")
+        if roll < 0.4:
+            return text_update(update_id, user_id, "Перезвоните мне, пожалуйста")
+        return callback_update(update_id, user_id, self._rng.choice(self._callback_data))
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def _summary(values: list[float]) -> dict:
+    return {
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(max(values, default=0.0) * 1000, 2),
+    }
+
+
+async def run_step(
+    client: httpx.AsyncClient,
+    make_payload: PayloadFactory,
+    started_at: dict[int, float],
+    finished_at: dict[int, float],
+    rate: float,
+    duration: float,
+    concurrency: int,
+) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    ack_latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    update_ids: list[int] = []
+
+    async def fire(payload: dict) -> None:
+        async with semaphore:
+            sent = time.perf_counter()
+            started_at[payload["update_id"]] = sent
+            response = await client.post("/webhook", json=payload)
+            ack_latencies.append(time.perf_counter() - sent)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    tasks = []
+    begin = time.perf_counter()
+    count = 0
+    while (elapsed := time.perf_counter() - begin) < duration:
+        if rate > 0 and count >= elapsed * rate:
+            await asyncio.sleep(max(count / rate - elapsed, 0.0005))
+            continue
+        payload = make_payload()
+        update_ids.append(payload["update_id"])
+        tasks.append(asyncio.create_task(fire(payload)))
+        count += 1
+        if rate <= 0:
+            await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+
+    accepted = [update_id for update_id in update_ids if update_id in started_at]
+    deadline = time.perf_counter() + 30
+    while time.perf_counter() < deadline and any(uid not in finished_at for uid in accepted):
+        await asyncio.sleep(0.01)
+    wall = time.perf_counter() - begin
+
+    processing = [
+        finished_at[uid] - started_at[uid] for uid in accepted if uid in finished_at
+    ]
+    return {
+        "offered_rate": rate,
+        "sent": count,
+        "statuses": {str(code): total for code, total in sorted(statuses.items())},
+        "sustained_per_second": round(len(processing) / wall, 1) if wall else 0.0,
+        "ack": _summary(ack_latencies),
+        "end_to_end": _summary(processing),
+    }
+
+
+async def run(args: argparse.Namespace) -> list[dict]:
+    today = datetime.now(ZoneInfo(TZ)).date()
+    started_at: dict[int, float] = {}
+    finished_at: dict[int, float] = {}
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = await build_environment(
+            data_dir, today, bot_api=FakeBotAPI(args.bot_latency, args.rate_limit_every)
+        )
+
+        async def process(update: Update) -> None:
+            try:
+                await env.application.process_update(update)
+            finally:
+                finished_at[update.update_id] = time.perf_counter()
+
+        app = bind_webhook_app(
+            env, workers=args.workers, queue_size=args.queue_size, process=process
+        )
+        make_payload = PayloadFactory(callback_data_values(env.application), args.users)
+        transport = httpx.ASGITransport(app=app)
+        results = []
+        async with httpx.AsyncClient(transport=transport, base_url="http://load") as client:
+            for rate in args.rates:
+                step = await run_step(
+                    client,
+                    make_payload,
+                    started_at,
+                    finished_at,
+                    rate,
+                    args.duration,
+                    args.concurrency,
+                )
+                results.append(step)
+                print(_format_step(step), flush=True)
+        await app.state.update_queue.stop()
+        await env.close()
+    return results
+
+
+def _format_step(step: dict) -> str:
+    return (
+        f"rate {step['offered_rate']:>7.0f}/s  sent {step['sent']:>6}  "
+        f"sustained {step['sustained_per_second']:>7.1f}/s  "
+        f"ack p50/p95/p99 {step['ack']['p50_ms']}/{step['ack']['p95_ms']}/"
+        f"{step['ack']['p99_ms']} ms  "
+        f"e2e p50/p95/p99 {step['end_to_end']['p50_ms']}/{step['end_to_end']['p95_ms']}/"
+        f"{step['end_to_end']['p99_ms']} ms  statuses {step['statuses']}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Webhook load test against the ASGI app")
+    parser.add_argument("--rates", type=float, nargs="+", default=[100, 250, 500, 1000, 0])
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--queue-size", type=int, default=1_000)
+    parser.add_argument("--bot-latency", type=float, default=0.02)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        report = {
+            "meta": {
+                "created_at": datetime.now(UTC).isoformat(),
+                "python": platform.python_version(),
+                "args": {key: str(value) for key, value in vars(args).items()},
+            },
+            "results": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import asyncio
+from datetime import date, timedelta
+
+from dateutil.relativedelta import relativedelta
+
+from app.appointments import AppointmentsMirror, six_month_fire_date
+from app.storage import AsyncSQLiteStateStore, SQLiteStateStore
+
+
+class FakeSheets:
+    def __init__(self, rows: list[list[str]]) -> None:
+        self.rows = rows
+        self.fetches = 0
+
+    async def get_values(self, tab_name, range_name):
+        self.fetches += 1
+        return [list(row) for row in self.rows]
+
+
+def _rows(count: int) -> list[list[str]]:
+    return [[f"{day % 28 + 1:02d}.03.2026 10:00", f"@user{day}"] for day in range(count)]
+
+
+def test_mirror_refreshes_only_changed_blocks(tmp_path):
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    sheets = FakeSheets(_rows(10))
+    mirror = AppointmentsMirror(store, sheets, "appointments", block_size=4)
+
+    async def run() -> None:
+        assert await mirror.refresh(force=True) == 3
+        assert len(await mirror.all_entries()) == 10
+
+        assert await mirror.refresh(force=False) == 0
+        assert sheets.fetches == 1
+
+        assert await mirror.refresh(force=True) == 0
+        assert sheets.fetches == 2
+
+        sheets.rows[5] = ["15.04.2026 09:30", "@changed"]
+        sheets.rows.append(["bad date", "@ignored"])
+        mirror._last_refresh = None
+        assert await mirror.refresh() == 2
+
+        entries = await mirror.entries_on([date(2026, 4, 15)])
+        assert [(entry.username, entry.dt.hour) for entry in entries] == [("@changed", 9)]
+
+        del sheets.rows[4:]
+        assert await mirror.refresh(force=True) == 0
+        assert len(await mirror.all_entries()) == 4
+
+    asyncio.run(run())
+
+
+def test_six_month_fire_date_clips_to_month_end():
+    assert six_month_fire_date(date(2026, 2, 15)) == date(2026, 8, 15)
+    assert six_month_fire_date(date(2025, 8, 31)) == date(2026, 2, 28)
+    assert six_month_fire_date(date(2027, 8, 31)) == date(2028, 2, 29)
+    assert six_month_fire_date(date(2027, 8, 29)) == date(2028, 2, 29)
+    assert six_month_fire_date(date(2026, 3, 31)) == date(2026, 9, 30)
+    assert six_month_fire_date(date(2026, 12, 31)) == date(2027, 6, 30)
+    assert six_month_fire_date(date(2028, 2, 29)) == date(2028, 8, 29)
+    assert six_month_fire_date(date(2026, 7, 1)) == date(2027, 1, 1)
+
+
+def test_six_month_fire_date_matches_relativedelta():
+    day = date(2024, 1, 1)
+    while day < date(2029, 1, 1):
+        assert six_month_fire_date(day) == day + relativedelta(months=+6)
+        day += timedelta(days=1)
+
+
+def test_due_queue_is_filled_on_ingestion(tmp_path):
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    sheets = FakeSheets(
+        [
+            ["31.08.2025 10:00", "@late_summer"],
+            ["30.08.2025 11:00", "@also_late"],
+            ["28.02.2026 12:00", "@tomorrow"],
+            ["15.01.2026 09:00", "@other"],
+        ]
+    )
+    mirror = AppointmentsMirror(store, sheets, "appointments", block_size=2)
+
+    async def run() -> None:
+        await mirror.refresh(force=True)
+        due = await mirror.due_between(date(2026, 2, 27), date(2026, 2, 27))
+        assert [(reminder.kind, reminder.username) for reminder in due] == [
+            ("appointment", "@tomorrow")
+        ]
+        due = await mirror.due_between(date(2026, 2, 28), date(2026, 2, 28))
+        assert [(reminder.kind, reminder.username) for reminder in due] == [
+            ("6m", "@late_summer"),
+            ("6m", "@also_late"),
+        ]
+
+        sheets.rows[2] = ["01.03.2026 12:00", "@tomorrow"]
+        await mirror.refresh(force=True)
+        assert await mirror.due_between(date(2026, 2, 27), date(2026, 2, 27)) == []
+        due = await mirror.due_between(date(2026, 2, 27), date(2026, 2, 28))
+        assert [reminder.username for reminder in due] == [
+            "@late_summer",
+            "@also_late",
+            "@tomorrow",
+        ]
+
+        del sheets.rows[2:]
+        await mirror.refresh(force=True)
+        assert len(await mirror.reminders()) == 4
+
+    asyncio.run(run())
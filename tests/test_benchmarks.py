@@ -0,0 +1,16 @@
+import asyncio
+from datetime import date
+
+from benchmarks.environment import CONFIG, build_environment
+
+
+def test_benchmark_environment_builds(tmp_path):
+    async def run() -> list[str]:
+        env = await build_environment(str(tmp_path), date(2026, 3, 1), rows=3)
+        try:
+            return [handler.callback.__name__ for handler in env.application.handlers[0]]
+        finally:
+            await env.close()
+
+    assert "replay_dead_letters_cmd" in asyncio.run(run())
+    assert CONFIG.admin_chat_id is None
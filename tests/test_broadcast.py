@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+from app.broadcast import BroadcastEngine, BroadcastJob, TokenBucket
+
+
+def test_token_bucket_limits_rate():
+    async def run() -> float:
+        bucket = TokenBucket(rate=100.0, capacity=1.0)
+        started = time.monotonic()
+        for _ in range(11):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.09
+
+
+def test_engine_counts_results_and_keeps_per_chat_order():
+    calls: list[tuple[str, int]] = []
+
+    def make_send(chat: str, index: int, ok: bool):
+        async def send() -> bool:
+            calls.append((chat, index))
+            await asyncio.sleep(0)
+            if index == 99:
+                raise RuntimeError("boom")
+            return ok
+
+        return send
+
+    jobs = [
+        BroadcastJob("@a", make_send("@a", 0, True)),
+        BroadcastJob("@b", make_send("@b", 0, False)),
+        BroadcastJob("@a", make_send("@a", 1, True)),
+        BroadcastJob("@c", make_send("@c", 99, True)),
+    ]
+    engine = BroadcastEngine(rate_per_second=1000.0, concurrency=3, per_chat_interval=0.01)
+    stats = asyncio.run(engine.run(jobs))
+
+    assert (stats.total, stats.sent, stats.failed) == (4, 2, 2)
+    assert stats.finished_at is not None
+    assert [index for chat, index in calls if chat == "@a"] == [0, 1]
+
+
+def test_pausing_a_shard_bucket_pauses_every_shard():
+    async def run() -> float:
+        engine = BroadcastEngine(rate_per_second=1000.0)
+        first, second = engine.shard(2), engine.shard(2)
+        first.bucket.pause(0.05)
+        started = time.monotonic()
+        await second.bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.04
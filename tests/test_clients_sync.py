@@ -0,0 +1,82 @@
+import asyncio
+from datetime import datetime
+
+from app.clients_sync import ClientsSheetSync, column_edits
+from app.storage import AsyncSQLiteStateStore, SQLiteStateStore
+
+NOW = datetime(2026, 2, 11, 10, 0, 0)
+
+
+def _apply(column: list[str], edits) -> list[str]:
+    result = list(column)
+    for edit in sorted(edits, key=lambda item: item.start, reverse=True):
+        result[edit.start : edit.start + edit.delete_count] = edit.values
+    return result
+
+
+def test_column_edits_are_minimal_and_reproduce_target():
+    existing = ["tg_username", "@anna", "@boris", "@dmitry", "@oleg"]
+    target = ["tg_username", "@anna", "@boris", "@egor", "@oleg", "@pavel"]
+
+    edits = column_edits(existing, target)
+
+    assert _apply(existing, edits) == target
+    assert sum(edit.delete_count + len(edit.values) for edit in edits) == 3
+    assert column_edits(target, target) == []
+
+
+class FakeSheets:
+    def __init__(self, column: list[str]) -> None:
+        self.column = column
+        self.full_syncs = 0
+        self.edit_calls = 0
+
+    async def sync_client_usernames(self, tab_name, usernames):
+        self.full_syncs += 1
+        self.column = ["tg_username", *sorted(usernames)]
+        return list(self.column)
+
+    async def apply_column_edits(self, tab_name, edits):
+        self.edit_calls += 1
+        self.column = _apply(self.column, edits)
+
+
+def test_burst_of_changes_is_flushed_as_one_batch(tmp_path):
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    store.sync.upsert_client(1, "anna", NOW)
+    sheets = FakeSheets(["tg_username"])
+
+    async def run() -> None:
+        sync = ClientsSheetSync(store, sheets, "clients", debounce=0.01)
+        await sync.reconcile()
+        for user_id, username in enumerate(["boris", "dmitry", "egor"], start=2):
+            await store.upsert_client(user_id, username, NOW)
+            sync.mark_dirty()
+        await asyncio.sleep(0.05)
+        await sync.stop()
+
+    asyncio.run(run())
+
+    assert sheets.full_syncs == 1
+    assert sheets.edit_calls == 1
+    assert sheets.column == ["tg_username", "@anna", "@boris", "@dmitry", "@egor"]
+
+
+def test_inactive_sync_only_records_dirty_state(tmp_path):
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    sheets = FakeSheets(["tg_username"])
+
+    async def run() -> None:
+        sync = ClientsSheetSync(store, sheets, "clients", debounce=0.01, active=False)
+        await store.upsert_client(1, "anna", NOW)
+        sync.mark_dirty()
+        await asyncio.sleep(0.05)
+        assert sheets.full_syncs == 0
+
+        sync.active = True
+        sync.mark_dirty()
+        await asyncio.sleep(0.05)
+        await sync.stop()
+
+    asyncio.run(run())
+    assert sheets.column == ["tg_username", "@anna"]
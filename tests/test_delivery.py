@@ -0,0 +1,174 @@
+import asyncio
+import random
+from datetime import UTC, datetime, timedelta
+from functools import partial
+from zoneinfo import ZoneInfo
+
+import pytest
+from telegram.error import BadRequest, Forbidden, RetryAfter, TimedOut
+
+from app.broadcast import BroadcastEngine, RetryPolicy, TokenBucket
+from app.delivery import (
+    PERMANENT,
+    RETRY_AFTER,
+    TRANSIENT,
+    DeliveryError,
+    classify_error,
+    deliver,
+    retry_delay,
+    send_6m_message,
+    send_with_retry,
+)
+from app.outbox import SheetsOutbox
+from app.scheduler import replay_dead_letters
+from app.storage import AsyncSQLiteStateStore, SQLiteStateStore
+
+TZ = "Asia/Novosibirsk"
+
+
+class ScriptedBot:
+    def __init__(self, errors: list[Exception]) -> None:
+        self.errors = errors
+        self.sent: list[object] = []
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(chat_id)
+
+
+def test_errors_are_classified_by_type():
+    assert classify_error(RetryAfter(3)) == RETRY_AFTER
+    assert classify_error(TimedOut()) == TRANSIENT
+    assert classify_error(BadRequest("Chat not found")) == PERMANENT
+    assert classify_error(Forbidden("bot was blocked by the user")) == PERMANENT
+
+
+def test_retry_delay_honors_retry_after_and_backs_off():
+    policy = RetryPolicy(base_delay=1.0, max_delay=8.0, jitter=0.1)
+    rng = random.Random(1)
+    delay = retry_delay(RetryAfter(5), 1, policy, rng)
+    assert 5.0 <= delay <= 6.5
+    delays = [retry_delay(TimedOut(), attempt, policy, rng) for attempt in range(1, 6)]
+    bounds = [(0.5, 1.0), (1.0, 2.0), (2.0, 4.0), (4.0, 8.0), (4.0, 8.0)]
+    assert all(low <= value <= high for value, (low, high) in zip(delays, bounds, strict=True))
+
+
+def test_send_with_retry_stops_on_permanent_errors():
+    policy = RetryPolicy(attempts=3, base_delay=0.0)
+
+    async def run() -> None:
+        bot = ScriptedBot([RetryAfter(0), TimedOut()])
+        await send_with_retry(lambda: bot.send_message(1, "hi"), policy)
+        assert bot.sent == [1]
+
+        bot = ScriptedBot([TimedOut(), BadRequest("Chat not found")])
+        with pytest.raises(DeliveryError) as info:
+            await send_with_retry(lambda: bot.send_message(1, "hi"), policy)
+        assert (info.value.category, info.value.attempts) == (PERMANENT, 2)
+
+        bot = ScriptedBot([TimedOut()] * 3)
+        with pytest.raises(DeliveryError) as info:
+            await send_with_retry(lambda: bot.send_message(1, "hi"), policy)
+        assert (info.value.category, info.value.attempts) == (TRANSIENT, 3)
+
+    asyncio.run(run())
+
+
+def test_retry_after_pauses_the_bucket_and_retries_take_tokens():
+    class CountingBucket(TokenBucket):
+        def __init__(self) -> None:
+            super().__init__(rate=1000.0)
+            self.acquired = 0
+            self.paused: list[float] = []
+
+        async def acquire(self) -> None:
+            self.acquired += 1
+            await super().acquire()
+
+        def pause(self, seconds: float) -> None:
+            self.paused.append(seconds)
+            super().pause(seconds)
+
+    policy = RetryPolicy(attempts=3, base_delay=0.0, jitter=0.0)
+    bucket = CountingBucket()
+    bot = ScriptedBot([RetryAfter(0), TimedOut()])
+
+    asyncio.run(send_with_retry(lambda: bot.send_message(1, "hi"), policy, bucket))
+    assert bot.sent == [1]
+    assert bucket.paused == [0.0]
+    assert bucket.acquired == 2
+
+
+def test_failed_sends_are_dead_lettered_and_replayed(tmp_path):
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    outbox = SheetsOutbox(store, sheets=None)
+    engine = BroadcastEngine(
+        rate_per_second=1000,
+        per_chat_interval=0,
+        retry_policy=RetryPolicy(attempts=2, base_delay=0.0),
+    )
+    bot = ScriptedBot([TimedOut(), TimedOut(), Forbidden("blocked")])
+    send = partial(send_6m_message, bot, store, outbox, "undelivered", engine=engine)
+
+    async def run() -> None:
+        zone = datetime.now().astimezone().tzinfo
+        assert await send("@anna", zone, 7) == "failed"
+        assert await send("boris", zone, 8) == "rejected"
+        assert await store.dead_letter_counts() == {TRANSIENT: 1, PERMANENT: 1}
+
+        stats = await replay_dead_letters(
+            bot, store, outbox, "undelivered", TZ, error_class=TRANSIENT, engine=engine
+        )
+        assert (stats.sent, stats.failed) == (1, 0)
+        assert bot.sent == [7]
+        assert await store.dead_letter_counts() == {PERMANENT: 1}
+
+    asyncio.run(run())
+
+
+def test_replay_settles_the_delivery_ledger(tmp_path):
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    outbox = SheetsOutbox(store, sheets=None)
+    engine = BroadcastEngine(
+        rate_per_second=1000,
+        per_chat_interval=0,
+        retry_policy=RetryPolicy(attempts=1, base_delay=0.0),
+    )
+    bot = ScriptedBot([TimedOut(), TimedOut()])
+    zone = ZoneInfo(TZ)
+    today = datetime.now(zone).date()
+    past = datetime.now(zone) - timedelta(hours=1)
+
+    async def run() -> None:
+        store.sync.claim_deliveries(today, [("@anna", "6m")], "daily", datetime.now(UTC), 3600)
+        send = partial(
+            send_6m_message,
+            bot,
+            store,
+            outbox,
+            "undelivered",
+            "@anna",
+            zone,
+            7,
+            ledger=(today, "6m"),
+            engine=engine,
+        )
+        assert not await deliver(store, today, "@anna", "6m", send)
+        await store.add_dead_letter(
+            "appointment", "@boris", 8, {"dt": past.isoformat()}, TRANSIENT, "x", 1, past
+        )
+
+        stats = await replay_dead_letters(bot, store, outbox, "undelivered", TZ, engine=engine)
+        assert (stats.total, stats.failed) == (1, 1)
+        assert await store.dead_letter_counts() == {TRANSIENT: 1}
+
+        stats = await replay_dead_letters(bot, store, outbox, "undelivered", TZ, engine=engine)
+        assert (stats.total, stats.sent) == (1, 1)
+        assert bot.sent == [7]
+        assert await store.dead_letter_counts() == {}
+        assert await store.delivery_status(today, "@anna", "6m") == "sent"
+
+    asyncio.run(run())
+    later = datetime.now(UTC) + timedelta(hours=2)
+    assert store.sync.claim_deliveries(today, [("@anna", "6m")], "rerun", later, 0) == []
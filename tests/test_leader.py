@@ -0,0 +1,41 @@
+import asyncio
+
+from app.leader import LeaderElection, LeaderLease
+
+
+def test_lease_is_exclusive_until_it_expires(tmp_path):
+    first = LeaderLease(str(tmp_path), ttl=10, holder="first")
+    second = LeaderLease(str(tmp_path), ttl=10, holder="second")
+
+    assert first.try_acquire(now=100)
+    assert not second.try_acquire(now=105)
+    assert first.try_acquire(now=108)
+    assert not second.try_acquire(now=115)
+    assert second.try_acquire(now=119)
+    assert not first.try_acquire(now=120)
+    assert second.current_holder(now=120) == "second"
+
+
+def test_election_hands_over_when_leader_stops(tmp_path):
+    events: list[str] = []
+
+    def election(holder: str) -> LeaderElection:
+        async def elected() -> None:
+            events.append(f"{holder} elected")
+
+        async def demoted() -> None:
+            events.append(f"{holder} demoted")
+
+        return LeaderElection(LeaderLease(str(tmp_path), holder=holder), elected, demoted)
+
+    async def run() -> None:
+        first, second = election("first"), election("second")
+        assert await first.step()
+        assert not await second.step()
+        assert await first.step()
+        await first.stop()
+        assert await second.step()
+        assert not await first.step()
+
+    asyncio.run(run())
+    assert events == ["first elected", "first demoted", "second elected"]
@@ -0,0 +1,50 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import BadRequest
+
+from app.messages import PhotoFileIdCache
+from app.storage import AsyncSQLiteStateStore, SQLiteStateStore
+
+
+class FakeBot:
+    def __init__(self) -> None:
+        self.uploads = 0
+        self.sent: list[object] = []
+        self.rejected: set[str] = set()
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        if isinstance(photo, str):
+            if photo in self.rejected:
+                raise BadRequest("Wrong file identifier/http url specified")
+            self.sent.append(photo)
+            return SimpleNamespace(photo=[SimpleNamespace(file_id=photo)])
+        self.uploads += 1
+        self.sent.append("upload")
+        file_id = f"file-{self.uploads}"
+        sizes = [SimpleNamespace(file_id=f"{file_id}-small"), SimpleNamespace(file_id=file_id)]
+        return SimpleNamespace(photo=sizes)
+
+
+def test_photo_is_uploaded_once_and_reused_across_restarts(tmp_path):
+    image = tmp_path / "logo.jpg"
+    image.write_bytes(b"logo-v1")
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    bot = FakeBot()
+
+    async def run() -> None:
+        cache = PhotoFileIdCache(store)
+        await cache.send_photo(bot, 1, image, caption="hi")
+        await cache.send_photo(bot, 2, image, caption="hi")
+        await PhotoFileIdCache(store).send_photo(bot, 3, image)
+
+        bot.rejected.add("file-1")
+        await cache.send_photo(bot, 4, image)
+        await cache.send_photo(bot, 5, image)
+
+        image.write_bytes(b"logo-v2-changed")
+        await cache.send_photo(bot, 6, image)
+
+    asyncio.run(run())
+    assert bot.sent == ["upload", "file-1", "file-1", "upload", "file-2", "upload"]
+    assert bot.uploads == 3
@@ -0,0 +1,68 @@
+import asyncio
+import os
+
+import pytest
+
+from app.metrics import (
+    HANDLER_ERRORS,
+    HANDLER_LATENCY,
+    Counter,
+    Gauge,
+    Histogram,
+    Registry,
+    timed_handler,
+)
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    latency = registry.register(
+        Histogram("demo_seconds", "Demo latency.", ["method"], buckets=(0.1, 1.0))
+    )
+    calls = registry.register(Counter("demo_calls_total", "Demo calls.", ["outcome"]))
+    depth = registry.register(Gauge("demo_depth", "Demo depth.", callback=lambda: 3))
+
+    latency.observe(0.05, method="get")
+    latency.observe(0.5, method="get")
+    latency.observe(5, method="get")
+    calls.inc(outcome='a"b')
+
+    lines = registry.render().splitlines()
+    assert "# TYPE demo_seconds histogram" in lines
+    assert 'demo_seconds_bucket{method="get",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{method="get",le="1"} 2' in lines
+    assert 'demo_seconds_bucket{method="get",le="+Inf"} 3' in lines
+    assert 'demo_seconds_sum{method="get"} 5.55' in lines
+    assert 'demo_seconds_count{method="get"} 3' in lines
+    assert 'demo_calls_total{outcome="a\\"b"} 1' in lines
+    assert "demo_depth 3" in lines
+    assert depth.kind == "gauge"
+
+
+def test_worker_registry_labels_samples_with_the_pid():
+    registry = Registry(worker_label="worker")
+    latency = registry.register(Histogram("demo_seconds", "Demo latency.", buckets=(1.0,)))
+    depth = registry.register(Gauge("demo_depth", "Demo depth.", callback=lambda: 3))
+    latency.observe(0.5)
+
+    lines = registry.render().splitlines()
+    worker = f'worker="{os.getpid()}"'
+    assert f'demo_seconds_bucket{{{worker},le="1"}} 1' in lines
+    assert f"demo_seconds_count{{{worker}}} 1" in lines
+    assert f"demo_depth{{{worker}}} 3" in lines
+    assert depth.kind == "gauge"
+
+
+def test_timed_handler_records_latency_and_errors():
+    async def sample_handler(update, context):
+        if update:
+            raise RuntimeError("boom")
+
+    wrapped = timed_handler(sample_handler)
+    asyncio.run(wrapped(None, None))
+    with pytest.raises(RuntimeError):
+        asyncio.run(wrapped(True, None))
+
+    assert wrapped.__name__ == "sample_handler"
+    assert HANDLER_LATENCY.count(handler="sample_handler") == 2
+    assert HANDLER_ERRORS.value(handler="sample_handler") == 1
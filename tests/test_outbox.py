@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from app.outbox import SheetsOutbox
+from app.storage import AsyncSQLiteStateStore, SQLiteStateStore
+
+NOW = datetime(2026, 2, 11, 10, 0, 0, tzinfo=ZoneInfo("Asia/Novosibirsk"))
+
+
+class FakeSheets:
+    def __init__(self, failing: set[str] | None = None) -> None:
+        self.failing = failing or set()
+        self.calls: list[tuple[str, list[list[str]]]] = []
+
+    async def append_rows(self, tab_name, rows):
+        if tab_name in self.failing:
+            raise RuntimeError("quota exceeded")
+        self.calls.append((tab_name, rows))
+
+
+def _store(path) -> AsyncSQLiteStateStore:
+    return AsyncSQLiteStateStore(SQLiteStateStore(str(path)))
+
+
+def test_outbox_flushes_in_order_per_tab_in_batches(tmp_path):
+    sheets = FakeSheets()
+    outbox = SheetsOutbox(_store(tmp_path), sheets, batch_size=2)
+
+    async def run() -> None:
+        for index in range(3):
+            await outbox.enqueue("comments", [str(index)], NOW)
+        await outbox.enqueue("undelivered", ["x"], NOW)
+
+        assert (await outbox.stats())["queue_depth"] == 4
+        assert await outbox.flush() == (4, 0)
+        assert (await outbox.stats())["queue_depth"] == 0
+
+    asyncio.run(run())
+    assert sheets.calls == [
+        ("comments", [["0"], ["1"]]),
+        ("comments", [["2"]]),
+        ("undelivered", [["x"]]),
+    ]
+
+
+def test_failed_tab_is_kept_for_next_flush_and_survives_restart(tmp_path):
+    outbox = SheetsOutbox(_store(tmp_path), FakeSheets(failing={"comments"}))
+    sheets = FakeSheets()
+    restarted = SheetsOutbox(_store(tmp_path), sheets)
+
+    async def run() -> None:
+        await outbox.enqueue("comments", ["first"], NOW)
+        await outbox.enqueue("undelivered", ["x"], NOW)
+        await outbox.enqueue("comments", ["second"], NOW)
+
+        assert await outbox.flush() == (1, 1)
+        stats = await outbox.stats()
+        assert stats["queue_depth"] == 2
+        assert stats["flush_lag_seconds"] > 0
+
+        assert await restarted.flush() == (2, 0)
+
+    asyncio.run(run())
+    assert sheets.calls == [("comments", [["first"], ["second"]])]
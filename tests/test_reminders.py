@@ -0,0 +1,127 @@
+import asyncio
+from datetime import UTC, date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from app.broadcast import BroadcastEngine
+from app.outbox import SheetsOutbox
+from app.reminders import ExactAppointmentReminders, TimerHeap
+from app.sheets import SheetEntry
+from app.storage import AsyncSQLiteStateStore, SQLiteStateStore
+
+TZ = "Asia/Novosibirsk"
+
+
+class FakeMirror:
+    def __init__(self, entries: list[SheetEntry]) -> None:
+        self.entries = entries
+
+    async def refresh(self) -> int:
+        return 0
+
+    async def entries_on(self, dates) -> list[SheetEntry]:
+        wanted = set(dates)
+        return [entry for entry in self.entries if entry.dt.date() in wanted]
+
+
+class RecordingBot:
+    def __init__(self) -> None:
+        self.sent: list[tuple[int, str]] = []
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        self.sent.append((chat_id, text))
+
+
+def test_timer_heap_orders_reschedules_and_cancels():
+    timers = TimerHeap()
+    timers.push("a", 30.0, "first")
+    timers.push("b", 10.0, "second")
+    timers.push("c", 20.0, "third")
+    timers.push("a", 5.0, "moved")
+    timers.discard("c")
+
+    assert len(timers) == 2
+    assert timers.next_deadline() == 5.0
+    assert timers.pop_due(4.0) == []
+    assert timers.pop_due(15.0) == [("a", "moved"), ("b", "second")]
+    assert timers.next_deadline() is None
+    assert timers.pop_due(100.0) == []
+
+
+def test_exact_reminders_fire_offset_before_each_appointment(tmp_path):
+    zone = ZoneInfo(TZ)
+    now = datetime(2026, 3, 10, 8, 0, tzinfo=zone)
+    mirror = FakeMirror(
+        [
+            SheetEntry(dt=datetime(2026, 3, 10, 9, 30), username="@anna"),
+            SheetEntry(dt=datetime(2026, 3, 10, 14, 0), username="boris"),
+            SheetEntry(dt=datetime(2026, 3, 10, 7, 0), username="@past"),
+            SheetEntry(dt=datetime(2026, 3, 12, 10, 0), username="@later"),
+        ]
+    )
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    store.sync.upsert_user("anna", 1, datetime.now(UTC))
+    store.sync.upsert_user("boris", 2, datetime.now(UTC))
+    bot = RecordingBot()
+    reminders = ExactAppointmentReminders(
+        bot,
+        mirror,
+        store,
+        SheetsOutbox(store, sheets=None),
+        "undelivered",
+        TZ,
+        timedelta(hours=2),
+        BroadcastEngine(rate_per_second=1000, per_chat_interval=0),
+    )
+
+    async def run() -> list[int]:
+        fired = [await reminders.reload(now)]
+        fired.append(await reminders.fire_due(now.timestamp()))
+        fired.append(await reminders.reload(now + timedelta(hours=3, minutes=50)))
+        fired.append(await reminders.fire_due((now + timedelta(hours=3, minutes=55)).timestamp()))
+        fired.append(await reminders.fire_due((now + timedelta(hours=4)).timestamp()))
+        fired.append(await reminders.reload(now + timedelta(hours=4, minutes=1)))
+        return fired
+
+    assert asyncio.run(run()) == [1, 1, 1, 0, 1, 0]
+    assert [chat_id for chat_id, _ in bot.sent] == [1, 2]
+    assert store.sync.delivery_counts(date(2026, 3, 10)) == {"sent": 2}
+
+
+def test_exact_reminders_keep_same_day_appointments_and_date_only_rows(tmp_path):
+    zone = ZoneInfo(TZ)
+    now = datetime(2026, 3, 10, 8, 0, tzinfo=zone)
+    mirror = FakeMirror(
+        [
+            SheetEntry(dt=datetime(2026, 3, 10, 10, 0), username="@anna"),
+            SheetEntry(dt=datetime(2026, 3, 10, 15, 0), username="@anna"),
+            SheetEntry(dt=datetime(2026, 3, 11), username="boris"),
+        ]
+    )
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    store.sync.upsert_user("anna", 1, datetime.now(UTC))
+    store.sync.upsert_user("boris", 2, datetime.now(UTC))
+    bot = RecordingBot()
+    reminders = ExactAppointmentReminders(
+        bot,
+        mirror,
+        store,
+        SheetsOutbox(store, sheets=None),
+        "undelivered",
+        TZ,
+        timedelta(hours=2),
+        BroadcastEngine(rate_per_second=1000, per_chat_interval=0),
+        daily_hour=9,
+    )
+
+    async def run() -> list[int]:
+        await reminders.reload(now)
+        fired = [await reminders.fire_due(now.timestamp())]
+        fired.append(await reminders.fire_due((now + timedelta(minutes=59)).timestamp()))
+        fired.append(await reminders.fire_due((now + timedelta(hours=1)).timestamp()))
+        await reminders.reload(now + timedelta(hours=4, minutes=59))
+        fired.append(await reminders.fire_due((now + timedelta(hours=5)).timestamp()))
+        return fired
+
+    assert asyncio.run(run()) == [1, 0, 1, 1]
+    assert [chat_id for chat_id, _ in bot.sent] == [1, 2, 1]
+    assert store.sync.delivery_counts(date(2026, 3, 10)) == {"sent": 3}
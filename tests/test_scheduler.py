@@ -0,0 +1,307 @@
+import asyncio
+from datetime import UTC, date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from telegram.error import TimedOut
+
+from app.appointments import reminder_fire_dates
+from app.broadcast import BroadcastEngine, RetryPolicy
+from app.outbox import SheetsOutbox
+from app.scheduler import (
+    PERSISTENT_JOBSTORE,
+    build_scheduler,
+    catch_up_daily_messages,
+    schedule_2w_reminder,
+    schedule_start_followup,
+    send_daily_messages,
+    shard_of,
+    stop_daily_runs,
+)
+from app.sheets import SheetEntry
+from app.storage import AsyncSQLiteStateStore, Reminder, SQLiteStateStore
+
+TZ = "Asia/Novosibirsk"
+
+
+def test_user_jobs_survive_scheduler_restart(tmp_path):
+    run_date = datetime.now(ZoneInfo(TZ)) + timedelta(days=3)
+
+    async def schedule() -> None:
+        scheduler = build_scheduler(str(tmp_path), TZ)
+        scheduler.start(paused=True)
+        schedule_start_followup(scheduler, 1, 100, run_date)
+        schedule_2w_reminder(scheduler, 100, run_date)
+        schedule_2w_reminder(scheduler, 100, run_date + timedelta(days=1))
+        scheduler.shutdown(wait=False)
+
+    async def reload() -> list:
+        scheduler = build_scheduler(str(tmp_path), TZ)
+        scheduler.start(paused=True)
+        jobs = scheduler.get_jobs(jobstore=PERSISTENT_JOBSTORE)
+        scheduler.shutdown(wait=False)
+        return jobs
+
+    asyncio.run(schedule())
+    jobs = {job.id: job for job in asyncio.run(reload())}
+
+    assert set(jobs) == {"start_followup_1", "remind_100"}
+    assert jobs["start_followup_1"].args == (100,)
+    assert jobs["remind_100"].next_run_time == run_date + timedelta(days=1)
+
+
+class FakeMirror:
+    def __init__(self, entries: list[SheetEntry]) -> None:
+        self.entries = entries
+
+    async def refresh(self) -> int:
+        return 0
+
+    async def due_between(self, since: date, until: date) -> list[Reminder]:
+        return [
+            Reminder(row_index, kind, day, entry.dt, entry.username)
+            for row_index, entry in enumerate(self.entries)
+            for kind, day in reminder_fire_dates(entry.dt.date())
+            if since <= day <= until
+        ]
+
+
+class FlakyBot:
+    def __init__(self, failing: set[int]) -> None:
+        self.failing = failing
+        self.sent: list[int] = []
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        if chat_id in self.failing:
+            raise TimedOut()
+        self.sent.append(chat_id)
+
+
+def test_daily_run_resends_only_missing_deliveries(tmp_path):
+    tomorrow = datetime.now(ZoneInfo(TZ)).replace(hour=10, minute=0) + timedelta(days=1)
+    mirror = FakeMirror(
+        [
+            SheetEntry(dt=tomorrow.replace(tzinfo=None), username="@anna"),
+            SheetEntry(dt=tomorrow.replace(tzinfo=None), username="boris"),
+            SheetEntry(dt=tomorrow.replace(tzinfo=None), username="@anna"),
+        ]
+    )
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    store.sync.upsert_user("anna", 1, datetime.now(UTC))
+    store.sync.upsert_user("boris", 2, datetime.now(UTC))
+    outbox = SheetsOutbox(store, sheets=None)
+    engine = BroadcastEngine(
+        rate_per_second=1000,
+        per_chat_interval=0,
+        retry_policy=RetryPolicy(attempts=2, base_delay=0.0),
+    )
+    bot = FlakyBot(failing={2})
+
+    async def run() -> list[int]:
+        totals = []
+        for _ in range(2):
+            stats = await send_daily_messages(bot, mirror, "undelivered", TZ, store, outbox, engine)
+            totals.append(stats.total)
+            bot.failing.clear()
+        stats = await send_daily_messages(bot, mirror, "undelivered", TZ, store, outbox, engine)
+        totals.append(stats.total)
+        return totals
+
+    assert asyncio.run(run()) == [2, 1, 0]
+    assert bot.sent == [1, 2]
+    today = datetime.now(ZoneInfo(TZ)).date()
+    assert store.sync.delivery_counts(today) == {"sent": 2}
+
+
+def test_daily_run_catches_up_missed_reminders(tmp_path):
+    today = datetime.now(ZoneInfo(TZ)).date()
+    yesterday = today - timedelta(days=1)
+    mirror = FakeMirror(
+        [
+            SheetEntry(dt=datetime.combine(today, datetime.min.time()), username="@anna"),
+            SheetEntry(
+                dt=datetime.combine(yesterday, datetime.min.time()).replace(hour=12),
+                username="boris",
+            ),
+        ]
+    )
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    store.sync.upsert_user("anna", 1, datetime.now(UTC))
+    store.sync.upsert_user("boris", 2, datetime.now(UTC))
+    outbox = SheetsOutbox(store, sheets=None)
+    engine = BroadcastEngine(rate_per_second=1000, per_chat_interval=0)
+    bot = FlakyBot(failing=set())
+
+    async def run() -> list[int]:
+        totals = []
+        for earlier_run in (None, yesterday, None):
+            if earlier_run is not None:
+                await store.start_daily_shard(earlier_run, 0, 1, datetime.now(UTC))
+            stats = await send_daily_messages(
+                bot, mirror, "undelivered", TZ, store, outbox, engine, catch_up_days=3
+            )
+            totals.append(stats.total)
+        return totals
+
+    assert asyncio.run(run()) == [0, 1, 0]
+    assert bot.sent == [1]
+    assert store.sync.delivery_counts(yesterday) == {"sent": 1}
+
+
+def test_fresh_claims_are_not_taken_by_a_concurrent_run(tmp_path):
+    store = SQLiteStateStore(str(tmp_path))
+    day = date(2026, 3, 1)
+    now = datetime(2026, 3, 1, 9, 0, tzinfo=UTC)
+    keys = [("@anna", "appointment"), ("@anna", "6m")]
+
+    assert store.claim_deliveries(day, keys, "first", now, 600) == keys
+    assert store.claim_deliveries(day, keys, "second", now, 600) == []
+    store.mark_delivery(day, "@anna", "6m", "sent", now)
+
+    later = now + timedelta(minutes=11)
+    assert store.claim_deliveries(day, keys, "third", later, 600) == [keys[0]]
+
+
+def test_rejected_deliveries_are_not_reclaimed(tmp_path):
+    store = SQLiteStateStore(str(tmp_path))
+    day = date(2026, 3, 1)
+    now = datetime(2026, 3, 1, 9, 0, tzinfo=UTC)
+    keys = [("@anna", "6m"), ("@boris", "6m")]
+
+    assert store.claim_deliveries(day, keys, "first", now, 600) == keys
+    store.mark_delivery(day, "@anna", "6m", "failed", now)
+    store.mark_delivery(day, "@boris", "6m", "rejected", now)
+    assert store.claim_deliveries(day, keys, "second", now, 600) == [keys[0]]
+
+
+def test_catch_up_runs_only_unfinished_days(tmp_path):
+    tomorrow = datetime.now(ZoneInfo(TZ)).replace(hour=10, minute=0) + timedelta(days=1)
+    mirror = FakeMirror(
+        [
+            SheetEntry(dt=tomorrow.replace(tzinfo=None), username="@anna"),
+            SheetEntry(dt=tomorrow.replace(tzinfo=None), username="@boris"),
+        ]
+    )
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    store.sync.upsert_user("anna", 1, datetime.now(UTC))
+    store.sync.upsert_user("boris", 2, datetime.now(UTC))
+    outbox = SheetsOutbox(store, sheets=None)
+    engine = BroadcastEngine(rate_per_second=1000, per_chat_interval=0)
+    bot = FlakyBot(failing=set())
+    today = datetime.now(ZoneInfo(TZ)).date()
+    store.sync.claim_deliveries(
+        today, [("@anna", "appointment")], "still sending", datetime.now(UTC), 3600
+    )
+
+    async def run(hour: int, minute: int):
+        return await catch_up_daily_messages(
+            bot, mirror, "undelivered", TZ, hour, minute, store, outbox, engine
+        )
+
+    now = datetime.now(ZoneInfo(TZ))
+    if (now.hour, now.minute) < (23, 59):
+        assert asyncio.run(run(23, 59)) is None
+    assert asyncio.run(run(0, 0)).sent == 1
+    assert asyncio.run(run(0, 0)) is None
+    assert bot.sent == [2]
+
+
+def test_stopped_daily_run_releases_its_claims(tmp_path):
+    tomorrow = datetime.now(ZoneInfo(TZ)).replace(hour=10, minute=0) + timedelta(days=1)
+    mirror = FakeMirror([SheetEntry(dt=tomorrow.replace(tzinfo=None), username="@anna")])
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    store.sync.upsert_user("anna", 1, datetime.now(UTC))
+    outbox = SheetsOutbox(store, sheets=None)
+    engine = BroadcastEngine(rate_per_second=1000, per_chat_interval=0)
+    today = datetime.now(ZoneInfo(TZ)).date()
+
+    class StuckBot:
+        def __init__(self) -> None:
+            self.sending = asyncio.Event()
+
+        async def send_message(self, chat_id, text, reply_markup=None):
+            self.sending.set()
+            await asyncio.Event().wait()
+
+    async def run() -> None:
+        bot = StuckBot()
+        task = asyncio.create_task(
+            send_daily_messages(bot, mirror, "undelivered", TZ, store, outbox, engine)
+        )
+        await bot.sending.wait()
+        await stop_daily_runs()
+        assert task.cancelled()
+
+    asyncio.run(run())
+    later = datetime.now(UTC) + timedelta(seconds=1)
+    keys = [("@anna", "appointment")]
+    assert store.sync.claim_deliveries(today, keys, "next", later, 3600) == keys
+    assert [shard.status for shard in store.sync.list_daily_shards(today)] == ["failed"]
+
+
+def test_failed_shard_can_be_retried_alone(tmp_path):
+    tomorrow = datetime.now(ZoneInfo(TZ)).replace(hour=10, minute=0) + timedelta(days=1)
+    usernames = [f"user{index}" for index in range(12)]
+    mirror = FakeMirror(
+        [SheetEntry(dt=tomorrow.replace(tzinfo=None), username=name) for name in usernames]
+    )
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    for chat_id, username in enumerate(usernames, start=1):
+        store.sync.upsert_user(username, chat_id, datetime.now(UTC))
+    outbox = SheetsOutbox(store, sheets=None)
+    engine = BroadcastEngine(
+        rate_per_second=1000,
+        per_chat_interval=0,
+        retry_policy=RetryPolicy(attempts=2, base_delay=0.0),
+    )
+    broken_shard = shard_of("@user0", 3)
+    bot = FlakyBot(failing={1})
+    today = datetime.now(ZoneInfo(TZ)).date()
+
+    async def run() -> tuple[int, int]:
+        first = await send_daily_messages(
+            bot, mirror, "undelivered", TZ, store, outbox, engine, shards=3
+        )
+        bot.failing.clear()
+        retry = await send_daily_messages(
+            bot, mirror, "undelivered", TZ, store, outbox, engine, 3, only_shards=[broken_shard]
+        )
+        return first.sent, retry.total
+
+    assert asyncio.run(run()) == (11, 1)
+    assert sorted(bot.sent) == list(range(1, 13))
+    shards = store.sync.list_daily_shards(today)
+    assert [shard.shard for shard in shards] == [0, 1, 2]
+    assert all(shard.status == "done" for shard in shards)
+    assert all(shard.sent == shard.total and shard.failed == 0 for shard in shards)
+    assert sum(shard.total for shard in shards) == 12
+
+
+def test_shard_counts_follow_the_ledger(tmp_path):
+    store = SQLiteStateStore(str(tmp_path))
+    day = date(2026, 3, 1)
+    now = datetime(2026, 3, 1, 9, 0, tzinfo=UTC)
+    keys = [("@anna", "6m"), ("@boris", "6m"), ("@vera", "6m")]
+
+    store.start_daily_shard(day, 0, 1, now)
+    store.claim_deliveries(day, keys, "first", now, 600, 0)
+    store.mark_delivery(day, "@anna", "6m", "sent", now)
+    store.mark_delivery(day, "@boris", "6m", "failed", now)
+    store.finish_daily_shard(day, 0, now, crashed=True)
+    [shard] = store.list_daily_shards(day)
+    assert (shard.status, shard.total, shard.sent, shard.failed) == ("failed", 3, 1, 1)
+
+    store.start_daily_shard(day, 0, 1, now)
+    later = now + timedelta(minutes=1)
+    assert store.claim_deliveries(day, keys, "retry", later, 0, 0) == keys[1:]
+    store.mark_delivery(day, "@boris", "6m", "sent", now)
+    store.mark_delivery(day, "@vera", "6m", "rejected", now)
+    store.finish_daily_shard(day, 0, now)
+    [shard] = store.list_daily_shards(day)
+    assert (shard.status, shard.total, shard.sent, shard.failed) == ("done", 3, 2, 1)
+
+
+def test_engine_shards_split_the_rate_budget():
+    engine = BroadcastEngine(rate_per_second=30, concurrency=16)
+    shard = engine.shard(3)
+    assert shard._rate_per_second == 10
+    assert shard._concurrency == 5
@@ -1,4 +1,13 @@
-﻿from app.sheets import _parse_datetime
+﻿import asyncio
+import itertools
+import threading
+from datetime import datetime
+
+import gspread
+import pytest
+from gspread.exceptions import APIError
+
+from app.sheets import AsyncSheetsClient, SheetsClient, _parse_datetime
 
 
 def test_parse_datetime_with_time():
@@ -10,4 +19,156 @@ def test_parse_datetime_with_time():
 def test_parse_datetime_with_date_only():
     dt = _parse_datetime("03.02.2026")
     assert dt is not None
-    assert dt.strftime("%d.%m.%Y") == "03.02.2026"
\ No newline at end of file
+    assert dt.strftime("%d.%m.%Y") == "03.02.2026"
+
+
+def _parse_datetime_strptime(value: str) -> datetime | None:
+    for fmt in ("%d.%m.%Y %H:%M", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def test_parse_datetime_matches_strptime_formats():
+    days = ["0", "1", "01", "9", "28", "29", "30", "31", "32", " 1"]
+    months = ["0", "1", "02", "2", "12", "13"]
+    years = ["2024", "2026", "0000", "226", "20266"]
+    times = ["", " 18:00", " 7:5", " 23:59", " 24:00", " 18:60", " 18:00:59", " 18:00:60"]
+    times += ["  18:00", "\t18:00", " 18:00:", "18:00", " 18", " 1:00:00:00"]
+    times += ["\xa018:00", "\u200318:00"]
+    for value in (
+        f"{day}.{month}.{year}{time}"
+        for day, month, year, time in itertools.product(days, months, years, times)
+    ):
+        assert _parse_datetime(value) == _parse_datetime_strptime(value), value
+
+    assert _parse_datetime("") is None
+    assert _parse_datetime("завтра") is None
+    assert _parse_datetime("05.03.2026\xa010:00") == datetime(2026, 3, 5, 10, 0)
+    assert _parse_datetime("٠٥.03.2026") is None
+
+
+def test_async_client_times_out_without_blocking_the_loop():
+    release = threading.Event()
+
+    class SlowClient:
+        def append_comment(self, tab_name, row):
+            release.wait(5)
+
+    async def run() -> tuple[bool, int]:
+        sheets = AsyncSheetsClient(SlowClient(), max_workers=1, timeout=0.05)
+        ticks = 0
+
+        async def ticker() -> None:
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        task = asyncio.create_task(ticker())
+        try:
+            await sheets.append_comment("tab", ["row"])
+            timed_out = False
+        except TimeoutError:
+            timed_out = True
+        task.cancel()
+        release.set()
+        sheets.shutdown()
+        return timed_out, ticks
+
+    timed_out, ticks = asyncio.run(run())
+    assert timed_out
+    assert ticks > 1
+
+
+class _FakeResponse:
+    def __init__(self, code: int, message: str) -> None:
+        self._payload = {"error": {"code": code, "message": message}}
+        self.text = message
+
+    def json(self):
+        return self._payload
+
+
+class _FakeWorksheet:
+    def __init__(self, stale: bool = False) -> None:
+        self.stale = stale
+        self.rows: list[list[str]] = []
+
+    def append_row(self, row, value_input_option=None):
+        if self.stale:
+            raise APIError(_FakeResponse(400, "Unable to parse range: 'old'!A1"))
+        self.rows.append(row)
+
+
+class _FakeSpreadsheet:
+    def __init__(self) -> None:
+        self.lookups = 0
+        self.current = _FakeWorksheet()
+
+    def worksheet(self, tab_name):
+        self.lookups += 1
+        return self.current
+
+
+def _make_client(monkeypatch, spreadsheet, ttl=600.0) -> SheetsClient:
+    class FakeGC:
+        def open_by_key(self, sheet_id):
+            return spreadsheet
+
+    monkeypatch.setattr(gspread, "service_account", lambda filename: FakeGC())
+    return SheetsClient("sheet", "sa.json", worksheet_ttl=ttl)
+
+
+def test_worksheet_handles_are_cached(monkeypatch):
+    spreadsheet = _FakeSpreadsheet()
+    client = _make_client(monkeypatch, spreadsheet)
+
+    client.append_comment("tab", ["a"])
+    client.append_undelivered("tab", ["b"])
+
+    assert spreadsheet.lookups == 1
+    assert spreadsheet.current.rows == [["a"], ["b"]]
+
+
+def test_stale_worksheet_is_refetched_once(monkeypatch):
+    spreadsheet = _FakeSpreadsheet()
+    client = _make_client(monkeypatch, spreadsheet)
+    client.append_comment("tab", ["a"])
+
+    spreadsheet.current.stale = True
+    spreadsheet.current = _FakeWorksheet()
+    client.append_comment("tab", ["b"])
+
+    assert spreadsheet.lookups == 2
+    assert spreadsheet.current.rows == [["b"]]
+
+
+def test_async_client_connects_lazily_once():
+    calls = []
+
+    class Client:
+        def get_values(self, tab_name, range_name):
+            return [[tab_name, range_name]]
+
+    def factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("google is down")
+        threading.Event().wait(0.02)
+        return Client()
+
+    async def run() -> list:
+        sheets = AsyncSheetsClient(factory=factory, max_workers=2)
+        assert not sheets.ready
+        with pytest.raises(ConnectionError):
+            await sheets.connect()
+        results = await asyncio.gather(*(sheets.get_values("tab", "A2:B") for _ in range(5)))
+        assert sheets.ready
+        sheets.shutdown()
+        return results
+
+    assert asyncio.run(run()) == [[["tab", "A2:B"]]] * 5
+    assert len(calls) == 2
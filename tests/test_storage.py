@@ -1,6 +1,8 @@
+import asyncio
+import threading
 from datetime import datetime
 
-from app.storage import SQLiteStateStore
+from app.storage import AsyncSQLiteStateStore, SQLiteStateStore, UserStateCache
 
 
 def test_client_usernames_are_tracked_as_latest(tmp_path):
@@ -27,3 +29,117 @@ def test_activation_is_marked_once(tmp_path):
 
     assert store.mark_activated(42, now) is True
     assert store.mark_activated(42, now) is False
+
+
+def test_user_cache_skips_writes_for_unchanged_users(tmp_path):
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    cache = UserStateCache(store, maxsize=2, touch_batch_size=2)
+    now = datetime(2026, 2, 11, 10, 0, 0)
+    later = datetime(2026, 2, 11, 11, 0, 0)
+    writes: list[str] = []
+
+    async def upsert_user(*args) -> None:
+        writes.append("user")
+
+    async def upsert_client(*args) -> bool:
+        writes.append("client")
+        return True
+
+    async def run() -> None:
+        assert await cache.record(1, "Anna", 1, now) is True
+        store.upsert_user = upsert_user
+        store.upsert_client = upsert_client
+
+        assert await cache.record(1, "@anna", 1, later) is False
+        assert writes == []
+        assert await cache.record(1, "Anya", 1, later) is True
+        assert writes == ["user", "client"]
+        assert await cache.record(2, None, 2, now) is False
+
+    asyncio.run(run())
+
+
+def test_user_cache_rewrites_users_changed_by_another_worker(tmp_path):
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    first = UserStateCache(store)
+    second = UserStateCache(store)
+    now = datetime(2026, 2, 11, 10, 0, 0)
+
+    async def run() -> None:
+        await first.record(1, "anna", 1, now)
+        await second.record(1, "anya", 1, now)
+        assert await first.record(1, "anna", 1, now) is False
+        await first.flush(now)
+        assert await first.record(1, "anna", 1, now) is True
+
+    asyncio.run(run())
+    assert store.sync.list_client_usernames() == ["@anna"]
+
+
+def test_user_cache_refreshes_updated_at_in_batches(tmp_path):
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    cache = UserStateCache(store, touch_batch_size=2)
+    now = datetime(2026, 2, 11, 10, 0, 0)
+    later = datetime(2026, 2, 11, 11, 0, 0)
+
+    def stamps() -> dict[str, str]:
+        with store.sync._connect() as conn:
+            return dict(conn.execute("SELECT username, updated_at FROM user_map"))
+
+    async def run() -> None:
+        await cache.record(1, "anna", 1, now)
+        await cache.record(2, "boris", 2, now)
+
+        await cache.record(1, "anna", 1, later)
+        assert stamps()["@anna"] == now.isoformat()
+
+        await cache.record(2, "boris", 2, later)
+        assert stamps() == {"@anna": later.isoformat(), "@boris": later.isoformat()}
+
+    asyncio.run(run())
+
+
+def test_store_reuses_one_wal_connection_per_thread(tmp_path):
+    store = SQLiteStateStore(str(tmp_path))
+    conn = store._connect()
+
+    assert store._connect() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    other: list = []
+    thread = threading.Thread(target=lambda: other.append(store._connect()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+    store.close()
+    assert store._connect() is not conn
+
+
+def test_async_store_serializes_writes_on_one_thread(tmp_path):
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+    now = datetime(2026, 2, 11, 10, 0, 0)
+
+    async def run() -> tuple[list[bool], int | None]:
+        activated = await asyncio.gather(*(store.mark_activated(7, now) for _ in range(20)))
+        await store.upsert_user("anna", 1, now)
+        return activated, await store.get_chat_id("@Anna")
+
+    activated, chat_id = asyncio.run(run())
+    store.close()
+
+    assert activated.count(True) == 1
+    assert chat_id == 1
+
+
+def test_get_chat_ids_resolves_normalized_usernames_in_bulk(tmp_path):
+    store = SQLiteStateStore(str(tmp_path))
+    now = datetime(2026, 2, 11, 10, 0, 0)
+    store.upsert_user("Anna", 1, now)
+    store.upsert_user("@boris", 2, now)
+
+    assert store.get_chat_ids(["@ANNA", " boris ", "anna", "nobody", ""]) == {
+        "@anna": 1,
+        "@boris": 2,
+    }
+    assert store.get_chat_ids([]) == {}
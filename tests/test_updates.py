@@ -0,0 +1,108 @@
+import asyncio
+
+from telegram import Update
+
+from app.storage import AsyncSQLiteStateStore, SQLiteStateStore
+from app.updates import UpdateDeduplicator, UpdateQueue
+
+
+def _update(update_id: int, chat_id: int) -> Update:
+    return Update.de_json(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": chat_id, "type": "private"},
+                "text": "hi",
+            },
+        },
+        None,
+    )
+
+
+def test_updates_are_processed_in_order_per_chat():
+    processed: list[tuple[int, int]] = []
+
+    async def process(update: Update) -> None:
+        await asyncio.sleep(0.001 * (update.update_id % 3))
+        processed.append((update.effective_chat.id, update.update_id))
+
+    async def run() -> dict:
+        queue = UpdateQueue(process, maxsize=100, workers=4)
+        queue.start()
+        for update_id in range(40):
+            assert await queue.submit(_update(update_id, chat_id=update_id % 5))
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    for chat_id in range(5):
+        ids = [update_id for chat, update_id in processed if chat == chat_id]
+        assert ids == sorted(ids)
+    assert stats["processed_total"] == 40
+    assert stats["queue_depth"] == 0
+
+
+def test_full_queue_rejects_instead_of_blocking():
+    async def run() -> dict:
+        gate = asyncio.Event()
+
+        async def process(update: Update) -> None:
+            await gate.wait()
+
+        queue = UpdateQueue(process, maxsize=2, workers=1, put_timeout=0.01)
+        queue.start()
+        results = [await queue.submit(_update(update_id, 1)) for update_id in range(5)]
+        assert results == [True, True, True, False, False]
+        gate.set()
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert stats["accepted_total"] == 3
+    assert stats["rejected_total"] == 2
+    assert stats["processed_total"] == 3
+
+
+def test_dedup_window_is_bounded_and_survives_restart(tmp_path):
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+
+    async def run() -> None:
+        dedup = UpdateDeduplicator(store, capacity=3)
+        assert [await dedup.claim(update_id) for update_id in (1, 2, 1, 3, 4)] == [
+            True,
+            True,
+            False,
+            True,
+            True,
+        ]
+        assert not await dedup.claim(1)
+        await dedup.stop()
+
+        restarted = UpdateDeduplicator(store, capacity=3)
+        await restarted.load()
+        assert [await restarted.claim(update_id) for update_id in (2, 3, 4, 1)] == [
+            False,
+            False,
+            False,
+            True,
+        ]
+
+        await dedup.release(5)
+        assert await dedup.claim(5)
+        await dedup.release(5)
+        assert await dedup.claim(5)
+
+    asyncio.run(run())
+
+
+def test_dedup_is_shared_between_workers(tmp_path):
+    store = AsyncSQLiteStateStore(SQLiteStateStore(str(tmp_path)))
+
+    async def run() -> list[bool]:
+        first = UpdateDeduplicator(store)
+        second = UpdateDeduplicator(store)
+        return [await first.claim(7), await second.claim(7), await second.claim(8)]
+
+    assert asyncio.run(run()) == [True, False, True]